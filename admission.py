@@ -0,0 +1,170 @@
+# admission.py - Контроль нагрузки и сброс второстепенной работы при перегрузке
+import os
+import time
+import asyncio
+import logging
+import functools
+from collections import Counter, deque
+from telegram.ext import SimpleUpdateProcessor
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_MAX_LOAD = int(os.environ.get('ADMISSION_MAX_LOAD', 50))
+ADMISSION_MAX_LATENCY = float(os.environ.get('ADMISSION_MAX_LATENCY_MS', 2000)) / 1000
+# Выход из режима перегрузки - только когда показатели упали ниже 80% порога
+ADMISSION_RECOVERY_RATIO = 0.8
+# Замер задержки старше этого считается устаревшим (нет свежих данных - нет перегрузки)
+LATENCY_SAMPLE_TTL = 30
+LATENCY_EWMA_ALPHA = 0.2
+DEFERRED_QUEUE_SIZE = 10000
+DEFERRED_BATCH_SIZE = 100
+DEFERRED_INTERVAL = 0.5
+
+class AdmissionController:
+    """
+    Следит за числом апдейтов в работе (и в очереди) и за задержками БД/Bot API.
+    При превышении порогов включает режим перегрузки с гистерезисом.
+    """
+
+    def __init__(self, max_load=ADMISSION_MAX_LOAD, max_latency=ADMISSION_MAX_LATENCY):
+        self.max_load = max_load
+        self.max_latency = max_latency
+        # pending - апдейты, переданные обработчику и ещё не завершённые: ждут слот, очередь
+        # своего пользователя или выполняются; in_flight - только выполняющиеся
+        self.pending = 0
+        self.in_flight = 0
+        self.backlog = lambda: 0
+        self._latency = {}
+        self._overloaded = False
+        self.shed_counts = Counter()
+        self._deferred = deque(maxlen=DEFERRED_QUEUE_SIZE)
+        self.deferred_dropped = 0
+
+    def record(self, kind, seconds):
+        """Обновляет экспоненциальное среднее задержки для 'db', 'api' или 'update'."""
+        previous = self._latency.get(kind)
+        value = seconds if previous is None else previous[0] + LATENCY_EWMA_ALPHA * (seconds - previous[0])
+        self._latency[kind] = (value, time.monotonic())
+
+    def latency(self, kind):
+        sample = self._latency.get(kind)
+        if not sample or time.monotonic() - sample[1] > LATENCY_SAMPLE_TTL:
+            return 0.0
+        return sample[0]
+
+    def load(self):
+        return self.pending + self.backlog()
+
+    @property
+    def overloaded(self):
+        load = self.load()
+        latency = max(self.latency('db'), self.latency('api'))
+        if self._overloaded:
+            if load < self.max_load * ADMISSION_RECOVERY_RATIO and latency < self.max_latency * ADMISSION_RECOVERY_RATIO:
+                self._overloaded = False
+                logger.info(f"✅ Нагрузка снизилась (load={load}, latency={latency:.2f}с)")
+        elif load >= self.max_load or latency >= self.max_latency:
+            self._overloaded = True
+            logger.warning(f"🔥 Перегрузка: load={load}, latency={latency:.2f}с - включён сброс нагрузки")
+        return self._overloaded
+
+    def shed(self, route):
+        self.shed_counts[route] += 1
+
+    def track_db(self, func):
+        """Декоратор: замеряет время синхронных обращений к БД."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record('db', time.perf_counter() - started)
+        return wrapper
+
+    def defer(self, func, *args):
+        """Откладывает второстепенную запись в БД до снижения нагрузки."""
+        if len(self._deferred) == self._deferred.maxlen:
+            self.deferred_dropped += 1
+        self._deferred.append((func, args))
+
+    def _run_deferred_batch(self):
+        for _ in range(min(DEFERRED_BATCH_SIZE, len(self._deferred))):
+            func, args = self._deferred.popleft()
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"Ошибка отложенной задачи {func.__name__}: {e}")
+
+    async def run_deferred(self):
+        """Задача планировщика (раз в DEFERRED_INTERVAL): выполняет отложенную работу, пока нет перегрузки."""
+        while self._deferred and not self.overloaded:
+            await asyncio.to_thread(self._run_deferred_batch)
+
+    def flush_deferred(self):
+        """Блокирующий вызов при остановке: выполняет всю отложенную работу независимо от нагрузки."""
+        count = len(self._deferred)
+        while self._deferred:
+            self._run_deferred_batch()
+        if count:
+            logger.info(f"Выполнено отложенных задач при остановке: {count}")
+
+    def stats(self):
+        return {
+            'overloaded': self._overloaded,
+            'pending': self.pending,
+            'in_flight': self.in_flight,
+            'backlog': self.backlog(),
+            'latency_ms': {kind: round(self.latency(kind) * 1000, 1) for kind in ('db', 'api', 'update')},
+            'shed': dict(self.shed_counts),
+            'deferred': len(self._deferred),
+            'deferred_dropped': self.deferred_dropped,
+        }
+
+class AdmissionUpdateProcessor(SimpleUpdateProcessor):
+    """Обработчик апдейтов, сообщающий контроллеру число апдейтов в работе и их длительность."""
+
+    __slots__ = ("controller",)
+
+    def __init__(self, controller, max_concurrent_updates=1):
+        super().__init__(max_concurrent_updates)
+        self.controller = controller
+
+    async def process_update(self, update, coroutine):
+        # PTB сразу забирает апдейты из update_queue в задачи, поэтому нагрузка считается
+        # с момента поступления, до ожидания семафора и очереди пользователя
+        self.controller.pending += 1
+        try:
+            await self.admit(update, coroutine)
+        finally:
+            self.controller.pending -= 1
+
+    async def admit(self, update, coroutine):
+        """Ждёт слот семафора и обрабатывает апдейт; наследники ставят свою очередь перед слотом."""
+        await super().process_update(update, coroutine)
+
+    async def do_process_update(self, update, coroutine):
+        self.controller.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await coroutine
+        finally:
+            self.controller.in_flight -= 1
+            self.controller.record('update', time.perf_counter() - started)
+
+class TimedRequest(HTTPXRequest):
+    """HTTPXRequest, замеряющий задержку вызовов Bot API (кроме long polling)."""
+
+    __slots__ = ("controller",)
+
+    def __init__(self, controller, **kwargs):
+        super().__init__(**kwargs)
+        self.controller = controller
+
+    async def do_request(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(*args, **kwargs)
+        finally:
+            self.controller.record('api', time.perf_counter() - started)
@@ -0,0 +1,82 @@
+# benchmarks/ipn_benchmark.py - Нагрузочный тест IPN-эндпоинта
+#
+# Отправляет тысячи подписанных IPN-уведомлений на локальный экземпляр бота:
+#   NOWPAYMENTS_IPN_SECRET=... python benchmarks/ipn_benchmark.py --count 5000 --concurrency 50
+import os
+import sys
+import time
+import json
+import hmac
+import hashlib
+import argparse
+import statistics
+import http.client
+from collections import Counter
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+STATUSES = ['waiting', 'confirming', 'confirmed', 'sending', 'finished']
+
+def sign(payload, secret):
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hmac.new(secret.encode('utf-8'), canonical.encode('utf-8'), hashlib.sha512).hexdigest()
+
+def build_payloads(count, retry_ratio):
+    """Генерирует уведомления; часть из них - повторы, как при ретраях провайдера."""
+    step = int(1 / retry_ratio) if retry_ratio > 0 else 0
+    payloads = []
+    for i in range(count):
+        n = i - 1 if step and i and i % step == 0 else i
+        payloads.append({
+            'payment_id': 5000000000 + n,
+            'payment_status': STATUSES[n % len(STATUSES)],
+            'order_id': f"B{n:07d}",
+            'pay_amount': 10.5,
+            'actually_paid': 10.5,
+            'pay_currency': 'usdttrc20',
+            'price_amount': 420,
+            'price_currency': 'uah',
+        })
+    return payloads
+
+def send(url, payload, secret):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=10)
+    started = time.perf_counter()
+    try:
+        conn.request('POST', url.path or '/ipn', body=body, headers={
+            'Content-Type': 'application/json',
+            'x-nowpayments-sig': sign(payload, secret),
+        })
+        status = conn.getresponse().status
+    except OSError:
+        status = 'error'
+    finally:
+        conn.close()
+    return status, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест IPN-эндпоинта")
+    parser.add_argument('--url', default=os.environ.get('IPN_URL', 'http://localhost:10000/ipn'))
+    parser.add_argument('--secret', default=os.environ.get('NOWPAYMENTS_IPN_SECRET'))
+    parser.add_argument('--count', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--retry-ratio', type=float, default=0.2)
+    args = parser.parse_args()
+    if not args.secret:
+        sys.exit("NOWPAYMENTS_IPN_SECRET не задан (--secret)")
+    url = urlparse(args.url)
+    payloads = build_payloads(args.count, args.retry_ratio)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda p: send(url, p, args.secret), payloads))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(r[1] * 1000 for r in results)
+    codes = Counter(r[0] for r in results)
+    q = statistics.quantiles(latencies, n=100)
+    print(f"запросов: {len(results)} за {elapsed:.2f}с ({len(results) / elapsed:.0f} req/s)")
+    print(f"latency ms: p50={q[49]:.2f} p95={q[94]:.2f} p99={q[98]:.2f} max={latencies[-1]:.2f}")
+    print(f"коды ответов: {dict(codes)}")
+
+if __name__ == "__main__":
+    main()
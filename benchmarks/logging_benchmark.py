@@ -0,0 +1,66 @@
+# benchmarks/logging_benchmark.py - Задержка вызова logger.info в event loop
+#
+# Сравнивает запись напрямую в медленный stderr (StreamHandler) и через очередь (logs.setup_logging):
+#   python benchmarks/logging_benchmark.py --count 2000 --stall-ms 2
+# --stall-ms имитирует задержку записи в поток на каждую строку (переполненный pipe, медленный диск).
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from logs import setup_logging, TEXT_FORMAT
+
+class SlowStream:
+    def __init__(self, stall):
+        self.stall = stall
+        self.lines = 0
+
+    def write(self, text):
+        time.sleep(self.stall)
+        self.lines += 1
+
+    def flush(self):
+        pass
+
+async def measure(logger, count):
+    """Время вызова logger.info внутри корутины - столько event loop не обслуживает другие апдейты."""
+    durations = []
+    for i in range(count):
+        started = time.perf_counter()
+        logger.info("🔘 Получен callback запрос: %s от пользователя %s", 'order', i)
+        durations.append(time.perf_counter() - started)
+        await asyncio.sleep(0)
+    return durations
+
+def report(name, durations):
+    durations.sort()
+    p99 = durations[int(len(durations) * 0.99) - 1]
+    print(f"{name:>8}: p50 {statistics.median(durations) * 1e6:8.1f} мкс  p99 {p99 * 1e6:8.1f} мкс  "
+          f"всего {sum(durations) * 1000:8.1f} мс")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--stall-ms', type=float, default=2.0)
+    args = parser.parse_args()
+    stall = args.stall_ms / 1000
+
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    direct = logging.StreamHandler(SlowStream(stall))
+    direct.setFormatter(logging.Formatter(TEXT_FORMAT))
+    root.addHandler(direct)
+    report('direct', asyncio.run(measure(logging.getLogger('bench'), args.count)))
+
+    stream = SlowStream(stall)
+    pipeline = setup_logging(queue_size=args.count * 2, rate_limits='', stream=stream)
+    report('queued', asyncio.run(measure(logging.getLogger('bench'), args.count)))
+    pipeline.stop()
+    print(f"записано потоком вывода: {stream.lines}, отброшено: {pipeline.stats()['dropped']}")
+
+if __name__ == '__main__':
+    main()
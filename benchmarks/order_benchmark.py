@@ -0,0 +1,98 @@
+# benchmarks/order_benchmark.py - Сравнение оформления заказа: три подключения против одного пакета
+#
+# Оформляет N заказов от тестовых пользователей двумя способами и удаляет созданные данные:
+#   DATABASE_URL=... python benchmarks/order_benchmark.py --count 500 --threads 8
+# Затем те же заказы из --threads потоков: одно общее соединение против пула db.primary_pool.
+# Рекомендуется запускать на копии базы: счётчик bot_stats.total_orders восстанавливается в конце.
+import os
+import sys
+import time
+import argparse
+import statistics
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg
+import db
+from config import DATABASE_URL
+
+# У пользователей Telegram ID всегда положительные - тестовые берутся из отрицательных
+TEST_USER_BASE = -1_000_000
+
+def make_user(n):
+    return SimpleNamespace(
+        id=TEST_USER_BASE - n, username=f"bench{n}", first_name="Bench", last_name=None,
+        language_code='uk', is_bot=False,
+    )
+
+def legacy_order(user, order_id, items_text, total_uah):
+    """Прежняя последовательность: save_user, save_order, increment_orders - три подключения и три коммита."""
+    with psycopg.connect(DATABASE_URL) as conn:
+        conn.execute(db.ORDER_USER_UPSERT, (
+            user.id, user.username, user.first_name, user.last_name, user.language_code, user.is_bot
+        ))
+        conn.commit()
+    with psycopg.connect(DATABASE_URL) as conn:
+        conn.execute("""
+            INSERT INTO orders (user_id, order_id, items, total_uah, status, created_at)
+            VALUES (%s, %s, %s, %s, 'created', NOW())
+        """, (user.id, order_id, items_text, total_uah))
+        conn.commit()
+    with psycopg.connect(DATABASE_URL) as conn:
+        conn.execute(db.ORDER_COUNTER_UPDATE)
+        conn.commit()
+
+def pipelined_order(user, order_id, items_text, total_uah):
+    db.place_order(user, order_id, items_text, total_uah, [(items_text, 1, total_uah)])
+
+def run(name, func, count, offset, threads=1):
+    def timed(i):
+        user = make_user(offset + i)
+        t = time.perf_counter()
+        func(user, f"BENCH{offset + i}", "Bench item - 100 UAH", 100)
+        return (time.perf_counter() - t) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        latencies = list(executor.map(timed, range(count)))
+    elapsed = time.perf_counter() - started
+    q = statistics.quantiles(latencies, n=100)
+    print(f"{name:>10}: {count} заказов за {elapsed:.2f}с ({count / elapsed:.0f} заказов/с), "
+          f"p50={q[49]:.2f}мс p99={q[98]:.2f}мс")
+
+def cleanup(total):
+    with psycopg.connect(DATABASE_URL) as conn:
+        # Позиции ссылаются на orders.id без внешнего ключа - удаляются первыми
+        conn.execute("""
+            DELETE FROM order_items WHERE order_ref IN (SELECT id FROM orders WHERE user_id <= %s)
+        """, (TEST_USER_BASE,))
+        conn.execute("DELETE FROM orders WHERE user_id <= %s", (TEST_USER_BASE,))
+        conn.execute("DELETE FROM users WHERE id <= %s", (TEST_USER_BASE,))
+        conn.execute("UPDATE bot_stats SET total_orders = total_orders - %s", (total,))
+        conn.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение оформления заказа: три подключения против одного пакета")
+    parser.add_argument('--count', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+    if not DATABASE_URL:
+        sys.exit("DATABASE_URL не задан")
+    try:
+        run('legacy', legacy_order, args.count, 0)
+        run('pipeline', pipelined_order, args.count, args.count)
+        # Прежняя схема: одно соединение на все потоки - пул из одного соединения
+        pool = db.primary_pool
+        db.primary_pool = db.ConnectionPool(db.connect, max_size=1, timeout=60, breaker=db.breaker)
+        run('single', pipelined_order, args.count, args.count * 2, args.threads)
+        db.primary_pool.close()
+        db.primary_pool = pool
+        run('pool', pipelined_order, args.count, args.count * 3, args.threads)
+    finally:
+        db.close_connections()
+        cleanup(args.count * 4)
+
+if __name__ == "__main__":
+    main()
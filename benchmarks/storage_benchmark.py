@@ -0,0 +1,96 @@
+# benchmarks/storage_benchmark.py - Задержка записи на апдейт: Postgres против встроенного SQLite
+#
+# Каждый "апдейт" - save_user + save_question + increment_questions + place_order,
+# как при вопросе и заказе клиента. Несколько потоков имитируют параллельные апдейты:
+#   python benchmarks/storage_benchmark.py --url sqlite:///tmp/bench.db --threads 8
+#   DATABASE_URL=postgresql://... python benchmarks/storage_benchmark.py --threads 8
+# Для Postgres тестовые данные удаляются в конце; запускайте на копии базы.
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import statistics
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg
+import storage
+from config import DATABASE_URL
+from spool import WriteSpool
+
+# У пользователей Telegram ID всегда положительные - тестовые берутся из отрицательных
+TEST_USER_BASE = -1_000_000
+
+def make_user(n):
+    return SimpleNamespace(
+        id=TEST_USER_BASE - n, username=f"bench{n}", first_name="Bench", last_name=None,
+        language_code='uk', is_bot=False,
+    )
+
+def one_update(store, n):
+    user = make_user(n)
+    store.save_user(user)
+    store.save_question(user.id, "Bench question", None)
+    store.increment_questions()
+    store.place_order(user, f"BENCH{n}", "Bench item - 100 UAH", 100, [("Bench item", 1, 100)])
+
+def run(store, count, threads):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(offset):
+        local = []
+        for i in range(offset, count, threads):
+            t = time.perf_counter()
+            one_update(store, i)
+            local.append((time.perf_counter() - t) * 1000)
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(offset,)) for offset in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    q = statistics.quantiles(latencies, n=100)
+    print(f"{store.name:>8}: {count} апдейтов за {elapsed:.2f}с ({count / elapsed:.0f} апдейтов/с), "
+          f"p50={q[49]:.2f}мс p99={q[98]:.2f}мс, потоков {threads}")
+    print(f"{'':>8}  {store.stats()}")
+
+def cleanup_postgres(url, count):
+    with psycopg.connect(url) as conn:
+        conn.execute("DELETE FROM order_items WHERE order_ref IN (SELECT id FROM orders WHERE user_id <= %s)", (TEST_USER_BASE,))
+        conn.execute("DELETE FROM orders WHERE user_id <= %s", (TEST_USER_BASE,))
+        conn.execute("DELETE FROM active_questions WHERE user_id <= %s", (TEST_USER_BASE,))
+        conn.execute("DELETE FROM users WHERE id <= %s", (TEST_USER_BASE,))
+        conn.execute(
+            "UPDATE bot_stats SET total_orders = total_orders - %s, total_questions = total_questions - %s",
+            (count, count),
+        )
+        conn.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description="Задержка записи на апдейт: Postgres против SQLite")
+    parser.add_argument('--url', default=DATABASE_URL, help="По умолчанию DATABASE_URL или временный файл SQLite")
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+    url = args.url or storage.SQLITE_URL_PREFIX + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    with tempfile.TemporaryDirectory() as spool_dir:
+        store = storage.create_store(url, WriteSpool(os.path.join(spool_dir, 'writes.log')))
+        store.init_schema()
+        try:
+            run(store, args.count, args.threads)
+        finally:
+            if storage.is_sqlite_url(url):
+                store.close()
+            else:
+                cleanup_postgres(url, args.count)
+
+if __name__ == "__main__":
+    main()
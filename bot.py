@@ -0,0 +1,1125 @@
+# bot.py - Бот: обработчики, HTTP-сервер и запуск (python main.py)
+import os
+import logging
+import threading
+import functools
+import json
+import re
+from datetime import datetime, timedelta
+from urllib.parse import urljoin
+import asyncio
+import tempfile
+from http.server import HTTPServer, BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    BotCommand,
+    BotCommandScopeChat,
+)
+from telegram.ext import (
+    Application,
+    CommandHandler,
+    MessageHandler,
+    CallbackQueryHandler,
+    InlineQueryHandler,
+    TypeHandler,
+    filters,
+    ContextTypes,
+    ApplicationHandlerStop,
+)
+import httpx
+from config import (
+    BOT_TOKEN,
+    SUPPORT_STAFF_IDS,
+    SUPPORT_WORKING_HOURS,
+    SUPPORT_TIMEZONE,
+    DATABASE_URL,
+    OWNER_ID_1,
+    OWNER_ID_2,
+    NOWPAYMENTS_API_KEY,
+    NOWPAYMENTS_IPN_SECRET,
+    PAYMENT_CURRENCY,
+    CARD_NUMBER,
+    SECURE_SUPPORT_ID,
+    ORDER_INTAKE_SECRET,
+)
+from products_config import SUBSCRIPTIONS, DIGITAL_PRODUCTS, DIGITAL_PRODUCT_MAP
+from catalog_search import CatalogSearch, build_entries, INLINE_CACHE_TIME, DEEP_LINK_PREFIX
+from ipn import IPNProcessor, verify_signature, IPN_PATH, IPN_MAX_BODY
+from intake import OrderIntake, INTAKE_PATH, INTAKE_MAX_BODY, INTAKE_PURGE_INTERVAL, CLAIM_PREFIX
+from catalog_feed import CatalogFeed, CATALOG_PATH, CATALOG_CHECK_INTERVAL
+from pay_rules import SERVICE_ABBR_MAP, PLAN_ABBR_MAP
+from i18n import Messages, DEFAULT_LOCALE
+from broadcast import Broadcaster
+from support import SupportRelay
+from routing import StaffRouter, parse_working_hours
+from throttle import FloodGuard
+from admission import AdmissionController, TimedRequest, DEFERRED_INTERVAL
+from concurrency import PerUserUpdateProcessor
+from persistence import PostgresPersistence
+from profiles import ProfileCache
+from state_sweeper import StateSweeper, CONVERSATION_KEYS, STATE_IDLE_TTL
+from inbox import render_inbox, handle_inbox_action
+import db
+import bulk
+import partitions
+import reports
+from jobs import JobManager
+from spool import WriteSpool, SPOOL_REPLAY_INTERVAL
+from scheduler import Scheduler
+from lifecycle import Lifecycle
+import storage
+from logs import setup_logging
+# Вывод логов - в отдельном потоке (logs.py), event loop только кладёт запись в очередь
+log_pipeline = setup_logging()
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+# Строка на каждую команду, callback и сообщение; сэмплируется и ограничивается по частоте (LOG_RATE_LIMITS)
+update_logger = logging.getLogger('updates')
+bot_running = False
+bot_lock = threading.Lock()
+OWNER_IDS = [id for id in [OWNER_ID_1, OWNER_ID_2] if id is not None]
+MANAGER_ID = SECURE_SUPPORT_ID
+STAFF_IDS = [id for id in dict.fromkeys([MANAGER_ID] + OWNER_IDS + SUPPORT_STAFF_IDS) if id]
+admission = AdmissionController()
+update_processor = PerUserUpdateProcessor(admission)
+write_spool = WriteSpool()
+store = storage.create_store(DATABASE_URL, write_spool)
+POSTGRES_BACKEND = isinstance(store, storage.PostgresStore)
+# Команды поверх таблиц, которые есть только в Postgres (диалоги, рассылки, COPY);
+# с SQLite они не регистрируются, а состояние диалогов живёт только в памяти процесса
+POSTGRES_ONLY_COMMANDS = {'json', 'export', 'broadcast', 'history', 'inbox'}
+persistence = (
+    PostgresPersistence(expiring_keys=CONVERSATION_KEYS, state_ttl=STATE_IDLE_TTL) if POSTGRES_BACKEND else None
+)
+state_sweeper = StateSweeper(persistence)
+catalog_search = CatalogSearch(build_entries(SUBSCRIPTIONS, DIGITAL_PRODUCTS))
+order_intake = OrderIntake(catalog_search, ORDER_INTAKE_SECRET)
+catalog_feed = CatalogFeed(lambda: (SUBSCRIPTIONS, DIGITAL_PRODUCTS, SERVICE_ABBR_MAP, PLAN_ABBR_MAP))
+NOWPAYMENTS_API_URL = "https://api.nowpayments.io/v1"
+AVAILABLE_CURRENCIES = {
+    "USDT (Solana)": "usdtsol",
+    "USDT (TRC20)": "usdttrc20",
+    "ETH": "eth",
+    "USDT (Arbitrum)": "usdtarb",
+    "USDT (Polygon)": "usdtmatic",   
+    "USDT (TON)": "usdtton",        
+    "AVAX (C-Chain)": "avax",
+    "APTOS (APT)": "apt"
+}
+RULES_URL = "https://drive.google.com/file/d/1t5jQWCCJeimM8lJ132M7oTRKRG7t3dug/view?usp=drivesdk"
+SUPPORT_URL = "https://t.me/SecureSupport"
+CHANNEL_URL = "https://t.me/SecureShopUA"
+# Раскладки клавиатур; подписи кнопок - ключи каталогов locales/*.json.
+# Клавиатуры строятся один раз для каждой локали и отдаются готовыми,
+# в том числе в режиме перегрузки (см. admission_gate)
+UNIVERSAL_MENU_ROWS = [
+    [{'text': 'button.main_menu', 'callback_data': 'back_to_main'}],
+    [{'text': 'button.rules', 'url': RULES_URL}],
+    [{'text': 'button.help', 'callback_data': 'help'}],
+    [{'text': 'button.ask', 'callback_data': 'question'}],
+]
+KEYBOARDS = {
+    'universal': UNIVERSAL_MENU_ROWS,
+    'support': [[{'text': 'button.support', 'url': SUPPORT_URL}]] + UNIVERSAL_MENU_ROWS,
+    'customer_menu': [
+        [{'text': 'button.order', 'callback_data': 'order'}],
+        [{'text': 'button.ask', 'callback_data': 'question'}],
+        [{'text': 'button.help', 'callback_data': 'help'}],
+        [{'text': 'button.channel', 'callback_data': 'channel'}],
+        [{'text': 'button.rules', 'url': RULES_URL}],
+    ],
+    'owner_menu': [[{'text': 'button.stats', 'callback_data': 'stats'}]],
+    'channel': [[{'text': 'button.channel_link', 'url': CHANNEL_URL}]],
+    'order_menu': [
+        [{'text': 'button.subscriptions', 'callback_data': 'order_subscriptions'}],
+        [{'text': 'button.digital', 'callback_data': 'order_digital'}],
+        [{'text': 'button.back', 'callback_data': 'back_to_main'}],
+    ],
+}
+def build_catalog_menus(t):
+    """Меню каталога товаров для локали t: callback_data -> (текст, клавиатура)."""
+    def back(callback_data):
+        return [t.button('button.back', callback_data=callback_data)]
+    def price_button(label, price, callback_data):
+        return [InlineKeyboardButton(t.text('button.price_option', label=label, price=price), callback_data=callback_data)]
+    def digital_menu(category, parent):
+        rows = [
+            price_button(DIGITAL_PRODUCTS[product_id]['name'], DIGITAL_PRODUCTS[product_id]['price'], product_callback)
+            for product_callback, product_id in DIGITAL_PRODUCT_MAP.items()
+            if DIGITAL_PRODUCTS[product_id].get('category') == category
+        ]
+        return InlineKeyboardMarkup(rows + [back(parent)])
+    menus = {
+        'order_subscriptions': (t.text('menu.subscriptions'), InlineKeyboardMarkup(
+            [[InlineKeyboardButton(service['name'], callback_data=f'service_{service_key}')]
+             for service_key, service in SUBSCRIPTIONS.items()] + [back('order')]
+        )),
+        'order_digital': (t.text('menu.digital'), InlineKeyboardMarkup([
+            [t.button('button.discord_decor', callback_data='digital_discord_decor')],
+            [t.button('button.psn_cards', callback_data='digital_psn_cards')],
+            back('order'),
+        ])),
+        'digital_discord_decor': (t.text('menu.discord_decor'), InlineKeyboardMarkup([
+            [t.button('button.decor_bzn', callback_data='discord_decor_bzn')],
+            [t.button('button.decor_zn', callback_data='discord_decor_zn')],
+            back('order_digital'),
+        ])),
+        'discord_decor_bzn': (t.text('menu.decor_bzn'), digital_menu('bzn', 'digital_discord_decor')),
+        'discord_decor_zn': (t.text('menu.decor_zn'), digital_menu('zn', 'digital_discord_decor')),
+        'digital_psn_cards': (t.text('menu.psn_cards'), digital_menu('psn', 'order_digital')),
+    }
+    for service_key, service in SUBSCRIPTIONS.items():
+        menus[f'service_{service_key}'] = (t.text('menu.plans', service=service['name']), InlineKeyboardMarkup(
+            [[InlineKeyboardButton(plan['name'], callback_data=f'plan_{service_key}_{plan_key}')]
+             for plan_key, plan in service['plans'].items()] + [back('order_subscriptions')]
+        ))
+        for plan_key, plan in service['plans'].items():
+            rows = [
+                price_button(
+                    option['period'], option['price'],
+                    f"add_{service_key}_{plan_key}_{option['period'].replace(' ', '_')}_{option['price']}"
+                )
+                for option in plan.get('options', [])
+            ]
+            menus[f'plan_{service_key}_{plan_key}'] = (
+                t.text('menu.periods', service=service['name'], plan=plan['name']),
+                InlineKeyboardMarkup(rows + [back(f'service_{service_key}')])
+            )
+    # Переход по кнопке "Замовити" из инлайн-поиска (/start buy_<ключ>)
+    for entry in catalog_search.entries:
+        menus[DEEP_LINK_PREFIX + entry.key] = (t.text('menu.confirm_order', item=entry.text), InlineKeyboardMarkup([
+            [InlineKeyboardButton(entry.button_text, callback_data=entry.callback_data)],
+            [t.button('button.all_products', callback_data='order')],
+        ]))
+    return menus
+def main_menu(user, t):
+    if profile_cache.is_owner(user.id):
+        return t.text('greeting.owner', first_name=user.first_name), t.keyboard('owner_menu')
+    return t.text('greeting', first_name=user.first_name), t.keyboard('customer_menu')
+messages = Messages(KEYBOARDS)
+for bundle in messages.bundles():
+    bundle.menus.update(build_catalog_menus(bundle))
+# Уведомления сотрудникам - всегда на локали по умолчанию
+staff_texts = messages.bundle(DEFAULT_LOCALE)
+def recipient_texts(user_id, language_code=None):
+    """Тексты на языке получателя по user_id: из кэша профилей, иначе language_code (или локаль по умолчанию)."""
+    return messages.bundle(profile_cache.language(user_id, default=language_code))
+def user_texts(user):
+    """Тексты и клавиатуры на языке пользователя: из кэша профилей, иначе из апдейта."""
+    return recipient_texts(user.id, user.language_code)
+get_stats = store.get_stats
+get_total_users_count = store.count_users
+get_active_questions_count = store.count_open_questions
+get_orders_count = store.count_orders
+save_user = admission.track_db(store.save_user)
+save_question = admission.track_db(store.save_question)
+increment_questions = admission.track_db(store.increment_questions)
+place_order = admission.track_db(store.place_order)
+PING_INTERVAL = 60 * 5
+PING_JITTER = 30
+WEBHOOK_URL = os.environ.get('RENDER_EXTERNAL_URL') or "http://localhost:10000"
+# Все периодические задачи бота выполняются в его event loop (см. scheduler.py)
+scheduler = Scheduler()
+# Готовность к трафику (/health) и плавная остановка по SIGTERM
+lifecycle = Lifecycle()
+# Общий асинхронный HTTP-клиент; создаётся в post_init, закрывается в post_shutdown
+http_client = None
+async def ping_self():
+    """Keepalive: запрос к своему /health, чтобы хостинг не усыплял сервис."""
+    response = await http_client.get(f"{WEBHOOK_URL}/health")
+    if response.status_code == 200:
+        logger.debug(f"✅ Ping успешен: {response.status_code}")
+    else:
+        logger.warning(f"⚠️ Ping вернул статус: {response.status_code}")
+ipn_processor = IPNProcessor(store.update_order_status, recipient_texts, staff_texts)
+class BotHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+class HealthCheckHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug("🌐 %s " + format, self.address_string(), *args)
+    def send_json(self, code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def read_body(self, max_body):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length <= 0 or length > max_body:
+            self.send_json(400, {'error': 'bad request'})
+            return None
+        return self.rfile.read(length)
+    def do_POST(self):
+        if lifecycle.draining and self.path in (INTAKE_PATH, IPN_PATH):
+            # Сайт и провайдер повторят запрос - его примет новый инстанс
+            self.send_json(503, {'error': 'shutting down'})
+            return
+        if self.path == INTAKE_PATH:
+            body = self.read_body(INTAKE_MAX_BODY)
+            if body is not None:
+                self.send_json(*order_intake.handle(body, self.headers))
+            return
+        if self.path != IPN_PATH:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = self.read_body(IPN_MAX_BODY)
+        if body is None:
+            return
+        payload = verify_signature(body, self.headers.get('x-nowpayments-sig'), NOWPAYMENTS_IPN_SECRET)
+        if payload is None:
+            logger.warning(f"⚠️ IPN с неверной подписью от {self.client_address[0]}")
+            self.send_json(401, {'error': 'invalid signature'})
+            return
+        # 200 - только после записи в БД; на 4xx/5xx провайдер повторит уведомление позже
+        self.send_json(*ipn_processor.handle(payload))
+    def do_GET(self):
+        if self.path.split('?', 1)[0] == CATALOG_PATH:
+            code, headers, body = catalog_feed.response(self.headers)
+            self.send_response(code)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            if code == 200:
+                self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == '/health':
+            # 503 до готовности и во время остановки: платформа не направит сюда трафик
+            self.send_response(200 if lifecycle.ready else 503)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            response = json.dumps({
+                'status': 'ok' if lifecycle.ready else lifecycle.state,
+                'ready': lifecycle.ready,
+                'lifecycle': lifecycle.stats(),
+                'timestamp': datetime.now().isoformat(),
+                'load': admission.stats(),
+                'updates': {
+                    'concurrency': update_processor.max_concurrent_updates,
+                    'active_users': update_processor.active_keys(),
+                    'dropped': update_processor.dropped,
+                },
+                'flood': flood_guard.stats(),
+                'persistence': persistence.stats() if persistence else None,
+                'profiles': profile_cache.stats(),
+                'reports': job_manager.stats(),
+                'search': catalog_search.stats(),
+                'intake': order_intake.stats(),
+                'catalog': catalog_feed.stats(),
+                'locales': messages.stats(),
+                'logging': log_pipeline.stats(),
+                'scheduler': scheduler.stats(),
+                'replica': db.replica_router.stats(),
+                'database': store.stats(),
+                'ipn': ipn_processor.stats(),
+            }).encode('utf-8')
+            self.wfile.write(response)
+        elif self.path == '/':
+            self.send_response(200)
+            self.send_header('Content-type', 'text/plain')
+            self.end_headers()
+            self.wfile.write(b"Telegram Bot SecureShop is running. Use /health for status.")
+        else:
+            self.send_response(404)
+            self.end_headers()
+def start_http_server(port):
+    try:
+        httpd = BotHTTPServer(("", port), HealthCheckHandler)
+        logger.info(f"🌐 HTTP сервер запущен на порту {port}")
+        httpd.serve_forever()
+    except OSError as e:
+        if e.errno == 48:
+            logger.warning(f"🌐 Порт {port} занят, HTTP сервер не запущен.")
+        else:
+            logger.error(f"❌ Ошибка запуска HTTP сервера: {e}")
+    except Exception as e:
+        logger.error(f"❌ Неожиданная ошибка HTTP сервера: {e}")
+profile_cache = ProfileCache(OWNER_IDS)
+async def ensure_user_exists(user, deferrable=False):
+    # Известный пользователь с неизменившимся профилем - без обращения к БД
+    if profile_cache.is_known(user):
+        return
+    try:
+        if profile_cache.get(user.id) is None:
+            logger.info(f"👤 Добавление/обновление пользователя: {user.id}")
+        if deferrable and admission.overloaded:
+            admission.defer(save_user, user)
+        elif not await asyncio.to_thread(save_user, user):
+            return
+        profile_cache.put(user)
+    except Exception as e:
+        logger.error(f"Ошибка при добавлении/обновлении пользователя {user.id}: {e}")
+async def send_order_notification(context, user, pending_order):
+    t = user_texts(user)
+    order_type = pending_order.get('type')
+    customer = user.username or user.first_name
+    if order_type == 'subscription':
+        order_summary_for_owner = staff_texts.text(
+            'staff.order_subscription', order_id=pending_order['order_id'], customer=customer, user_id=user.id,
+            service=pending_order['service'], plan=pending_order['plan'],
+            period=pending_order['period'], price=pending_order['price']
+        )
+    elif order_type == 'digital':
+        order_summary_for_owner = staff_texts.text(
+            'staff.order_digital', order_id=pending_order['order_id'], customer=customer, user_id=user.id,
+            plan=pending_order['plan'], price=pending_order['price']
+        )
+    else:
+        return
+    await notify_staff_order(context.bot, order_summary_for_owner)
+    if order_type == 'digital':
+        text_key = 'order.digital' if user.username else 'order.digital_no_username'
+        await context.bot.send_message(chat_id=user.id, text=t.text(text_key), reply_markup=t.keyboard('universal'))
+        return
+    duolingo = SUBSCRIPTIONS.get('duolingo', {})
+    special_message_needed = (
+        pending_order.get('service') == duolingo.get('name', 'Duolingo')
+        and pending_order.get('plan') == duolingo.get('plans', {}).get('fam', {}).get('name', 'Family')
+        and pending_order.get('price') == 380
+    )
+    if special_message_needed:
+        text_key = 'order.duolingo_family'
+    elif user.username:
+        text_key = 'order.send_credentials'
+    else:
+        text_key = 'order.contact_support'
+    # Без username менеджер не сможет написать первым - даём ссылку на поддержку
+    keyboard = t.keyboard('universal' if user.username else 'support')
+    await context.bot.send_message(chat_id=user.id, text=t.text(text_key), reply_markup=keyboard)
+    if text_key == 'order.send_credentials':
+        context.user_data['awaiting_subscription_data'] = True
+        context.user_data['subscription_order_details'] = pending_order
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    update_logger.info("🚀 Вызов /start пользователем %s", update.effective_user.id)
+    user = update.effective_user
+    await ensure_user_exists(user, deferrable=True)
+    if context.args and context.args[0].startswith(CLAIM_PREFIX):
+        await claim_web_order(update, context, context.args[0])
+        return
+    t = user_texts(user)
+    # Переход по кнопке "Замовити" из инлайн-поиска: сразу предлагаем оформить выбранный товар
+    entry = catalog_search.from_deep_link(context.args[0] if context.args else None)
+    if entry:
+        text, reply_markup = t.menus[DEEP_LINK_PREFIX + entry.key]
+    else:
+        text, reply_markup = main_menu(user, t)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.inline_query
+    try:
+        await query.answer(catalog_search.results(query.query), cache_time=INLINE_CACHE_TIME, is_personal=False)
+    except Exception as e:
+        logger.debug(f"Не удалось ответить на инлайн-запрос {query.id}: {e}")
+async def claim_web_order(update: Update, context: ContextTypes.DEFAULT_TYPE, payload) -> None:
+    """Оформляет на пользователя заказ, созданный сайтом через /api/orders."""
+    user = update.effective_user
+    t = user_texts(user)
+    try:
+        claimed = await asyncio.to_thread(order_intake.claim, payload, user.id)
+    except Exception as e:
+        logger.error(f"Ошибка получения заказа с сайта ({payload}): {e}")
+        await update.message.reply_text(t.text('claim.error'))
+        return
+    if claimed is None:
+        await update.message.reply_text(t.text('claim.not_found'), reply_markup=t.keyboard('universal'))
+        return
+    token, order_id, line_items, total_uah = claimed
+    order_details = [
+        staff_texts.text('staff.order_line', name=name, quantity=quantity, amount=price * quantity)
+        for name, quantity, price in line_items
+    ]
+    try:
+        await asyncio.to_thread(place_order, user, order_id, "\n".join(order_details), total_uah, line_items)
+        profile_cache.put(user)
+    except Exception as e:
+        logger.error(f"Ошибка сохранения заказа с сайта {order_id}: {e}")
+        # Ссылка остаётся рабочей: клиент может открыть её повторно
+        await asyncio.to_thread(db.release_web_order, token)
+        await update.message.reply_text(t.text('claim.failed'))
+        return
+    await asyncio.to_thread(order_intake.placed, token)
+    order_text = staff_texts.text(
+        'staff.web_order', order_id=order_id, customer=user.username or user.first_name, user_id=user.id,
+        items="\n".join(order_details), total_uah=total_uah
+    )
+    await notify_staff_order(context.bot, order_text)
+    await update.message.reply_text(
+        t.text('claim.accepted', order_id=order_id, total_uah=total_uah), reply_markup=t.keyboard('universal')
+    )
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    update_logger.info("📖 Вызов /help пользователем %s", update.effective_user.id)
+    await update.message.reply_text(user_texts(update.effective_user).text('help'))
+async def channel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    update_logger.info("📢 Вызов /channel пользователем %s", update.effective_user.id)
+    t = user_texts(update.effective_user)
+    await update.message.reply_text(t.text('channel'), reply_markup=t.keyboard('channel'))
+async def order_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    update_logger.info("📦 Вызов /order пользователем %s", update.effective_user.id)
+    t = user_texts(update.effective_user)
+    await update.message.reply_text(t.text('menu.order'), reply_markup=t.keyboard('order_menu'))
+async def question_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    update_logger.info("❓ Вызов /question пользователем %s", update.effective_user.id)
+    user = update.effective_user
+    await ensure_user_exists(user, deferrable=True)
+    context.user_data["conversation_type"] = "question"
+    await update.message.reply_text(user_texts(user).text('question.prompt'))
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    update_logger.info("📈 Вызов /stats пользователем %s", update.effective_user.id)
+    owner_id = update.effective_user.id
+    if owner_id not in OWNER_IDS:
+        return
+    try:
+        stats = await asyncio.to_thread(get_stats)
+        total_users_db = await asyncio.to_thread(get_total_users_count)
+        active_questions_db = await asyncio.to_thread(get_active_questions_count)
+        orders_db = await asyncio.to_thread(get_orders_count)
+        stats_message = staff_texts.text(
+            'staff.stats', total_users=total_users_db, total_orders=stats['total_orders'],
+            total_questions=stats['total_questions'], active_questions=active_questions_db, orders=orders_db,
+        )
+        await update.message.reply_text(stats_message)
+    except Exception as e:
+        logger.error(f"Ошибка получения статистики из БД: {e}")
+        await update.message.reply_text(staff_texts.text('staff.stats_failed'))
+async def memory_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    update_logger.info("🧠 Вызов /memory пользователем %s", update.effective_user.id)
+    if update.effective_user.id not in OWNER_IDS:
+        return
+    await update.message.reply_text(state_sweeper.report())
+USERS_EXPORT_PAGE_SIZE = 5000
+job_manager = JobManager()
+async def users_json_job(ctx):
+    total = await ctx.run_io(db.get_total_users_count)
+    if not total:
+        return None
+    fd, path = tempfile.mkstemp(suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write("[\n")
+            after_id, done = None, 0
+            while True:
+                rows = await ctx.run_io(db.get_users_page, after_id, USERS_EXPORT_PAGE_SIZE)
+                if not rows:
+                    break
+                # Сериализация - в пуле процессов, event loop остаётся свободным для клиентов
+                chunk = await ctx.run_cpu(reports.serialize_users_page, rows)
+                file.write((",\n" if done else "") + chunk)
+                done += len(rows)
+                after_id = rows[-1][0]
+                await ctx.progress(done, total)
+            file.write("\n]")
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, 'users_export.json', staff_texts.text('staff.json_export_caption')
+async def submit_report(update: Update, title, job_func):
+    job = await job_manager.submit(update.effective_chat.id, title, job_func)
+    if job is None:
+        await update.message.reply_text(staff_texts.text('staff.reports_busy'))
+async def export_users_json(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    update_logger.info("📁 Вызов /json пользователем %s", update.effective_user.id)
+    owner_id = update.effective_user.id
+    if owner_id not in OWNER_IDS:
+        await update.message.reply_text(user_texts(update.effective_user).text('access.denied'))
+        return
+    await submit_report(update, staff_texts.text('staff.json_export_title'), users_json_job)
+async def job_cancel_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    if query.from_user.id not in OWNER_IDS:
+        await query.answer()
+        return
+    job_id = int(query.data.rsplit('_', 1)[1])
+    await query.answer(staff_texts.text('staff.job_cancelling' if job_manager.cancel(job_id) else 'staff.job_finished'))
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    update_logger.info("📦 Вызов /export пользователем %s", update.effective_user.id)
+    if update.effective_user.id not in OWNER_IDS:
+        return
+    table = context.args[0] if context.args else 'users'
+    if table not in bulk.TABLES:
+        await update.message.reply_text(staff_texts.text('staff.export_usage', tables='|'.join(bulk.TABLES)))
+        return
+    filename = f"{table}-{datetime.now():%Y%m%d-%H%M%S}.csv.gz"
+    async def export_job(ctx):
+        fd, path = tempfile.mkstemp(suffix='.csv.gz')
+        os.close(fd)
+        try:
+            rows = await ctx.run_io(bulk.export_file, table, path)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path, filename, staff_texts.text('staff.export_caption', table=table, rows=rows)
+    await submit_report(update, staff_texts.text('staff.export_title', table=table), export_job)
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Документ CSV/NDJSON (можно .gz) с подписью '/import users' или '/import orders'."""
+    logger.info(f"📥 Импорт файла от пользователя {update.effective_user.id}")
+    parts = update.message.caption.split()
+    table = parts[1] if len(parts) > 1 else None
+    if table not in bulk.TABLES:
+        await update.message.reply_text(staff_texts.text('staff.import_usage', tables='|'.join(bulk.TABLES)))
+        return
+    document = update.message.document
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, os.path.basename(document.file_name or 'import.csv'))
+            telegram_file = await document.get_file()
+            await telegram_file.download_to_drive(path)
+            staged, merged = await asyncio.to_thread(bulk.import_file, table, path)
+        await update.message.reply_text(staff_texts.text('staff.import_done', table=table, staged=staged, merged=merged))
+    except Exception as e:
+        logger.error(f"Ошибка импорта {table}: {e}")
+        await update.message.reply_text(staff_texts.text('staff.import_failed', table=table, error=e))
+broadcaster = Broadcaster(on_blocked=profile_cache.discard)
+staff_router = StaffRouter(STAFF_IDS, parse_working_hours(SUPPORT_WORKING_HOURS), SUPPORT_TIMEZONE)
+support_relay = SupportRelay(staff_router, staff_texts, recipient_texts, persistent=POSTGRES_BACKEND)
+flood_guard = FloodGuard(user_texts, STAFF_IDS)
+CACHED_ROUTES = {
+    'help': lambda user, t: (t.text('help'), None),
+    'channel': lambda user, t: (t.text('channel'), t.keyboard('channel')),
+    'order': lambda user, t: (t.text('menu.order'), t.keyboard('order_menu')),
+    'menu': main_menu,
+}
+COMMAND_ROUTES = {'start': 'menu', 'help': 'help', 'channel': 'channel', 'order': 'order', 'pay': 'critical'}
+CALLBACK_ROUTES = {'help': 'help', 'channel': 'channel', 'order': 'order', 'back_to_main': 'menu'}
+def is_order_callback(data):
+    return bool(data) and (data.startswith('add_') or data in DIGITAL_PRODUCT_MAP)
+def classify_route(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Определяет приоритет апдейта: 'critical', кэшируемый маршрут или 'normal'."""
+    query = update.callback_query
+    if query:
+        if is_order_callback(query.data):
+            return 'critical'
+        return CALLBACK_ROUTES.get(query.data, 'normal')
+    message = update.message
+    if not message or not message.text:
+        return 'normal'
+    if message.text.startswith('/'):
+        command = message.text.split()[0][1:].split('@')[0]
+        if command == 'start' and CLAIM_PREFIX in message.text:
+            return 'critical'
+        if command == 'start' and DEEP_LINK_PREFIX in message.text:
+            # Переход из инлайн-поиска к оформлению заказа не заменяется меню из кэша
+            return 'normal'
+        return COMMAND_ROUTES.get(command, 'normal')
+    user_data = context.user_data or {}
+    if (user_data.get('awaiting_subscription_data') or user_data.get('conversation_type')
+            or support_relay.has_open(update.effective_user.id)):
+        return 'critical'
+    # Текст без активного диалога просто перерисовывает главное меню
+    return 'menu'
+async def admission_gate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not admission.overloaded:
+        return
+    user = update.effective_user
+    if not user or user.id in STAFF_IDS:
+        return
+    route = classify_route(update, context)
+    cached = CACHED_ROUTES.get(route)
+    if not cached:
+        return
+    admission.shed(route)
+    text, reply_markup = cached(user, user_texts(user))
+    try:
+        if update.callback_query:
+            await update.callback_query.answer()
+            await update.callback_query.message.edit_text(text, reply_markup=reply_markup)
+        else:
+            await update.message.reply_text(text, reply_markup=reply_markup)
+    except Exception as e:
+        logger.debug(f"Не удалось ответить из кэша ({route}): {e}")
+    raise ApplicationHandlerStop
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    update_logger.info("📣 Вызов /broadcast пользователем %s", update.effective_user.id)
+    owner_id = update.effective_user.id
+    if owner_id not in OWNER_IDS:
+        return
+    text = re.sub(r'^/broadcast(@\w+)?\s*', '', update.message.text or '').strip()
+    if not text or text == 'status':
+        active = broadcaster.active()
+        if not active:
+            await update.message.reply_text(staff_texts.text('staff.broadcast_none'))
+            return
+        lines = [
+            staff_texts.text('staff.broadcast_line', broadcast_id=bid, sent=p['sent'], blocked=p['blocked'], failed=p['failed'])
+            for bid, p in active.items()
+        ]
+        await update.message.reply_text(staff_texts.text('staff.broadcast_active', lines="\n".join(lines)))
+        return
+    if text == 'stop':
+        cancelled = broadcaster.cancel()
+        await update.message.reply_text(staff_texts.text('staff.broadcast_cancelled', count=cancelled))
+        return
+    try:
+        broadcast_id = await asyncio.to_thread(db.create_broadcast, text, owner_id)
+    except Exception as e:
+        logger.error(f"Ошибка создания рассылки: {e}")
+        await update.message.reply_text(staff_texts.text('staff.broadcast_failed'))
+        return
+    broadcaster.launch(broadcast_id, text, owner_id)
+    await update.message.reply_text(staff_texts.text('staff.broadcast_started', broadcast_id=broadcast_id))
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+    user = query.from_user
+    user_id = user.id
+    # Заказ сам сохраняет пользователя в той же транзакции
+    if not is_order_callback(query.data):
+        await ensure_user_exists(user, deferrable=True)
+    update_logger.info("🔘 Получен callback запрос: %s от пользователя %s", query.data, user_id)
+    t = user_texts(user)
+    if query.data == "order":
+        await query.message.edit_text(t.text('menu.order'), reply_markup=t.keyboard('order_menu'))
+    elif query.data == "question":
+        context.user_data["conversation_type"] = "question"
+        try:
+            await query.message.edit_text(t.text('question.prompt'), reply_markup=None)
+        except Exception as e:
+            logger.warning(f"Не удалось отредактировать сообщение для 'question': {e}. Отправляем новое сообщение.")
+            await query.message.reply_text(t.text('question.prompt'))
+    elif query.data == "help":
+        await query.message.edit_text(t.text('help'))
+    elif query.data == "channel":
+        await query.message.edit_text(t.text('channel'), reply_markup=t.keyboard('channel'))
+    elif query.data == "back_to_main":
+        text, reply_markup = main_menu(user, t)
+        await query.message.edit_text(text, reply_markup=reply_markup)
+    elif query.data in t.menus:
+        # Меню каталога (подписки, планы, периоды, цифровые товары) - готовые для локали
+        text, reply_markup = t.menus[query.data]
+        await query.message.edit_text(text, reply_markup=reply_markup)
+    elif query.data.startswith('add_'):
+        parts = query.data.split('_')
+        if len(parts) < 5 or not parts[-1].isdigit():
+             logger.error(f"❌ Неверный формат callback_data 'add_': {query.data}")
+             await query.message.edit_text(t.text('error.period'))
+             return
+        service_key = parts[1]
+        plan_key = parts[2]
+        price_str = parts[-1]
+        period_parts = parts[3:-1]
+        period_key = "_".join(period_parts)
+        period = period_key.replace('_', ' ')
+        try:
+            price = int(price_str)
+            service = SUBSCRIPTIONS.get(service_key)
+            if service and plan_key in service['plans']:
+                service_abbr = service_key[:3].capitalize()
+                plan_abbr = plan_key.upper()
+                period_abbr = period.replace('місяць', 'м').replace('місяців', 'м')
+                order_id = 'O' + str(user_id)[-4:] + str(price)[-2:]
+                command = f"/pay {order_id} {service_abbr}-{plan_abbr}-{period_abbr}-{price}"
+                context.user_data['pending_order'] = {
+                    'order_id': order_id,
+                    'service': service['name'],
+                    'plan': service['plans'][plan_key]['name'],
+                    'period': period,
+                    'price': price,
+                    'command': command,
+                    'type': 'subscription'
+                }
+                item_name = f"{service['name']} {service['plans'][plan_key]['name']} ({period})"
+                items_str = f"{item_name} - {price} UAH"
+                if await save_order(context.bot, user, order_id, items_str, price, [(item_name, 1, price)]):
+                    await send_order_notification(context, user, context.user_data['pending_order'])
+                context.user_data.pop('pending_order', None)
+            else:
+                await query.message.edit_text(t.text('error.service_not_found'))
+        except (ValueError, IndexError) as e:
+            logger.error(f"Ошибка обработки add_ callback: {e}")
+            await query.message.edit_text(t.text('error.period'))
+    elif query.data.startswith('digital_'):
+        product_id = DIGITAL_PRODUCT_MAP.get(query.data)
+        if product_id:
+            product_data = DIGITAL_PRODUCTS[product_id]
+            order_id = 'D' + str(user_id)[-4:] + str(product_data['price'])[-2:]
+            service_abbr = "Dis" if "Discord" in product_data['name'] else "Dig"
+            plan_abbr = "Dec" if "Украшення" in product_data['name'] else "Prod"
+            price = product_data['price']
+            command = f"/pay {order_id} {service_abbr}-{plan_abbr}-1шт-{price}"
+            context.user_data['pending_order'] = {
+                'order_id': order_id,
+                'service': "Цифровий товар",
+                'plan': product_data['name'],
+                'period': "1 шт",
+                'price': price,
+                'command': command,
+                'type': 'digital'
+            }
+            items_str = f"{product_data['name']} - {price} UAH"
+            if await save_order(context.bot, user, order_id, items_str, price, [(product_data['name'], 1, price)]):
+                await send_order_notification(context, user, context.user_data['pending_order'])
+            context.user_data.pop('pending_order', None)
+        else:
+            await query.message.edit_text(t.text('error.digital_not_found'))
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    update_logger.info("📨 Получено текстовое сообщение от пользователя %s", update.effective_user.id)
+    user = update.effective_user
+    user_id = user.id
+    message_text = update.message.text
+    await ensure_user_exists(user)
+    t = user_texts(user)
+    awaiting_data = context.user_data.get('awaiting_subscription_data', False)
+    if awaiting_data:
+        subscription_details = context.user_data.get('subscription_order_details', {})
+        if subscription_details:
+            data_message = staff_texts.text(
+                'staff.subscription_data', order_id=subscription_details['order_id'],
+                customer=user.username or user.first_name, user_id=user_id,
+                service=subscription_details['service'], plan=subscription_details['plan'],
+                period=subscription_details['period'], price=subscription_details['price'], credentials=message_text
+            )
+            success = False
+            if MANAGER_ID:
+                try:
+                    await context.bot.send_message(chat_id=MANAGER_ID, text=data_message)
+                    success = True
+                    logger.info(f"✅ Данные о подписке отправлены менеджеру {MANAGER_ID}")
+                except Exception as e:
+                    logger.error(f"❌ Не удалось отправить данные менеджеру {MANAGER_ID}: {e}")
+            for owner_id in OWNER_IDS:
+                try:
+                    await context.bot.send_message(chat_id=owner_id, text=data_message)
+                    success = True
+                    logger.info(f"✅ Данные о подписке отправлены владельцу {owner_id}")
+                except Exception as e:
+                    logger.error(f"❌ Не удалось отправить данные владельцу {owner_id}: {e}")
+            await update.message.reply_text(
+                t.text('order.data_received' if success else 'order.data_failed'), reply_markup=t.keyboard('universal')
+            )
+            context.user_data.pop('awaiting_subscription_data', None)
+            context.user_data.pop('subscription_order_details', None)
+            return
+    conversation_type = context.user_data.get('conversation_type')
+    if conversation_type == 'question':
+        conversation = await support_relay.open(user_id, 'question', message_text)
+        staff_id = conversation['owner'] or MANAGER_ID
+        try:
+            await asyncio.to_thread(save_question, user_id, message_text, staff_id)
+            await asyncio.to_thread(increment_questions)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения вопроса в БД: {e}")
+        forward_message = staff_texts.text(
+            'staff.question', first_name=user.first_name,
+            username=user.username or staff_texts.text('staff.username_missing'), user_id=user.id, text=message_text
+        )
+        try:
+            sent = await context.bot.send_message(chat_id=staff_id, text=forward_message)
+            support_relay.remember(sent, user_id)
+            await update.message.reply_text(t.text('question.sent'), reply_markup=t.keyboard('universal'))
+        except Exception as e:
+            logger.error(f"Не удалось отправить вопрос сотруднику {staff_id}: {e}")
+            await update.message.reply_text(t.text('question.failed'), reply_markup=t.keyboard('universal'))
+        context.user_data.pop('conversation_type', None)
+        return
+    if support_relay.has_open(user_id) and user_id not in STAFF_IDS:
+        try:
+            await support_relay.forward_from_customer(context.bot, user, message_text)
+        except Exception as e:
+            logger.error(f"Не удалось переслать сообщение клиента {user_id}: {e}")
+            await update.message.reply_text(t.text('message.failed'), reply_markup=t.keyboard('universal'))
+        return
+    if message_text.startswith('/pay'):
+        await pay_command(update, context)
+        return
+    await start(update, context)
+async def staff_reply_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    message = update.message
+    customer_id = support_relay.resolve_customer(message.reply_to_message)
+    if not customer_id:
+        await handle_message(update, context)
+        return
+    logger.info(f"💬 Ответ сотрудника {update.effective_user.id} клиенту {customer_id}")
+    try:
+        await support_relay.reply_to_customer(context.bot, customer_id, message.text)
+        await message.reply_text(staff_texts.text('staff.reply_sent'))
+    except Exception as e:
+        logger.error(f"❌ Не удалось отправить ответ клиенту {customer_id}: {e}")
+        await message.reply_text(staff_texts.text('staff.reply_failed'))
+def get_target_customer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if context.args and context.args[0].isdigit():
+        return int(context.args[0])
+    if update.message.reply_to_message:
+        return support_relay.resolve_customer(update.message.reply_to_message)
+    return None
+async def close_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    update_logger.info("🔒 Вызов /close пользователем %s", update.effective_user.id)
+    if update.effective_user.id not in STAFF_IDS:
+        return
+    customer_id = get_target_customer(update, context)
+    if not customer_id:
+        await update.message.reply_text(staff_texts.text('staff.close_usage'))
+        return
+    closed = await support_relay.close(customer_id)
+    await update.message.reply_text(staff_texts.text('staff.closed', user_id=customer_id, count=closed))
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    update_logger.info("📜 Вызов /history пользователем %s", update.effective_user.id)
+    if update.effective_user.id not in STAFF_IDS:
+        return
+    customer_id = get_target_customer(update, context)
+    if not customer_id:
+        await update.message.reply_text(staff_texts.text('staff.history_usage'))
+        return
+    text, reply_markup = await support_relay.history_page(customer_id)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+async def history_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+    if query.from_user.id not in STAFF_IDS:
+        return
+    try:
+        _, customer_id, before = query.data.split('_')
+        text, reply_markup = await support_relay.history_page(int(customer_id), before)
+        await query.message.edit_text(text, reply_markup=reply_markup)
+    except Exception as e:
+        logger.error(f"Ошибка обработки страницы истории {query.data}: {e}")
+async def inbox_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    update_logger.info("📥 Вызов /inbox пользователем %s", update.effective_user.id)
+    if update.effective_user.id not in OWNER_IDS:
+        return
+    text, reply_markup = await render_inbox()
+    await update.message.reply_text(text, reply_markup=reply_markup)
+async def inbox_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    if query.from_user.id not in OWNER_IDS:
+        await query.answer()
+        return
+    try:
+        notice, text, reply_markup = await handle_inbox_action(query.data, query.from_user.id, support_relay)
+        await query.answer(notice)
+        await query.message.edit_text(text, reply_markup=reply_markup)
+    except Exception as e:
+        logger.error(f"Ошибка обработки действия входящих {query.data}: {e}")
+async def save_order(bot, user, order_id, items_text, total_uah, line_items):
+    """
+    Сохраняет заказ (или откладывает в журнал). Если исход неизвестен (обрыв во время транзакции),
+    клиент получает сообщение об ошибке вместо подтверждения, а персонал - заказ для ручной проверки.
+    """
+    try:
+        await asyncio.to_thread(place_order, user, order_id, items_text, total_uah, line_items)
+        profile_cache.put(user)
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка сохранения заказа {order_id}: {e}")
+    await notify_staff_order(bot, staff_texts.text(
+        'staff.order_save_failed', order_id=order_id, customer=user.username or user.first_name, user_id=user.id,
+        items=items_text, total_uah=total_uah
+    ))
+    t = user_texts(user)
+    try:
+        await bot.send_message(chat_id=user.id, text=t.text('order.save_failed'), reply_markup=t.keyboard('universal'))
+    except Exception as e:
+        logger.error(f"❌ Не удалось сообщить клиенту {user.id} об ошибке заказа {order_id}: {e}")
+    return False
+async def notify_staff_order(bot, order_text):
+    """Отправляет заказ владельцам и менеджеру. Возвращает True, если получил хотя бы один владелец."""
+    success = False
+    for owner_id in OWNER_IDS:
+        try:
+            await bot.send_message(chat_id=owner_id, text=order_text)
+            success = True
+            logger.info(f"✅ Уведомление о заказе отправлено владельцу {owner_id}")
+        except Exception as e:
+            logger.error(f"❌ Не удалось отправить заказ владельцу {owner_id}: {e}")
+    if MANAGER_ID:
+        try:
+            await bot.send_message(chat_id=MANAGER_ID, text=order_text)
+            logger.info(f"✅ Уведомление о заказе отправлено менеджеру {MANAGER_ID}")
+        except Exception as e:
+            logger.error(f"❌ Не удалось отправить заказ менеджеру {MANAGER_ID}: {e}")
+    return success
+async def pay_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    update_logger.info("💰 Вызов команды /pay пользователем %s", update.effective_user.id)
+    user = update.effective_user
+    await ensure_user_exists(user)
+    t = user_texts(user)
+    if not context.args:
+        await update.message.reply_text(t.text('pay.usage'))
+        return
+    order_id = context.args[0]
+    items_str = " ".join(context.args[1:])
+    pattern = r'(\w{2,4})-(\w{2,4})-([\w\s$]+?)-(\d+)'
+    items = re.findall(pattern, items_str)
+    if not items:
+        await update.message.reply_text(t.text('pay.unrecognized'))
+        return
+    total_uah = 0
+    order_details = []
+    line_items = []
+    for service_abbr, plan_abbr, period, price_str in items:
+        price = int(price_str)
+        total_uah += price
+        name = f"{service_abbr}-{plan_abbr}-{period}"
+        order_details.append(staff_texts.text('staff.pay_line', name=name, price=price))
+        line_items.append((name, 1, price))
+    order_text = staff_texts.text(
+        'staff.pay_order', order_id=order_id, customer=user.username or user.first_name, user_id=user.id,
+        items="\n".join(order_details), total_uah=total_uah
+    )
+    context.user_data['pending_order_from_command'] = {
+        'order_id': order_id,
+        'items_str': items_str,
+        'total_uah': total_uah,
+        'order_text': order_text
+    }
+    if not await save_order(context.bot, user, order_id, "\n".join(order_details), total_uah, line_items):
+        context.user_data.pop('pending_order_from_command', None)
+        return
+    success = await notify_staff_order(context.bot, order_text)
+    await update.message.reply_text(
+        t.text('pay.accepted' if success else 'pay.notify_failed'), reply_markup=t.keyboard('universal')
+    )
+    context.user_data.pop('pending_order_from_command', None)
+def main() -> None:
+    logger.info("🚀 Инициализация приложения бота...")
+    if not BOT_TOKEN or BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
+        logger.critical("🔑 BOT_TOKEN не установлен или имеет значение по умолчанию!")
+        return
+    if not DATABASE_URL or DATABASE_URL == "YOUR_DATABASE_URL_HERE":
+        logger.critical("💾 DATABASE_URL не установлен или имеет значение по умолчанию!")
+        return
+    store.init_schema()
+    if POSTGRES_BACKEND:
+        try:
+            partitions.setup()
+        except Exception as e:
+            logger.error(f"Ошибка настройки секционирования: {e}")
+    else:
+        logger.warning(
+            "💾 Хранилище SQLite: входящие (/inbox), рассылки, экспорт/импорт и история переписки "
+            "требуют Postgres и отключены"
+        )
+    if not NOWPAYMENTS_IPN_SECRET:
+        logger.warning("💸 NOWPAYMENTS_IPN_SECRET не установлен, IPN-уведомления будут отклоняться.")
+    if not ORDER_INTAKE_SECRET:
+        logger.warning(f"🌐 ORDER_INTAKE_SECRET не установлен, приём заказов с сайта ({INTAKE_PATH}) отключён.")
+    port = int(os.environ.get('PORT', 10000))
+    http_thread = Thread(target=start_http_server, args=(port,), daemon=True)
+    http_thread.start()
+    logger.info(f"🌐 HTTP сервер запущен в потоке на порту {port}")
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(update_processor)
+        .request(TimedRequest(admission, connection_pool_size=256))
+    )
+    if persistence:
+        builder.persistence(persistence)
+    application = builder.build()
+    admission.backlog = application.update_queue.qsize
+    application.add_handler(TypeHandler(Update, state_sweeper.touch), group=-3)
+    application.add_handler(TypeHandler(Update, flood_guard), group=-2)
+    application.add_handler(TypeHandler(Update, admission_gate), group=-1)
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("order", order_command))
+    application.add_handler(CommandHandler("question", question_command))
+    application.add_handler(CommandHandler("channel", channel_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("memory", memory_command))
+    application.add_handler(CommandHandler("pay", pay_command))
+    application.add_handler(CommandHandler("close", close_command))
+    if POSTGRES_BACKEND:
+        application.add_handler(CommandHandler("json", export_users_json))
+        application.add_handler(CommandHandler("export", export_command))
+        application.add_handler(MessageHandler(
+            filters.Document.ALL & filters.CaptionRegex(r'^/import\b') & filters.User(OWNER_IDS), import_document
+        ))
+        application.add_handler(CommandHandler("broadcast", broadcast_command))
+        application.add_handler(CommandHandler("history", history_command))
+        application.add_handler(CommandHandler("inbox", inbox_command))
+        application.add_handler(CallbackQueryHandler(history_callback, pattern=r'^hist_'))
+        application.add_handler(CallbackQueryHandler(inbox_callback, pattern=r'^inbox_'))
+        application.add_handler(CallbackQueryHandler(job_cancel_callback, pattern=r'^job_cancel_'))
+    application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_handler(InlineQueryHandler(inline_query))
+    application.add_handler(MessageHandler(
+        filters.TEXT & ~filters.COMMAND & filters.REPLY & filters.User(STAFF_IDS), staff_reply_handler
+    ))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    def user_commands_for(t):
+        return [BotCommand(command, t.text(f'command.{command}')) for command in ('start', 'help', 'order', 'question', 'channel')]
+    async def set_commands_menu(application):
+        user_commands = user_commands_for(staff_texts)
+        staff_commands = user_commands + [
+            BotCommand(command, staff_texts.text(f'command.{command}')) for command in ('history', 'close')
+        ]
+        owner_commands = staff_commands + [
+            BotCommand(command, staff_texts.text(f'command.{command}'))
+            for command in ('stats', 'inbox', 'json', 'export', 'broadcast', 'memory')
+        ]
+        if not POSTGRES_BACKEND:
+            staff_commands = [c for c in staff_commands if c.command not in POSTGRES_ONLY_COMMANDS]
+            owner_commands = [c for c in owner_commands if c.command not in POSTGRES_ONLY_COMMANDS]
+        try:
+            await application.bot.set_my_commands(user_commands)
+            # Клиенты с другим языком интерфейса Telegram видят меню на своей локали
+            for t in messages.bundles():
+                if t.locale != messages.default:
+                    await application.bot.set_my_commands(user_commands_for(t), language_code=t.locale)
+            for staff_id in STAFF_IDS:
+                if staff_id not in OWNER_IDS:
+                    await application.bot.set_my_commands(staff_commands, scope=BotCommandScopeChat(staff_id))
+            for owner_id in OWNER_IDS:
+                await application.bot.set_my_commands(owner_commands, scope=BotCommandScopeChat(owner_id))
+        except Exception as e:
+            logger.error(f"Ошибка установки команд меню: {e}")
+    async def post_init(application):
+        global http_client
+        http_client = httpx.AsyncClient(timeout=10, headers={'User-Agent': 'SecureShopBot-Keepalive/1.0'})
+        catalog_search.prepare(application.bot.username)
+        await set_commands_menu(application)
+        ipn_processor.start(application.bot, [MANAGER_ID] + OWNER_IDS)
+        state_sweeper.bind(application)
+        scheduler.every('deferred_writes', DEFERRED_INTERVAL, admission.run_deferred)
+        scheduler.every('ping', PING_INTERVAL, ping_self, jitter=PING_JITTER)
+        scheduler.every('state_sweep', state_sweeper.interval, state_sweeper.sweep)
+        scheduler.every('catalog_refresh', CATALOG_CHECK_INTERVAL, catalog_feed.refresh)
+        if POSTGRES_BACKEND:
+            broadcaster.start(application.bot)
+            await broadcaster.resume_unfinished()
+            await support_relay.load()
+            job_manager.start(application.bot)
+            scheduler.every('persistence_flush', persistence.flush_interval, persistence.flush)
+            scheduler.daily('partitions', partitions.PARTITION_MAINTENANCE_AT, partitions.maintain)
+            scheduler.every(
+                'spool_replay', SPOOL_REPLAY_INTERVAL,
+                functools.partial(write_spool.replay_pending, db.apply_spooled, db.breaker, db.SPOOL_TRANSIENT_ERRORS)
+            )
+            scheduler.every('spool_applied_purge', db.SPOOL_APPLIED_PURGE_INTERVAL, db.purge_spool_applied, first=300)
+            if ORDER_INTAKE_SECRET:
+                order_intake.start(application.bot.username)
+                scheduler.every('web_orders_purge', INTAKE_PURGE_INTERVAL, order_intake.purge, first=60)
+        scheduler.start()
+        # Остановка: сначала дожидаемся апдейтов и очередей, потом шаги в порядке регистрации
+        lifecycle.track('updates', admission.load)
+        lifecycle.track('ipn', ipn_processor.pending)
+        lifecycle.track('web_orders', order_intake.pending)
+        lifecycle.on_stop('scheduler', scheduler.shutdown)
+        lifecycle.on_stop('ipn', ipn_processor.stop)
+        if POSTGRES_BACKEND:
+            # Рассылки продолжатся с места остановки (resume_unfinished) на новом инстансе
+            lifecycle.on_stop('broadcasts', broadcaster.suspend)
+            lifecycle.on_stop('reports', job_manager.shutdown)
+        lifecycle.on_stop('deferred_writes', admission.flush_deferred)
+        if POSTGRES_BACKEND:
+            lifecycle.on_stop('spool', functools.partial(
+                write_spool.replay_pending, db.apply_spooled, db.breaker, db.SPOOL_TRANSIENT_ERRORS
+            ))
+        lifecycle.on_stop('store', store.close)
+        lifecycle.on_stop('http_client', http_client.aclose)
+        lifecycle.install_signal_handlers(application)
+        lifecycle.mark_ready()
+    async def post_stop(application):
+        # Апдейты обработаны, persistence PTB сбросит следом в Application.shutdown()
+        await lifecycle.run_stop_steps()
+    application.post_init = post_init
+    application.post_stop = post_stop
+    logger.info("🤖 Бот запущен. Нажмите Ctrl+C для остановки.")
+    application.run_polling(allowed_updates=Update.ALL_TYPES, stop_signals=None)
@@ -0,0 +1,162 @@
+# broadcast.py - Фоновые рассылки всем пользователям с ограничением скорости
+import os
+import time
+import asyncio
+import logging
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
+import db
+
+logger = logging.getLogger(__name__)
+
+# Лимит Telegram ~30 сообщений/с на бота; оставляем запас для ответов покупателям
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', 25))
+BROADCAST_BURST = int(os.environ.get('BROADCAST_BURST', 5))
+BROADCAST_FETCH_SIZE = 500
+# Статусы сохраняются пачками: при падении повторно уйдёт не больше одной пачки
+BROADCAST_CHUNK_SIZE = 25
+BROADCAST_MAX_ATTEMPTS = 3
+
+class TokenBucket:
+    """Глобальный token bucket для исходящих сообщений."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Останавливает выдачу токенов (RetryAfter от Telegram)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class Broadcaster:
+    """Запускает рассылки как фоновые задачи и возобновляет прерванные."""
+
+    def __init__(self, rate=BROADCAST_RATE, burst=BROADCAST_BURST, on_blocked=None):
+        self.bucket = TokenBucket(rate, burst)
+        # Вызывается с user_id пользователя, заблокировавшего бота
+        self.on_blocked = on_blocked
+        self._bot = None
+        self._tasks = {}
+        self._progress = {}
+        self._suspended = False
+
+    def start(self, bot):
+        self._bot = bot
+
+    def active(self):
+        """Возвращает {broadcast_id: {'sent': .., 'failed': .., 'blocked': ..}} по текущим рассылкам."""
+        return {bid: dict(self._progress[bid]) for bid in self._tasks}
+
+    def launch(self, broadcast_id, text, created_by):
+        if broadcast_id in self._tasks:
+            return
+        self._progress[broadcast_id] = {'sent': 0, 'failed': 0, 'blocked': 0}
+        task = asyncio.get_running_loop().create_task(self._run(broadcast_id, text, created_by))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def resume_unfinished(self):
+        for row in await asyncio.to_thread(db.get_unfinished_broadcasts):
+            logger.info(f"📣 Возобновление рассылки #{row['id']}")
+            self.launch(row['id'], row['text'], row['created_by'])
+
+    def cancel(self, broadcast_id=None):
+        """Отменяет рассылку (или все, если ID не указан). Возвращает число отменённых."""
+        ids = [broadcast_id] if broadcast_id is not None else list(self._tasks)
+        cancelled = 0
+        for bid in ids:
+            task = self._tasks.get(bid)
+            if task:
+                task.cancel()
+                cancelled += 1
+        return cancelled
+
+    async def _deliver(self, user_id, text):
+        for _ in range(BROADCAST_MAX_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await self._bot.send_message(chat_id=user_id, text=text)
+                return 'sent'
+            except RetryAfter as e:
+                logger.warning(f"⏳ Рассылка: RetryAfter {e.retry_after}с")
+                self.bucket.pause(float(e.retry_after))
+            except Forbidden:
+                return 'blocked'
+            except BadRequest as e:
+                logger.debug(f"Рассылка: пользователь {user_id} недоступен: {e}")
+                return 'failed'
+            except (TimedOut, NetworkError) as e:
+                logger.warning(f"⚠️ Рассылка: сетевая ошибка для {user_id}: {e}")
+                await asyncio.sleep(1)
+        return 'failed'
+
+    async def suspend(self):
+        """Прерывает рассылки при остановке бота; они остаются 'running' и продолжатся после перезапуска."""
+        self._suspended = True
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, broadcast_id, text, created_by):
+        progress = self._progress[broadcast_id]
+        recipients = db.stream_broadcast_recipients(broadcast_id, BROADCAST_FETCH_SIZE)
+        status = 'finished'
+        logger.info(f"📣 Рассылка #{broadcast_id} запущена")
+        try:
+            while True:
+                batch = await asyncio.to_thread(next, recipients, None)
+                if batch is None:
+                    break
+                for i in range(0, len(batch), BROADCAST_CHUNK_SIZE):
+                    chunk = batch[i:i + BROADCAST_CHUNK_SIZE]
+                    results = await asyncio.gather(*(self._deliver(uid, text) for uid in chunk))
+                    await asyncio.to_thread(db.record_broadcast_deliveries, broadcast_id, list(zip(chunk, results)))
+                    for uid, result in zip(chunk, results):
+                        progress[result] += 1
+                        if result == 'blocked' and self.on_blocked:
+                            self.on_blocked(uid)
+        except asyncio.CancelledError:
+            if self._suspended:
+                logger.info(f"📣 Рассылка #{broadcast_id} приостановлена до перезапуска: {progress}")
+                return
+            status = 'cancelled'
+        except Exception as e:
+            # Рассылка остаётся в статусе 'running' и продолжится после перезапуска
+            logger.error(f"❌ Рассылка #{broadcast_id} прервана: {e}")
+            return
+        finally:
+            await asyncio.to_thread(recipients.close)
+        await asyncio.to_thread(db.finish_broadcast, broadcast_id, status)
+        logger.info(f"📣 Рассылка #{broadcast_id} завершена ({status}): {progress}")
+        if created_by:
+            try:
+                await self._bot.send_message(
+                    chat_id=created_by,
+                    text=(
+                        f"📣 Розсилку #{broadcast_id} {'завершено' if status == 'finished' else 'скасовано'}.\n"
+                        f"✅ Доставлено: {progress['sent']}\n"
+                        f"🚫 Заблокували бота: {progress['blocked']}\n"
+                        f"❌ Помилки: {progress['failed']}"
+                    )
+                )
+            except Exception as e:
+                logger.error(f"❌ Не удалось отправить отчёт о рассылке {created_by}: {e}")
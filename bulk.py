@@ -0,0 +1,179 @@
+# bulk.py - Массовый импорт/экспорт users и orders через COPY
+#
+# Импорт (CSV с заголовком или NDJSON, можно .gz):
+#   python bulk.py import users old_shop_users.csv
+#   python bulk.py import orders old_shop_orders.ndjson.gz
+# Экспорт (CSV с заголовком, сжатый gzip):
+#   python bulk.py export users backups/users-2024-05-01.csv.gz
+# У импортированного заказа одна позиция order_items (items, 1 шт., total_uah), как у заказа
+# из одной строки, а счётчик bot_stats.total_orders увеличивается на число добавленных заказов.
+import io
+import sys
+import csv
+import gzip
+import json
+import logging
+import argparse
+from config import DATABASE_URL
+from db import connect, connect_read
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Колонки, участвующие в импорте/экспорте; required - обязательные при импорте
+TABLES = {
+    'users': {
+        'columns': ('id', 'username', 'first_name', 'last_name', 'language_code', 'is_bot', 'created_at', 'updated_at'),
+        'required': ('id',),
+        'merge': """
+            INSERT INTO users (id, username, first_name, last_name, language_code, is_bot, created_at, updated_at)
+            SELECT DISTINCT ON (id)
+                id, username, first_name, last_name, language_code,
+                COALESCE(is_bot, FALSE), COALESCE(created_at, NOW()), COALESCE(updated_at, NOW())
+            FROM bulk_staging
+            WHERE id IS NOT NULL
+            ORDER BY id, updated_at DESC NULLS LAST
+            ON CONFLICT (id) DO UPDATE SET
+                username = EXCLUDED.username,
+                first_name = EXCLUDED.first_name,
+                last_name = EXCLUDED.last_name,
+                language_code = EXCLUDED.language_code,
+                created_at = LEAST(users.created_at, EXCLUDED.created_at),
+                updated_at = GREATEST(users.updated_at, EXCLUDED.updated_at)
+        """,
+    },
+    'orders': {
+        'columns': ('user_id', 'order_id', 'items', 'total_uah', 'status', 'created_at'),
+        'required': ('user_id', 'order_id'),
+        # У orders нет естественного ключа: уже загруженным считается заказ с тем же
+        # (user_id, order_id, created_at), а для строк без created_at (при вставке им
+        # достаётся NOW()) - с тем же (user_id, order_id); заказы неизвестных пользователей пропускаются
+        'merge': """
+            WITH inserted AS (
+                INSERT INTO orders (user_id, order_id, items, total_uah, status, created_at)
+                SELECT DISTINCT ON (s.user_id, s.order_id, s.created_at)
+                    s.user_id, s.order_id, s.items, s.total_uah,
+                    COALESCE(s.status, 'created'), COALESCE(s.created_at, NOW())
+                FROM bulk_staging s
+                JOIN users u ON u.id = s.user_id
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM orders o
+                    WHERE o.user_id = s.user_id AND o.order_id = s.order_id
+                    AND (s.created_at IS NULL OR o.created_at = s.created_at)
+                )
+                RETURNING id, items, total_uah
+            )
+            INSERT INTO order_items (order_ref, position, name, quantity, price_uah)
+            SELECT id, 1, COALESCE(items, ''), 1, COALESCE(total_uah, 0) FROM inserted
+        """,
+        # Выполняется в той же транзакции с числом добавленных строк
+        'counter': "UPDATE bot_stats SET total_orders = total_orders + %s, updated_at = NOW()",
+    },
+}
+
+def _table(name):
+    if name not in TABLES:
+        raise ValueError(f"Неизвестная таблица: {name} (доступны: {', '.join(TABLES)})")
+    return TABLES[name]
+
+def _open(path, mode='rb'):
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+    return gzip.open(path, mode) if compressed else open(path, mode)
+
+def _detect_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'ndjson' if name.endswith(('.ndjson', '.jsonl', '.json')) else 'csv'
+
+def _copy_csv(cur, source, columns):
+    header = source.readline().decode('utf-8-sig')
+    file_columns = [column.strip() for column in next(csv.reader([header]), [])]
+    unknown = set(file_columns) - set(columns)
+    if unknown:
+        raise ValueError(f"Неизвестные колонки в CSV: {', '.join(sorted(unknown))}")
+    # Данные после заголовка передаются серверу как есть, без разбора в Python
+    with cur.copy(f"COPY bulk_staging ({', '.join(file_columns)}) FROM STDIN WITH (FORMAT csv)") as copy:
+        while chunk := source.read(COPY_CHUNK_SIZE):
+            copy.write(chunk)
+    return file_columns
+
+def _copy_ndjson(cur, source, columns):
+    with cur.copy(f"COPY bulk_staging ({', '.join(columns)}) FROM STDIN") as copy:
+        for line in io.TextIOWrapper(source, encoding='utf-8'):
+            if line.strip():
+                record = json.loads(line)
+                copy.write_row([record.get(column) for column in columns])
+    return list(columns)
+
+def import_file(table, path, file_format=None):
+    """
+    Загружает файл во временную таблицу через COPY FROM STDIN и сливает её с table
+    одним INSERT ... SELECT. Возвращает (строк в файле, добавлено/обновлено строк).
+    """
+    spec = _table(table)
+    columns = spec['columns']
+    file_format = file_format or _detect_format(path)
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"CREATE TEMP TABLE bulk_staging ON COMMIT DROP AS "
+                f"SELECT {', '.join(columns)} FROM {table} WITH NO DATA"
+            )
+            with _open(path) as source:
+                if file_format == 'ndjson':
+                    loaded_columns = _copy_ndjson(cur, source, columns)
+                else:
+                    loaded_columns = _copy_csv(cur, source, columns)
+            missing = set(spec['required']) - set(loaded_columns)
+            if missing:
+                raise ValueError(f"В файле нет обязательных колонок: {', '.join(sorted(missing))}")
+            cur.execute("SELECT COUNT(*) FROM bulk_staging")
+            staged = cur.fetchone()[0]
+            cur.execute("ANALYZE bulk_staging")
+            cur.execute(spec['merge'])
+            merged = cur.rowcount
+            if merged and 'counter' in spec:
+                cur.execute(spec['counter'], (merged,))
+        conn.commit()
+    logger.info(f"📥 Импорт {table}: {staged} строк в файле, {merged} записано")
+    return staged, merged
+
+def export_file(table, path):
+    """Выгружает table в CSV с заголовком через COPY TO STDOUT, сжимая поток gzip на лету."""
+    columns = _table(table)['columns']
+    # Экспорт читает с реплики (если настроена), не конкурируя с записью заказов
+    with connect_read() as conn:
+        with conn.cursor() as cur:
+            query = f"SELECT {', '.join(columns)} FROM {table} ORDER BY {columns[0]}"
+            with gzip.open(path, 'wb', compresslevel=6) as target:
+                with cur.copy(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)") as copy:
+                    for chunk in copy:
+                        target.write(chunk)
+            rows = cur.rowcount
+    logger.info(f"📤 Экспорт {table}: {rows} строк в {path}")
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Массовый импорт/экспорт users и orders через COPY")
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    import_parser = subparsers.add_parser('import', help="Загрузить CSV/NDJSON (можно .gz)")
+    import_parser.add_argument('table', choices=TABLES)
+    import_parser.add_argument('path')
+    import_parser.add_argument('--format', choices=('csv', 'ndjson'))
+    export_parser = subparsers.add_parser('export', help="Выгрузить в CSV, сжатый gzip")
+    export_parser.add_argument('table', choices=TABLES)
+    export_parser.add_argument('path')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    if not DATABASE_URL:
+        sys.exit("DATABASE_URL не задан")
+    if args.action == 'import':
+        staged, merged = import_file(args.table, args.path, args.format)
+        print(f"{args.table}: {staged} строк в файле, {merged} записано")
+    else:
+        rows = export_file(args.table, args.path)
+        print(f"{args.table}: {rows} строк -> {args.path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# catalog_feed.py - Каталог для сайта: GET /catalog.json с ETag и условными запросами
+#
+# Сайт и CDN опрашивают каталог с If-None-Match и, пока цены не менялись, получают 304 без тела.
+# Тело (JSON и его gzip-версия) и ETag вычисляются заранее и пересобираются только при изменении
+# SUBSCRIPTIONS / DIGITAL_PRODUCTS / аббревиатур /pay.
+import os
+import json
+import gzip
+import time
+import hashlib
+import logging
+import threading
+from email.utils import formatdate
+from catalog_search import subscription_sku, digital_sku
+
+logger = logging.getLogger(__name__)
+
+CATALOG_PATH = "/catalog.json"
+CATALOG_MAX_AGE = int(os.environ.get('CATALOG_MAX_AGE', 60))
+# Как часто (секунды) планировщик сверяет исходные словари с собранным каталогом
+CATALOG_CHECK_INTERVAL = 30
+
+def build_document(subscriptions, digital_products, service_abbr, plan_abbr):
+    """Каталог в виде для сайта: sku совпадают с ключами, которые принимает /api/orders."""
+    return {
+        'currency': 'UAH',
+        'subscriptions': [
+            {
+                'key': service_key,
+                'name': service['name'],
+                'plans': [
+                    {
+                        'key': plan_key,
+                        'name': plan['name'],
+                        'description': plan.get('description', ''),
+                        'options': [
+                            {
+                                'sku': subscription_sku(service_key, plan_key, n),
+                                'period': option['period'],
+                                'price_uah': option['price'],
+                            }
+                            for n, option in enumerate(plan.get('options', []))
+                        ],
+                    }
+                    for plan_key, plan in service['plans'].items()
+                ],
+            }
+            for service_key, service in subscriptions.items()
+        ],
+        'digital': [
+            {
+                'sku': digital_sku(product_key),
+                'name': product['name'],
+                'category': product.get('category'),
+                'price_uah': product['price'],
+            }
+            for product_key, product in digital_products.items()
+        ],
+        'pay_abbreviations': {'services': service_abbr, 'plans': plan_abbr},
+    }
+
+class CatalogFeed:
+    """
+    Готовый ответ GET /catalog.json. sources - функция, возвращающая аргументы build_document;
+    документ пересобирается (refresh, по расписанию), только если их содержимое изменилось.
+    """
+
+    def __init__(self, sources):
+        self.sources = sources
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        # (etag, body, gzip_etag, gzip_body, last_modified) одной сборки - публикуются вместе
+        self._current = (None, b'', None, b'', None)
+        self.builds = 0
+        self.not_modified = 0
+        self.served = 0
+        self.refresh()
+
+    def refresh(self):
+        """Пересобирает каталог, если исходные данные изменились. Возвращает True при пересборке."""
+        with self._lock:
+            sources = self.sources()
+            fingerprint = hashlib.sha256(
+                json.dumps(sources, sort_keys=True, ensure_ascii=False).encode('utf-8')
+            ).hexdigest()
+            if fingerprint == self._fingerprint:
+                return False
+            body = json.dumps(build_document(*sources), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            digest = hashlib.sha256(body).hexdigest()[:32]
+            # mtime=0 - одинаковый каталог даёт побайтно одинаковый gzip на всех инстансах
+            gzip_body = gzip.compress(body, compresslevel=9, mtime=0)
+            etag = f'"{digest}"'
+            # У сжатого представления свой строгий ETag
+            self._current = (etag, body, f'"{digest}-gz"', gzip_body, formatdate(time.time(), usegmt=True))
+            self._fingerprint = fingerprint
+            self.builds += 1
+        logger.info(f"🗂️ Каталог для сайта собран: {len(body)} байт, gzip {len(gzip_body)} байт, ETag {etag}")
+        return True
+
+    @staticmethod
+    def matches(if_none_match, etag):
+        """Совпадает ли If-None-Match с ETag отдаваемого представления."""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        # If-None-Match сравнивается слабо: W/"x" совпадает с "x"
+        return etag in {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+
+    def response(self, headers):
+        """Возвращает (код, заголовки, тело) для запроса с заголовками headers."""
+        # Одна сборка на весь ответ: refresh в другом потоке не смешает ETag и тело разных версий
+        with self._lock:
+            etag, body, gzip_etag, gzip_body, last_modified = self._current
+        use_gzip = 'gzip' in (headers.get('Accept-Encoding') or '')
+        if use_gzip:
+            etag, body = gzip_etag, gzip_body
+        response_headers = {
+            'ETag': etag,
+            'Cache-Control': f"public, max-age={CATALOG_MAX_AGE}, stale-while-revalidate={CATALOG_MAX_AGE * 5}",
+            'Vary': 'Accept-Encoding',
+            'Last-Modified': last_modified,
+        }
+        if self.matches(headers.get('If-None-Match'), etag):
+            self.not_modified += 1
+            return 304, response_headers, b''
+        self.served += 1
+        response_headers['Content-Type'] = 'application/json; charset=utf-8'
+        if use_gzip:
+            response_headers['Content-Encoding'] = 'gzip'
+        return 200, response_headers, body
+
+    def stats(self):
+        return {'etag': self._current[0], 'builds': self.builds, 'served': self.served, 'not_modified': self.not_modified}
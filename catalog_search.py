@@ -0,0 +1,172 @@
+# catalog_search.py - Инлайн-поиск по каталогу: @bot netflix, @bot psn 2000
+#
+# Индекс строится один раз при старте из SUBSCRIPTIONS и DIGITAL_PRODUCTS и живёт в памяти:
+# префиксный (каждый префикс каждого слова -> записи) и по триграммам для запросов с опечатками.
+# Готовые InlineQueryResult создаются в prepare() - на запрос остаётся только поиск по словарям.
+import os
+import re
+import time
+import logging
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+)
+
+logger = logging.getLogger(__name__)
+
+# Telegram кэширует ответ на одинаковый запрос у себя и не присылает его боту повторно
+INLINE_CACHE_TIME = int(os.environ.get('INLINE_CACHE_TIME', 300))
+# Больше 50 результатов Telegram не принимает
+INLINE_MAX_RESULTS = 50
+# Доля общих триграмм, при которой слово с опечаткой считается совпадением
+TRIGRAM_MIN_SIMILARITY = 0.5
+# Параметр /start из ссылки "Замовити": buy_<ключ записи>
+DEEP_LINK_PREFIX = 'buy_'
+
+WORD_RE = re.compile(r'\w+')
+
+def normalize_words(text):
+    return WORD_RE.findall(text.casefold())
+
+def subscription_sku(service_key, plan_key, option_index):
+    return f"s_{service_key}_{plan_key}_{option_index}"
+
+def digital_sku(product_key):
+    return f"d_{product_key}"
+
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class CatalogEntry:
+    __slots__ = ('key', 'title', 'description', 'text', 'price', 'callback_data', 'button_text', 'words', 'result')
+
+    def __init__(self, key, title, description, price, callback_data, button_text, search_text):
+        self.key = key
+        self.title = title
+        self.description = description
+        self.text = f"🛒 {title}\n💰 {price} UAH"
+        self.price = price
+        self.callback_data = callback_data
+        self.button_text = button_text
+        self.words = tuple(dict.fromkeys(normalize_words(search_text)))
+        self.result = None
+
+def build_entries(subscriptions, digital_products):
+    """Одна запись на каждый вариант подписки (сервис, план, период) и на каждый цифровой товар."""
+    entries = []
+    for service_key, service in subscriptions.items():
+        for plan_key, plan in service['plans'].items():
+            for n, option in enumerate(plan.get('options', [])):
+                period, price = option['period'], option['price']
+                entries.append(CatalogEntry(
+                    key=subscription_sku(service_key, plan_key, n),
+                    title=f"{service['name']} {plan['name']} - {period}",
+                    description=f"{price} UAH · {plan.get('description', '')}",
+                    price=price,
+                    # Те же callback_data, что и в меню /order: дальше работает обычное оформление
+                    callback_data=f"add_{service_key}_{plan_key}_{period.replace(' ', '_')}_{price}",
+                    button_text=f"{period} - {price} UAH",
+                    search_text=f"{service_key} {service['name']} {plan['name']} {period} {price}",
+                ))
+    for product_key, product in digital_products.items():
+        entries.append(CatalogEntry(
+            key=digital_sku(product_key),
+            title=product['name'],
+            description=f"{product['price']} UAH · Цифровий товар",
+            price=product['price'],
+            callback_data=f"digital_{product_key}",
+            button_text=f"{product['name']} - {product['price']} UAH",
+            search_text=f"{product_key.replace('_', ' ')} {product['name']} {product['price']}",
+        ))
+    return entries
+
+class CatalogSearch:
+    """Поиск по каталогу в памяти; все слова запроса должны совпасть (по префиксу или по триграммам)."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self._by_key = {entry.key: entry for entry in entries}
+        self._words = {}
+        self._prefixes = {}
+        self._trigrams = {}
+        for n, entry in enumerate(entries):
+            for word in entry.words:
+                self._words.setdefault(word, set()).add(n)
+                for end in range(1, len(word) + 1):
+                    self._prefixes.setdefault(word[:end], set()).add(n)
+                for gram in trigrams(word):
+                    self._trigrams.setdefault(gram, set()).add(n)
+        self.queries = 0
+        self.lookup_time = 0.0
+
+    def prepare(self, bot_username):
+        """Создаёт готовые результаты; кнопка ведёт в чат с ботом через /start buy_<ключ>."""
+        for entry in self.entries:
+            url = f"https://t.me/{bot_username}?start={DEEP_LINK_PREFIX}{entry.key}"
+            entry.result = InlineQueryResultArticle(
+                id=entry.key,
+                title=entry.title,
+                description=entry.description,
+                input_message_content=InputTextMessageContent(entry.text),
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🛒 Замовити", url=url)]]),
+            )
+
+    def get(self, key):
+        return self._by_key.get(key)
+
+    def from_deep_link(self, payload):
+        if payload and payload.startswith(DEEP_LINK_PREFIX):
+            return self.get(payload[len(DEEP_LINK_PREFIX):])
+        return None
+
+    def _match_word(self, word):
+        """Возвращает {номер записи: вес} для одного слова запроса."""
+        hits = self._prefixes.get(word)
+        if hits:
+            # Слово целиком весит больше, чем префикс: "14" выше "145"
+            matched = dict.fromkeys(hits, 2.0)
+            for n in self._words.get(word, ()):
+                matched[n] = 3.0
+            return matched
+        if len(word) < 3:
+            return {}
+        grams = trigrams(word)
+        shared = {}
+        for gram in grams:
+            for n in self._trigrams.get(gram, ()):
+                shared[n] = shared.get(n, 0) + 1
+        return {n: count / len(grams) for n, count in shared.items() if count / len(grams) >= TRIGRAM_MIN_SIMILARITY}
+
+    def search(self, query, limit=INLINE_MAX_RESULTS):
+        started = time.perf_counter()
+        words = normalize_words(query)
+        if not words:
+            found = self.entries[:limit]
+        else:
+            scores = None
+            for word in words:
+                matched = self._match_word(word)
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = {n: score + matched[n] for n, score in scores.items() if n in matched}
+                if not scores:
+                    break
+            ranked = sorted(scores, key=lambda n: (-scores[n], n))[:limit]
+            found = [self.entries[n] for n in ranked]
+        self.queries += 1
+        self.lookup_time += time.perf_counter() - started
+        return found
+
+    def results(self, query):
+        return [entry.result for entry in self.search(query) if entry.result is not None]
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'queries': self.queries,
+            'avg_lookup_us': round(self.lookup_time / self.queries * 1e6, 1) if self.queries else 0,
+        }
@@ -0,0 +1,65 @@
+# concurrency.py - Параллельная обработка апдейтов с сохранением порядка для каждого пользователя
+import os
+import asyncio
+import logging
+from admission import AdmissionUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+UPDATE_CONCURRENCY = int(os.environ.get('UPDATE_CONCURRENCY', 32))
+# Сколько апдейтов одного пользователя может ждать своей очереди;
+# лишние отбрасываются, чтобы один пользователь не занял все слоты
+MAX_PENDING_PER_USER = int(os.environ.get('MAX_PENDING_PER_USER', 10))
+
+class PerUserUpdateProcessor(AdmissionUpdateProcessor):
+    """
+    Апдейты разных пользователей обрабатываются параллельно (до max_concurrent_updates),
+    а апдейты одного пользователя - строго последовательно в порядке поступления,
+    поэтому context.user_data (conversation_type, pending_order, ...) не гоняется.
+    Слот семафора берётся только после очереди пользователя: один пользователь занимает
+    не больше одного слота и не задерживает остальных.
+    """
+
+    __slots__ = ("_locks", "dropped")
+
+    def __init__(self, controller, max_concurrent_updates=UPDATE_CONCURRENCY):
+        super().__init__(controller, max_concurrent_updates)
+        # key -> [asyncio.Lock, число апдейтов, ожидающих или держащих блокировку]
+        self._locks = {}
+        self.dropped = 0
+
+    @staticmethod
+    def update_key(update):
+        user = getattr(update, 'effective_user', None)
+        if user:
+            return user.id
+        chat = getattr(update, 'effective_chat', None)
+        return chat.id if chat else None
+
+    def active_keys(self):
+        return len(self._locks)
+
+    async def admit(self, update, coroutine):
+        key = self.update_key(update)
+        if key is None:
+            await super().admit(update, coroutine)
+            return
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        if entry[1] >= MAX_PENDING_PER_USER:
+            self.dropped += 1
+            logger.warning(f"🚦 Слишком много апдейтов в очереди пользователя {key}, апдейт отброшен")
+            coroutine.close()
+            return
+        entry[1] += 1
+        try:
+            # Очередь пользователя - до семафора: ожидающие апдейты одного пользователя
+            # не занимают слоты, и он держит не больше одного слота за раз.
+            # asyncio.Lock будит ожидающих в порядке FIFO - порядок апдейтов сохраняется
+            async with entry[0]:
+                await super().admit(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(key, None)
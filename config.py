@@ -18,3 +18,14 @@ NOWPAYMENTS_IPN_SECRET = os.getenv('NOWPAYMENTS_IPN_SECRET')
 PAYMENT_CURRENCY = "UAH"  # Изменено с USD на UAH
 # Card number for manual payment simulation
 CARD_NUMBER = "5355 2800 4715 6045"
+# Support routing: дополнительные сотрудники и рабочие часы
+# SUPPORT_STAFF_IDS="111,222"; SUPPORT_WORKING_HOURS="111=09:00-18:00,222=18:00-02:00"
+SUPPORT_STAFF_IDS = [int(id) for id in os.getenv('SUPPORT_STAFF_IDS', '').split(',') if id.strip()]
+SUPPORT_WORKING_HOURS = os.getenv('SUPPORT_WORKING_HOURS', '')
+SUPPORT_TIMEZONE = os.getenv('SUPPORT_TIMEZONE', 'Europe/Kyiv')
+# Реплика для чтения отчётов/экспортов владельцев (необязательно)
+DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL')
+# При отставании реплики больше этого (секунды) чтение идёт с основной БД
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 30))
+# Общий секрет сайта для подписи заказов, отправляемых в /api/orders (см. intake.py)
+ORDER_INTAKE_SECRET = os.getenv('ORDER_INTAKE_SECRET')
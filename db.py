@@ -1,15 +1,264 @@
 # db.py
+import os
+import time
 import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import psycopg
 from psycopg.rows import dict_row
-from config import DATABASE_URL
+from psycopg.pq import TransactionStatus
+from config import DATABASE_URL, DATABASE_REPLICA_URL, REPLICA_MAX_LAG
+from spool import CircuitBreaker
 
 logger = logging.getLogger(__name__)
 
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', 5))
+
+class DatabaseUnavailable(psycopg.OperationalError):
+    """
+    Запрос заведомо не дошёл до БД: предохранитель открыт, подключиться не удалось или нет
+    свободного соединения. Такую запись можно отложить в журнал без риска применить её дважды.
+    """
+
+breaker = CircuitBreaker()
+
+def connect():
+    """
+    Подключение к основной БД через предохранитель: пока БД недоступна,
+    сразу бросает DatabaseUnavailable вместо ожидания таймаута подключения.
+    """
+    if not breaker.allow():
+        raise DatabaseUnavailable("база данных недоступна")
+    try:
+        conn = psycopg.connect(DATABASE_URL, connect_timeout=DB_CONNECT_TIMEOUT)
+    except psycopg.OperationalError as e:
+        breaker.record_failure()
+        raise DatabaseUnavailable(f"не удалось подключиться к базе данных: {e}") from e
+    breaker.record_success()
+    return conn
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+
+class PoolTimeout(DatabaseUnavailable):
+    """Свободное соединение пула не освободилось за отведённое время."""
+
+class ConnectionPool:
+    """
+    Постоянные соединения к одной БД для потоков-обработчиков: соединение берётся на одну
+    транзакцию и возвращается, поэтому подключение не оплачивается на каждый запрос, а
+    подготовленные запросы живут вместе с соединением. Одновременно открыто не больше max_size
+    соединений; сломанные и закрытые отбрасываются, новые открываются по требованию.
+    """
+
+    def __init__(self, connect, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, breaker=None):
+        self._connect = connect
+        self.breaker = breaker
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.waits = 0
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise DatabaseUnavailable("пул соединений закрыт")
+                while self._idle:
+                    conn = self._idle.pop()
+                    if not (conn.closed or conn.broken):
+                        return conn
+                    self._size -= 1
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"нет свободного соединения за {self.timeout:g}с")
+                self.waits += 1
+                self._cond.wait(remaining)
+        # Подключение - вне блокировки, чтобы не задерживать возврат соединений другими потоками
+        try:
+            return self._connect()
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, conn):
+        reusable = not (conn.closed or conn.broken)
+        if reusable and conn.info.transaction_status != TransactionStatus.IDLE:
+            try:
+                conn.rollback()
+            except psycopg.Error:
+                reusable = False
+        with self._cond:
+            reusable = reusable and not self._closed
+            if reusable:
+                self._idle.append(conn)
+            else:
+                self._size -= 1
+            self._cond.notify()
+        if not reusable:
+            conn.close()
+
+    def connection(self):
+        """
+        Соединение на одну транзакцию (`with pool.connection() as conn`): как `with psycopg.connect()` -
+        commit при успехе, rollback при ошибке. Ошибка подключения бросается сразу, до входа в with.
+        С breaker обрыв соединения посреди транзакции считается неудачей, как и ошибка подключения,
+        а пока предохранитель открыт, готовые соединения тоже не выдаются.
+        """
+        # Пробное подключение в half_open делает connect(), поэтому здесь - только проверка состояния
+        if self.breaker is not None and self.breaker.state == 'open':
+            raise DatabaseUnavailable("база данных недоступна")
+        return self._lease(self._acquire())
+
+    @contextmanager
+    def _lease(self, conn):
+        try:
+            yield conn
+            if conn.info.transaction_status == TransactionStatus.INTRANS:
+                conn.commit()
+        except psycopg.OperationalError:
+            # Ошибки запроса (таймауты, блокировки) - тоже OperationalError, но соединение они не ломают
+            if self.breaker is not None and (conn.closed or conn.broken):
+                self.breaker.record_failure()
+            raise
+        else:
+            if self.breaker is not None and self.breaker.state != 'closed':
+                self.breaker.record_success()
+        finally:
+            self._release(conn)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        return {'size': self._size, 'idle': len(self._idle), 'max_size': self.max_size, 'waits': self.waits}
+
+# Соединения основной БД для частых коротких транзакций (оформление заказов)
+primary_pool = ConnectionPool(connect, breaker=breaker)
+
+REPLICA_CHECK_INTERVAL = 15
+REPLICA_CONNECT_TIMEOUT = 3
+REPLICA_POOL_SIZE = int(os.environ.get('REPLICA_POOL_SIZE', 4))
+
+class ReplicaRouter:
+    """
+    Выбирает, куда отправлять чтение, терпимое к отставанию (отчёты, экспорты, входящие).
+    Реплика используется, пока она доступна и отстаёт не больше max_lag секунд;
+    состояние проверяется не чаще раза в check_interval, иначе - основная БД.
+    Соединения к реплике переиспользуются через пул (REPLICA_POOL_SIZE).
+    """
+
+    def __init__(self, replica_url, max_lag=REPLICA_MAX_LAG, check_interval=REPLICA_CHECK_INTERVAL):
+        self.replica_url = replica_url
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._healthy = False
+        self._lag = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._pool = ConnectionPool(self._connect_replica, max_size=REPLICA_POOL_SIZE)
+        self.fallbacks = 0
+
+    def _connect_replica(self):
+        return psycopg.connect(self.replica_url, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+
+    def _check(self):
+        try:
+            with psycopg.connect(self.replica_url, connect_timeout=REPLICA_CONNECT_TIMEOUT) as conn:
+                # Без новых записей на основной БД время последнего воспроизведения стареет,
+                # поэтому полностью догнавшая реплика считается отстающей на 0
+                row = conn.execute("""
+                    SELECT CASE
+                        WHEN NOT pg_is_in_recovery() THEN 0
+                        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                        ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+                    END::float
+                """).fetchone()
+            self._lag = row[0]
+            healthy = self._lag <= self.max_lag
+            if not healthy:
+                logger.warning(f"🐢 Реплика отстаёт на {self._lag:.1f}с, чтение переключено на основную БД")
+        except Exception as e:
+            logger.warning(f"🐢 Реплика недоступна, чтение переключено на основную БД: {e}")
+            self._lag = None
+            healthy = False
+        if healthy and not self._healthy:
+            logger.info("📖 Чтение отчётов идёт с реплики")
+        self._healthy = healthy
+
+    def use_replica(self):
+        if not self.replica_url:
+            return False
+        if time.monotonic() - self._checked_at > self.check_interval and self._lock.acquire(blocking=False):
+            try:
+                self._checked_at = time.monotonic()
+                self._check()
+            finally:
+                self._lock.release()
+        return self._healthy
+
+    def mark_down(self, error):
+        logger.warning(f"🐢 Ошибка подключения к реплике, чтение переключено на основную БД: {error}")
+        self._healthy = False
+        self._checked_at = time.monotonic()
+
+    def connection(self):
+        """Соединение для чтения из пула: реплика, если она в порядке, иначе основная БД."""
+        if self.use_replica():
+            try:
+                return self._pool.connection()
+            except PoolTimeout:
+                # Реплика исправна, но все соединения заняты - это чтение идёт с основной БД
+                pass
+            except psycopg.OperationalError as e:
+                self.mark_down(e)
+        if self.replica_url:
+            self.fallbacks += 1
+        return primary_pool.connection()
+
+    def close(self):
+        self._pool.close()
+
+    def stats(self):
+        return {
+            'configured': bool(self.replica_url),
+            'healthy': self._healthy,
+            'lag': self._lag,
+            'fallbacks': self.fallbacks,
+            'pool': self._pool.stats(),
+        }
+
+replica_router = ReplicaRouter(DATABASE_REPLICA_URL)
+
+def connect_read(primary=False):
+    """
+    Соединение из пула для чтения, допускающего небольшое отставание (`with connect_read() as conn`).
+    Записи - только через DATABASE_URL. primary=True - читать свою только что сделанную запись
+    (реплика могла её ещё не получить).
+    """
+    return primary_pool.connection() if primary else replica_router.connection()
+
 def init_db():
     """Инициализирует базу данных."""
     try:
-        with psycopg.connect(DATABASE_URL) as conn:
+        with connect() as conn:
             with conn.cursor() as cur:
                 # Создаем таблицу пользователей
                 cur.execute("""
@@ -46,6 +295,104 @@ def init_db():
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     );
                 """)
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_messages_user_created
+                    ON messages (user_id, created_at DESC, id DESC)
+                """)
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_active_conversations_user
+                    ON active_conversations (user_id)
+                """)
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_active_conversations_created
+                    ON active_conversations (created_at DESC, id DESC)
+                """)
+                # Статус вопросов: в выборках участвуют только открытые,
+                # поэтому частичный индекс не растёт вместе с историей
+                cur.execute("ALTER TABLE active_questions ADD COLUMN IF NOT EXISTS status VARCHAR(20) DEFAULT 'open'")
+                cur.execute("ALTER TABLE active_questions ADD COLUMN IF NOT EXISTS assigned_to BIGINT")
+                cur.execute("ALTER TABLE active_questions ADD COLUMN IF NOT EXISTS closed_at TIMESTAMP")
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_active_questions_open
+                    ON active_questions (created_at DESC, id DESC)
+                    WHERE status = 'open'
+                """)
+                # Пользователи, заблокировавшие бота, не получают рассылки
+                cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMP")
+                # Создаем таблицы рассылок и статусов доставки
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS broadcasts (
+                        id SERIAL PRIMARY KEY,
+                        text TEXT,
+                        created_by BIGINT,
+                        status VARCHAR(20) DEFAULT 'running',
+                        sent INTEGER DEFAULT 0,
+                        failed INTEGER DEFAULT 0,
+                        blocked INTEGER DEFAULT 0,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        finished_at TIMESTAMP
+                    );
+                """)
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                        broadcast_id INTEGER REFERENCES broadcasts(id) ON DELETE CASCADE,
+                        user_id BIGINT,
+                        status VARCHAR(20),
+                        sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (broadcast_id, user_id)
+                    );
+                """)
+                # Позиции заказов (orders создаётся в main.init_db). Внешнего ключа на orders нет:
+                # orders секционирована и уникальна только по (id, created_at), см. partitions.py
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS order_items (
+                        id SERIAL PRIMARY KEY,
+                        order_ref INTEGER NOT NULL,
+                        position SMALLINT NOT NULL,
+                        name TEXT NOT NULL,
+                        quantity INTEGER NOT NULL DEFAULT 1,
+                        price_uah INTEGER NOT NULL
+                    );
+                """)
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_ref)")
+                # Платёж, к которому привязан заказ (см. ipn.py); имена индексов - как в partitions.py
+                cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS payment_id VARCHAR(64)")
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_part_1 ON orders (order_id, created_at DESC)")
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_orders_payment
+                    ON orders (payment_id, created_at DESC)
+                    WHERE payment_id IS NOT NULL
+                """)
+                # Ключи записей локального журнала, уже применённых к БД (см. spool.py)
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS spool_applied (
+                        key VARCHAR(32) PRIMARY KEY,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    );
+                """)
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_spool_applied_at ON spool_applied (applied_at)")
+                # Заказы с сайта, ещё не привязанные к пользователю Telegram (см. intake.py)
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS web_orders (
+                        token VARCHAR(32) PRIMARY KEY,
+                        order_id VARCHAR(255) NOT NULL UNIQUE,
+                        items JSONB NOT NULL,
+                        total_uah INTEGER NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        claimed_by BIGINT,
+                        claimed_at TIMESTAMP,
+                        placed_at TIMESTAMP
+                    );
+                """)
+                cur.execute("ALTER TABLE web_orders ADD COLUMN IF NOT EXISTS placed_at TIMESTAMP")
+                # Состояние диалогов пользователей (context.user_data) для персистентности
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS user_state (
+                        user_id BIGINT PRIMARY KEY,
+                        data JSONB NOT NULL,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    );
+                """)
                 conn.commit()
     except Exception as e:
         logger.error(f"Ошибка инициализации базы данных: {e}")
@@ -53,7 +400,7 @@ def init_db():
 def get_total_users_count():
     """Получает общее количество пользователей."""
     try:
-        with psycopg.connect(DATABASE_URL) as conn:
+        with connect_read() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT COUNT(*) FROM users")
                 count = cur.fetchone()[0]
@@ -62,10 +409,23 @@ def get_total_users_count():
         logger.error(f"Ошибка получения количества пользователей: {e}")
         return 0
 
+def get_users_page(after_id=None, limit=5000):
+    """Страница пользователей по возрастанию id (keyset) для экспорта; строки - кортежи."""
+    with connect_read() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, username, first_name, last_name, language_code, is_bot, created_at, updated_at
+                FROM users
+                WHERE %(after_id)s::bigint IS NULL OR id > %(after_id)s
+                ORDER BY id
+                LIMIT %(limit)s
+            """, {'after_id': after_id, 'limit': limit})
+            return cur.fetchall()
+
 def get_total_orders_count():
     """Получает общее количество заказов (все активные диалоги типа order)."""
     try:
-        with psycopg.connect(DATABASE_URL) as conn:
+        with connect_read() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT COUNT(*) FROM active_conversations WHERE type IN ('order', 'subscription_order', 'digital_order')")
                 count = cur.fetchone()[0]
@@ -77,7 +437,7 @@ def get_total_orders_count():
 def get_total_questions_count():
     """Получает общее количество вопросов (активные диалоги типа question)."""
     try:
-        with psycopg.connect(DATABASE_URL) as conn:
+        with connect_read() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT COUNT(*) FROM active_conversations WHERE type = 'question'")
                 count = cur.fetchone()[0]
@@ -86,41 +446,85 @@ def get_total_questions_count():
         logger.error(f"Ошибка получения количества вопросов: {e}")
         return 0
 
-def get_active_conversations():
-    """Получает все активные диалоги."""
+CONVERSATION_COLUMNS = "id, user_id, type, assigned_owner, last_message, created_at, updated_at"
+
+# Курсор строки секционированной таблицы: "<id>.<created_at в секундах от эпохи>". По секунде
+# поиск строки затрагивает только её секцию; курсор без времени (старые кнопки) ищется везде.
+CURSOR_EPOCH = datetime(1970, 1, 1)
+
+def row_cursor(row):
+    return f"{row['id']}.{(row['created_at'] - CURSOR_EPOCH) // timedelta(seconds=1)}"
+
+def cursor_key(cursor):
+    """Курсор -> (id, created_at от, created_at до) для условий WHERE id = %s AND created_at >= %s AND created_at < %s."""
+    row_id, _, seconds = str(cursor).partition('.')
+    if not seconds:
+        return int(row_id), datetime.min, datetime.max
+    since = CURSOR_EPOCH + timedelta(seconds=int(seconds))
+    return int(row_id), since, since + timedelta(seconds=1)
+
+def get_active_conversations(limit=50, before_id=None, conversation_type=None):
+    """
+    Получает страницу активных диалогов, от новых к старым.
+    before_id - ID последнего диалога предыдущей страницы (keyset-пагинация).
+    """
+    conditions = []
+    params = []
+    if conversation_type is not None:
+        conditions.append("type = %s")
+        params.append(conversation_type)
+    if before_id is not None:
+        conditions.append("(created_at, id) < (SELECT created_at, id FROM active_conversations WHERE id = %s)")
+        params.append(before_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
     try:
-        with psycopg.connect(DATABASE_URL) as conn:
+        with connect_read() as conn:
             with conn.cursor(row_factory=dict_row) as cur:
-                cur.execute("SELECT * FROM active_conversations ORDER BY created_at DESC")
+                cur.execute(f"""
+                    SELECT {CONVERSATION_COLUMNS} FROM active_conversations
+                    {where}
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                """, (*params, limit))
                 conversations = cur.fetchall()
                 return conversations
     except Exception as e:
         logger.error(f"Ошибка получения активных диалогов: {e}")
         return []
 
-def get_active_questions():
-    """Получает все активные вопросы."""
-    try:
-        with psycopg.connect(DATABASE_URL) as conn:
-            with conn.cursor(row_factory=dict_row) as cur:
-                cur.execute("SELECT * FROM active_conversations WHERE type = 'question' ORDER BY created_at DESC")
-                questions = cur.fetchall()
-                return questions
-    except Exception as e:
-        logger.error(f"Ошибка получения активных вопросов: {e}")
-        return []
+def get_active_questions(limit=50, before_id=None):
+    """Получает страницу активных вопросов, от новых к старым."""
+    return get_active_conversations(limit, before_id, conversation_type='question')
 
-def get_conversation_history(user_id, limit=50):
-    """Получает историю переписки с пользователем."""
+def get_conversation_history(user_id, limit=50, before=None):
+    """
+    Получает историю переписки с пользователем, от новых к старым.
+    before - курсор (row_cursor) последнего сообщения предыдущей страницы: keyset-пагинация
+    по индексу (user_id, created_at, id) вместо OFFSET, только по секциям не новее курсора.
+    Читается с основной БД: сотрудник должен видеть в /history ответ, который только что отправил.
+    """
     try:
-        with psycopg.connect(DATABASE_URL) as conn:
+        with connect_read(primary=True) as conn:
             with conn.cursor(row_factory=dict_row) as cur:
-                cur.execute("""
-                    SELECT * FROM messages
-                    WHERE user_id = %s
-                    ORDER BY created_at DESC
-                    LIMIT %s
-                """, (user_id, limit))
+                if before is None:
+                    cur.execute("""
+                        SELECT id, message, is_from_user, created_at FROM messages
+                        WHERE user_id = %s
+                        ORDER BY created_at DESC, id DESC
+                        LIMIT %s
+                    """, (user_id, limit))
+                else:
+                    before_id, since, until = cursor_key(before)
+                    cur.execute("""
+                        SELECT id, message, is_from_user, created_at FROM messages
+                        WHERE user_id = %s AND created_at < %s
+                          AND (created_at, id) < (
+                              SELECT created_at, id FROM messages
+                              WHERE id = %s AND created_at >= %s AND created_at < %s
+                          )
+                        ORDER BY created_at DESC, id DESC
+                        LIMIT %s
+                    """, (user_id, until, before_id, since, until, limit))
                 history = cur.fetchall()
                 return history
     except Exception as e:
@@ -130,7 +534,7 @@ def get_conversation_history(user_id, limit=50):
 def clear_all_active_conversations():
     """Очищает все активные диалоги из базы данных."""
     try:
-        with psycopg.connect(DATABASE_URL) as conn:
+        with connect() as conn:
             with conn.cursor() as cur:
                 cur.execute("DELETE FROM active_conversations")
                 deleted_count = cur.rowcount
@@ -142,7 +546,7 @@ def clear_all_active_conversations():
 def save_new_question(user_id, user_info, message_text):
     """Сохраняет новое вопрос в базе данных."""
     try:
-        with psycopg.connect(DATABASE_URL) as conn:
+        with connect() as conn:
             with conn.cursor() as cur:
                 # Сохраняем пользователя (если его нет)
                 cur.execute("""
@@ -175,7 +579,7 @@ def save_new_question(user_id, user_info, message_text):
 def is_user_in_active_conversation(user_id):
     """Проверяет, находится ли пользователь в активном диалоге."""
     try:
-        with psycopg.connect(DATABASE_URL) as conn:
+        with connect() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT 1 FROM active_conversations WHERE user_id = %s", (user_id,))
                 return cur.fetchone() is not None
@@ -186,7 +590,7 @@ def is_user_in_active_conversation(user_id):
 def get_assigned_owner(user_id):
     """Получает ID владельца, который ведет диалог с пользователем."""
     try:
-        with psycopg.connect(DATABASE_URL) as conn:
+        with connect() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT assigned_owner FROM active_conversations WHERE user_id = %s", (user_id,))
                 result = cur.fetchone()
@@ -194,3 +598,569 @@ def get_assigned_owner(user_id):
     except Exception as e:
         logger.error(f"Ошибка получения назначенного владельца для {user_id}: {e}")
         return None
+
+def update_order_status(payment_id, order_id, total_uah, status, allowed_from, max_age_days):
+    """
+    Применяет уведомление об оплате payment_id к заказу не старше max_age_days дней.
+    Заказ, уже привязанный к payment_id, находится по нему; иначе платёж привязывается к единственному
+    непривязанному заказу с этими order_id и total_uah (order_id бота не уникален). Статус меняется,
+    только если текущий входит в allowed_from.
+    Возвращает (результат, заказ): ('matched', dict) при переходе, ('matched', None), если переход не нужен,
+    ('not_found' | 'ambiguous', None), если заказ не определён. Ошибки БД пробрасываются.
+    """
+    try:
+        with connect() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute("""
+                    SELECT id, created_at, status FROM orders
+                    WHERE payment_id = %s AND created_at > NOW() - make_interval(days => %s)
+                    FOR UPDATE
+                """, (payment_id, max_age_days))
+                rows = cur.fetchall()
+                if not rows:
+                    cur.execute("""
+                        SELECT id, created_at, status FROM orders
+                        WHERE order_id = %s AND total_uah = %s AND payment_id IS NULL
+                          AND created_at > NOW() - make_interval(days => %s)
+                        LIMIT 2
+                        FOR UPDATE
+                    """, (order_id, total_uah, max_age_days))
+                    rows = cur.fetchall()
+                if len(rows) != 1:
+                    conn.rollback()
+                    return ('not_found' if not rows else 'ambiguous'), None
+                row = rows[0]
+                changed = row['status'] in allowed_from
+                cur.execute("""
+                    UPDATE orders SET payment_id = %s, status = CASE WHEN %s THEN %s ELSE status END
+                    WHERE id = %s AND created_at = %s
+                    RETURNING id, user_id, order_id, total_uah, status
+                """, (payment_id, changed, status, row['id'], row['created_at']))
+                order = cur.fetchone()
+                conn.commit()
+                return 'matched', (order if changed else None)
+    except Exception as e:
+        logger.error(f"Ошибка обновления статуса заказа {order_id} (платёж {payment_id}): {e}")
+        raise
+
+ORDER_USER_UPSERT = """
+    INSERT INTO users (id, username, first_name, last_name, language_code, is_bot, created_at, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, NOW(), NOW())
+    ON CONFLICT (id) DO UPDATE SET
+        username = EXCLUDED.username,
+        first_name = EXCLUDED.first_name,
+        last_name = EXCLUDED.last_name,
+        language_code = EXCLUDED.language_code,
+        blocked_at = NULL,
+        updated_at = NOW()
+"""
+# Заказ и его позиции одним запросом: id заказа не нужно возвращать клиенту между шагами
+ORDER_INSERT = """
+    WITH new_order AS (
+        INSERT INTO orders (user_id, order_id, items, total_uah, status, created_at)
+        VALUES (%s, %s, %s, %s, 'created', COALESCE(%s::timestamp, NOW()))
+        RETURNING id
+    ), new_items AS (
+        INSERT INTO order_items (order_ref, position, name, quantity, price_uah)
+        SELECT new_order.id, t.position, t.name, t.quantity, t.price_uah
+        FROM new_order, unnest(%s::smallint[], %s::text[], %s::int[], %s::int[])
+            AS t(position, name, quantity, price_uah)
+    )
+    SELECT id FROM new_order
+"""
+ORDER_COUNTER_UPDATE = "UPDATE bot_stats SET total_orders = total_orders + 1, updated_at = NOW()"
+
+def close_connections():
+    """Закрывает постоянные соединения при остановке бота."""
+    primary_pool.close()
+    replica_router.close()
+
+def place_order(user, order_id, items_text, total_uah, line_items):
+    """
+    Оформляет заказ одной транзакцией: upsert пользователя, заказ, позиции, счётчик заказов.
+    Запросы подготовлены и отправляются одним пакетом в pipeline mode -
+    один сетевой round trip на заказ. Соединение берётся из primary_pool, поэтому заказы
+    из разных потоков оформляются параллельно. line_items - [(название, количество, цена_uah), ...].
+    Возвращает orders.id; при ошибке транзакция откатывается целиком.
+    """
+    positions = list(range(1, len(line_items) + 1))
+    names = [name for name, _, _ in line_items]
+    quantities = [quantity for _, quantity, _ in line_items]
+    prices = [price for _, _, price in line_items]
+    try:
+        with primary_pool.connection() as conn:
+            with conn.pipeline():
+                conn.execute(ORDER_USER_UPSERT, (
+                    user.id, user.username, user.first_name, user.last_name, user.language_code, user.is_bot
+                ), prepare=True)
+                order_cur = conn.execute(ORDER_INSERT, (
+                    user.id, order_id, items_text, total_uah, None, positions, names, quantities, prices
+                ), prepare=True)
+                conn.execute(ORDER_COUNTER_UPDATE, prepare=True)
+                conn.commit()
+            return order_cur.fetchone()[0]
+    except Exception as e:
+        # Незавершённая транзакция откатывается при возврате соединения в пул
+        logger.error(f"Ошибка оформления заказа {order_id}: {e}")
+        raise
+
+# Пачка заказов с сайта - одним запросом. Повтор того же order_id возвращает уже выданный токен
+WEB_ORDERS_INSERT = """
+    INSERT INTO web_orders (token, order_id, items, total_uah)
+    SELECT t.token, t.order_id, t.items::jsonb, t.total_uah
+    FROM unnest(%s::varchar[], %s::varchar[], %s::text[], %s::int[]) AS t(token, order_id, items, total_uah)
+    ON CONFLICT (order_id) DO UPDATE SET order_id = EXCLUDED.order_id
+    RETURNING order_id, token, total_uah
+"""
+
+def insert_web_orders(orders):
+    """
+    Сохраняет пачку заказов с сайта одной транзакцией.
+    orders - [(token, order_id, items_json, total_uah)] с уникальными order_id.
+    Возвращает {order_id: (token, total_uah)}; для уже сохранённого order_id - значения сохранённого заказа.
+    """
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(WEB_ORDERS_INSERT, (
+                [token for token, _, _, _ in orders],
+                [order_id for _, order_id, _, _ in orders],
+                [items for _, _, items, _ in orders],
+                [total for _, _, _, total in orders],
+            ))
+            stored = {order_id: (token, total_uah) for order_id, token, total_uah in cur.fetchall()}
+        conn.commit()
+    return stored
+
+def claim_web_order(token, user_id, ttl_seconds):
+    """
+    Привязывает заказ с сайта к пользователю, если он ещё не забран и не старше ttl_seconds.
+    Забранный, но не оформленный заказ (сбой между claim и mark_web_order_placed) тот же
+    пользователь может забрать повторно. Возвращает dict заказа или None.
+    """
+    with connect() as conn:
+        with conn.cursor(row_factory=dict_row) as cur:
+            cur.execute("""
+                UPDATE web_orders SET claimed_by = %s, claimed_at = NOW()
+                WHERE token = %s AND placed_at IS NULL
+                AND (claimed_by = %s OR (claimed_by IS NULL AND created_at > NOW() - make_interval(secs => %s)))
+                RETURNING token, order_id, items, total_uah
+            """, (user_id, token, user_id, ttl_seconds))
+            order = cur.fetchone()
+        conn.commit()
+    return order
+
+def release_web_order(token):
+    """Возвращает заказ в незабранные (если оформить его не удалось)."""
+    with connect() as conn:
+        conn.execute("UPDATE web_orders SET claimed_by = NULL, claimed_at = NULL WHERE token = %s", (token,))
+        conn.commit()
+
+def mark_web_order_placed(token):
+    """Отмечает заказ с сайта оформленным (он уже записан в orders или в журнал)."""
+    with connect() as conn:
+        conn.execute("UPDATE web_orders SET placed_at = NOW() WHERE token = %s", (token,))
+        conn.commit()
+
+def purge_web_orders(ttl_seconds):
+    """
+    Удаляет оформленные заказы (они уже есть в orders) и незабранные старше ttl_seconds.
+    Забранные, но не оформленные остаются: клиент может открыть ссылку повторно.
+    """
+    with connect() as conn:
+        cur = conn.execute("""
+            DELETE FROM web_orders
+            WHERE placed_at IS NOT NULL
+            OR (claimed_by IS NULL AND created_at < NOW() - make_interval(secs => %s))
+        """, (ttl_seconds,))
+        conn.commit()
+        return cur.rowcount
+
+SPOOLED_COUNTERS = ('total_orders', 'total_questions')
+# Ошибки, после которых запись журнала воспроизводится повторно (БД недоступна или соединение
+# оборвалось); остальные - постоянные, такая запись уходит в dead-letter (spool.WriteSpool.replay)
+SPOOL_TRANSIENT_ERRORS = (psycopg.OperationalError, psycopg.InterfaceError)
+# Сколько хранить ключи применённых записей: воспроизведённые записи удаляются из журнала,
+# ключ нужен лишь на случай сбоя между применением записи и перезаписью файла
+SPOOL_APPLIED_TTL_DAYS = int(os.environ.get('SPOOL_APPLIED_TTL_DAYS', 7))
+SPOOL_APPLIED_PURGE_INTERVAL = 6 * 60 * 60
+
+def apply_spooled(record):
+    """
+    Применяет запись локального журнала (spool.WriteSpool) ровно один раз: ключ записи
+    фиксируется в spool_applied той же транзакцией. Возвращает False, если запись уже применена.
+    """
+    kind, data, created_at = record['kind'], record['data'], record['created_at']
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute("INSERT INTO spool_applied (key) VALUES (%s) ON CONFLICT DO NOTHING", (record['key'],))
+            if cur.rowcount == 0:
+                return False
+            if kind in ('user', 'order'):
+                user = data['user']
+                cur.execute(ORDER_USER_UPSERT, (
+                    user['id'], user['username'], user['first_name'], user['last_name'],
+                    user['language_code'], user['is_bot'],
+                ))
+            if kind == 'order':
+                line_items = data['line_items']
+                cur.execute(ORDER_INSERT, (
+                    data['user']['id'], data['order_id'], data['items_text'], data['total_uah'], created_at,
+                    list(range(1, len(line_items) + 1)),
+                    [name for name, _, _ in line_items],
+                    [quantity for _, quantity, _ in line_items],
+                    [price for _, _, price in line_items],
+                ))
+                cur.execute(ORDER_COUNTER_UPDATE)
+            elif kind == 'question':
+                cur.execute("""
+                    INSERT INTO active_questions (user_id, message, assigned_to, created_at)
+                    VALUES (%s, %s, %s, %s)
+                """, (data['user_id'], data['message'], data['assigned_to'], created_at))
+            elif kind == 'counter':
+                column = data['column']
+                if column not in SPOOLED_COUNTERS:
+                    raise ValueError(f"Неизвестный счётчик: {column}")
+                cur.execute(f"UPDATE bot_stats SET {column} = {column} + 1, updated_at = NOW()")
+            elif kind != 'user':
+                raise ValueError(f"Неизвестный тип записи журнала: {kind}")
+            conn.commit()
+    return True
+
+def purge_spool_applied(ttl_days=SPOOL_APPLIED_TTL_DAYS):
+    """Удаляет ключи применённых записей журнала старше ttl_days; запускается планировщиком."""
+    try:
+        with connect() as conn:
+            cur = conn.execute(
+                "DELETE FROM spool_applied WHERE applied_at < NOW() - make_interval(days => %s)", (ttl_days,)
+            )
+            conn.commit()
+            if cur.rowcount:
+                logger.info(f"🧹 Удалено ключей применённых записей журнала: {cur.rowcount}")
+            return cur.rowcount
+    except Exception as e:
+        logger.warning(f"Не удалось очистить spool_applied: {e}")
+        return 0
+
+def create_broadcast(text, created_by):
+    """Создаёт рассылку и возвращает её ID."""
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO broadcasts (text, created_by) VALUES (%s, %s) RETURNING id",
+                (text, created_by)
+            )
+            broadcast_id = cur.fetchone()[0]
+            conn.commit()
+            return broadcast_id
+
+def get_unfinished_broadcasts():
+    """Получает рассылки, прерванные перезапуском или падением процесса."""
+    try:
+        with connect() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute("SELECT id, text, created_by FROM broadcasts WHERE status = 'running' ORDER BY id")
+                return cur.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка получения незавершённых рассылок: {e}")
+        return []
+
+def get_broadcast(broadcast_id):
+    """Получает рассылку со счётчиками доставки."""
+    try:
+        with connect() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute("SELECT * FROM broadcasts WHERE id = %s", (broadcast_id,))
+                return cur.fetchone()
+    except Exception as e:
+        logger.error(f"Ошибка получения рассылки {broadcast_id}: {e}")
+        return None
+
+def stream_broadcast_recipients(broadcast_id, batch_size=500):
+    """
+    Отдаёт пачки ID получателей рассылки по возрастанию id (keyset): каждая пачка читается
+    отдельной короткой транзакцией, и соединение не удерживается, пока пачка рассылается.
+    Пропускает заблокировавших бота и тех, кому рассылка уже доставлена,
+    поэтому после перезапуска рассылка продолжается с места остановки.
+    """
+    after_id = None
+    while True:
+        with connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT u.id FROM users u
+                    WHERE (%(after_id)s::bigint IS NULL OR u.id > %(after_id)s)
+                      AND u.blocked_at IS NULL
+                      AND u.is_bot IS NOT TRUE
+                      AND NOT EXISTS (
+                          SELECT 1 FROM broadcast_deliveries d
+                          WHERE d.broadcast_id = %(broadcast_id)s AND d.user_id = u.id
+                      )
+                    ORDER BY u.id
+                    LIMIT %(limit)s
+                """, {'after_id': after_id, 'broadcast_id': broadcast_id, 'limit': batch_size})
+                rows = cur.fetchall()
+            conn.commit()
+        if not rows:
+            break
+        after_id = rows[-1][0]
+        yield [row[0] for row in rows]
+        if len(rows) < batch_size:
+            break
+
+def record_broadcast_deliveries(broadcast_id, results):
+    """
+    Сохраняет статусы доставки [(user_id, status), ...] одной транзакцией,
+    обновляет счётчики рассылки и помечает пользователей, заблокировавших бота.
+    """
+    if not results:
+        return
+    user_ids = [user_id for user_id, _ in results]
+    statuses = [status for _, status in results]
+    blocked_ids = [user_id for user_id, status in results if status == 'blocked']
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO broadcast_deliveries (broadcast_id, user_id, status, sent_at)
+                SELECT %s, t.user_id, t.status, NOW()
+                FROM unnest(%s::bigint[], %s::varchar[]) AS t(user_id, status)
+                ON CONFLICT (broadcast_id, user_id) DO NOTHING
+                RETURNING status
+            """, (broadcast_id, user_ids, statuses))
+            inserted = [row[0] for row in cur.fetchall()]
+            cur.execute("""
+                UPDATE broadcasts
+                SET sent = sent + %s, failed = failed + %s, blocked = blocked + %s
+                WHERE id = %s
+            """, (inserted.count('sent'), inserted.count('failed'), inserted.count('blocked'), broadcast_id))
+            if blocked_ids:
+                cur.execute("UPDATE users SET blocked_at = NOW() WHERE id = ANY(%s)", (blocked_ids,))
+            conn.commit()
+
+def finish_broadcast(broadcast_id, status):
+    """Завершает рассылку со статусом 'finished' или 'cancelled'."""
+    try:
+        with connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE broadcasts SET status = %s, finished_at = NOW() WHERE id = %s",
+                    (status, broadcast_id)
+                )
+                conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка завершения рассылки {broadcast_id}: {e}")
+
+def save_message(user_id, message, is_from_user):
+    """Сохраняет сообщение переписки (от клиента или от персонала) и обновляет диалог."""
+    try:
+        with connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO messages (user_id, message, is_from_user, created_at)
+                    VALUES (%s, %s, %s, NOW())
+                """, (user_id, message, is_from_user))
+                cur.execute("""
+                    UPDATE active_conversations SET last_message = %s, updated_at = NOW()
+                    WHERE user_id = %s
+                """, (message, user_id))
+                conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка сохранения сообщения для {user_id}: {e}")
+
+def open_conversation(user_id, conversation_type, assigned_owner, message_text):
+    """
+    Открывает диалог и сохраняет первое сообщение клиента одной транзакцией.
+    Возвращает ID диалога или None при ошибке.
+    """
+    try:
+        with connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO active_conversations (user_id, type, assigned_owner, last_message, created_at, updated_at)
+                    VALUES (%s, %s, %s, %s, NOW(), NOW())
+                    RETURNING id
+                """, (user_id, conversation_type, assigned_owner, message_text))
+                conversation_id = cur.fetchone()[0]
+                cur.execute("""
+                    INSERT INTO messages (user_id, message, is_from_user, created_at)
+                    VALUES (%s, %s, TRUE, NOW())
+                """, (user_id, message_text))
+                conn.commit()
+                return conversation_id
+    except Exception as e:
+        logger.error(f"Ошибка открытия диалога для {user_id}: {e}")
+        return None
+
+def get_open_conversations():
+    """Получает открытые диалоги (user_id, assigned_owner) для прогрева кэша."""
+    try:
+        with connect() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute("SELECT id, user_id, assigned_owner FROM active_conversations ORDER BY id")
+                return cur.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка получения открытых диалогов: {e}")
+        return []
+
+def close_conversation(user_id):
+    """Закрывает (удаляет) активные диалоги и открытые вопросы пользователя. Возвращает число закрытых диалогов."""
+    try:
+        with connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM active_conversations WHERE user_id = %s", (user_id,))
+                deleted_count = cur.rowcount
+                cur.execute("""
+                    UPDATE active_questions SET status = 'closed', closed_at = NOW()
+                    WHERE user_id = %s AND status = 'open'
+                """, (user_id,))
+                conn.commit()
+                return deleted_count
+    except Exception as e:
+        logger.error(f"Ошибка закрытия диалога для {user_id}: {e}")
+        return 0
+
+def get_open_questions_page(limit, cursor=None, direction='older', primary=False):
+    """
+    Получает страницу открытых вопросов (от новых к старым) по частичному индексу.
+    cursor - курсор вопроса (row_cursor); direction: 'older' - вопросы старше него, 'newer' - новее,
+    'from' - начиная с него включительно. Возвращает (rows, has_newer, has_older).
+    """
+    key = "(SELECT created_at, id FROM active_questions WHERE id = %s AND created_at >= %s AND created_at < %s)"
+    if cursor is None:
+        condition, order, params = "", "DESC", ()
+    elif direction == 'newer':
+        condition, order, params = f"AND (created_at, id) > {key}", "ASC", cursor_key(cursor)
+    elif direction == 'from':
+        condition, order, params = f"AND (created_at, id) <= {key}", "DESC", cursor_key(cursor)
+    else:
+        condition, order, params = f"AND (created_at, id) < {key}", "DESC", cursor_key(cursor)
+    try:
+        with connect_read(primary) as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(f"""
+                    SELECT id, user_id, message, assigned_to, created_at FROM active_questions
+                    WHERE status = 'open' {condition}
+                    ORDER BY created_at {order}, id {order}
+                    LIMIT %s
+                """, (*params, limit + 1))
+                rows = cur.fetchall()
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                if order == "ASC":
+                    rows.reverse()
+                if not rows:
+                    return [], False, False
+                edge = rows[-1] if order == "ASC" else rows[0]
+                edge_op = "<" if order == "ASC" else ">"
+                cur.execute(f"""
+                    SELECT EXISTS (
+                        SELECT 1 FROM active_questions
+                        WHERE status = 'open' AND (created_at, id) {edge_op} (%s, %s)
+                    ) AS found
+                """, (edge['created_at'], edge['id']))
+                has_other_side = cur.fetchone()['found']
+                if order == "ASC":
+                    return rows, has_more, has_other_side
+                return rows, has_other_side, has_more
+    except Exception as e:
+        logger.error(f"Ошибка получения страницы открытых вопросов: {e}")
+        return [], False, False
+
+def get_open_questions_count(primary=False):
+    """Получает количество открытых вопросов."""
+    try:
+        with connect_read(primary) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) FROM active_questions WHERE status = 'open'")
+                return cur.fetchone()[0]
+    except Exception as e:
+        logger.error(f"Ошибка получения количества открытых вопросов: {e}")
+        return 0
+
+def close_question(cursor):
+    """
+    Закрывает вопрос по курсору (row_cursor). Возвращает (user_id, осталось открытых вопросов
+    у пользователя) или None, если вопрос уже закрыт.
+    """
+    question_id, since, until = cursor_key(cursor)
+    try:
+        with connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE active_questions SET status = 'closed', closed_at = NOW()
+                    WHERE id = %s AND created_at >= %s AND created_at < %s AND status = 'open'
+                    RETURNING user_id
+                """, (question_id, since, until))
+                row = cur.fetchone()
+                if not row:
+                    return None
+                cur.execute(
+                    "SELECT COUNT(*) FROM active_questions WHERE user_id = %s AND status = 'open'",
+                    (row[0],)
+                )
+                remaining = cur.fetchone()[0]
+                conn.commit()
+                return row[0], remaining
+    except Exception as e:
+        logger.error(f"Ошибка закрытия вопроса {question_id}: {e}")
+        return None
+
+def assign_question(cursor, staff_id):
+    """Назначает вопрос (курсор row_cursor) сотруднику, а с ним и диалог клиента. Возвращает user_id или None."""
+    question_id, since, until = cursor_key(cursor)
+    try:
+        with connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE active_questions SET assigned_to = %s
+                    WHERE id = %s AND created_at >= %s AND created_at < %s AND status = 'open'
+                    RETURNING user_id
+                """, (staff_id, question_id, since, until))
+                row = cur.fetchone()
+                if not row:
+                    return None
+                cur.execute(
+                    "UPDATE active_conversations SET assigned_owner = %s, updated_at = NOW() WHERE user_id = %s",
+                    (staff_id, row[0])
+                )
+                conn.commit()
+                return row[0]
+    except Exception as e:
+        logger.error(f"Ошибка назначения вопроса {question_id}: {e}")
+        return None
+
+def load_user_state(user_id):
+    """
+    Загружает сохранённое состояние диалога пользователя.
+    Возвращает (dict, секунд с последнего сохранения) или (None, None).
+    """
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT data, EXTRACT(EPOCH FROM NOW() - updated_at)::float
+                FROM user_state WHERE user_id = %s
+            """, (user_id,))
+            row = cur.fetchone()
+            return (row[0], row[1]) if row else (None, None)
+
+def save_user_states(states):
+    """Сохраняет пачку состояний [(user_id, json_text), ...] одним запросом."""
+    if not states:
+        return
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO user_state (user_id, data, updated_at)
+                SELECT t.user_id, t.data::jsonb, NOW()
+                FROM unnest(%s::bigint[], %s::text[]) AS t(user_id, data)
+                ON CONFLICT (user_id) DO UPDATE SET data = EXCLUDED.data, updated_at = NOW()
+            """, ([user_id for user_id, _ in states], [data for _, data in states]))
+            conn.commit()
+
+def delete_user_states(user_ids):
+    """Удаляет сохранённые состояния пользователей."""
+    if not user_ids:
+        return
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM user_state WHERE user_id = ANY(%s)", (list(user_ids),))
+            conn.commit()
@@ -0,0 +1,125 @@
+# i18n.py - Тексты и клавиатуры бота по локалям
+#
+# Каталоги сообщений locales/<локаль>.json (плоский словарь ключ -> шаблон str.format) загружаются
+# при старте. Для каждой локали заранее готовятся:
+#   - шаблоны: строка без полей хранится как есть, с полями - как связанный метод str.format;
+#   - клавиатуры: InlineKeyboardMarkup по общей раскладке, подписи кнопок - ключи каталога.
+# Ключи, отсутствующие в локали или с другим набором полей, берутся из локали по умолчанию.
+# Отрисовка сообщения - поиск в словаре и format, без создания одинаковых объектов на каждый запрос.
+import os
+import json
+import logging
+from string import Formatter
+from collections import Counter
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales')
+DEFAULT_LOCALE = 'uk'
+
+def template_fields(template):
+    return frozenset(name for _, name, _, _ in Formatter().parse(template) if name is not None)
+
+def compile_template(template):
+    return template.format if template_fields(template) else template
+
+class LocaleBundle:
+    """Готовые тексты и клавиатуры одной локали."""
+
+    __slots__ = ('locale', '_sources', '_texts', '_keyboards', 'menus')
+
+    def __init__(self, locale, texts, keyboards):
+        self.locale = locale
+        self._sources = texts
+        self._texts = {key: compile_template(template) for key, template in texts.items()}
+        self._keyboards = {name: self.build_keyboard(layout) for name, layout in keyboards.items()}
+        # Дополнительные готовые меню (например, каталог товаров) - заполняет вызывающий код
+        self.menus = {}
+
+    def text(self, key, **fields):
+        template = self._texts[key]
+        return template if type(template) is str else template(**fields)
+
+    def source(self, key):
+        """Исходный шаблон (например, чтобы распознать отрисованный по нему текст)."""
+        return self._sources[key]
+
+    def keyboard(self, name):
+        return self._keyboards[name]
+
+    def button(self, text_key, **kwargs):
+        return InlineKeyboardButton(self.text(text_key), **kwargs)
+
+    def build_keyboard(self, layout):
+        """layout - ряды кнопок вида {'text': ключ каталога, 'callback_data' | 'url': ...}."""
+        return InlineKeyboardMarkup([
+            [self.button(spec['text'], **{k: v for k, v in spec.items() if k != 'text'}) for spec in row]
+            for row in layout
+        ])
+
+class Messages:
+    def __init__(self, keyboards, directory=LOCALES_DIR, default=DEFAULT_LOCALE):
+        self.default = default
+        catalogs = self.load_catalogs(directory)
+        if default not in catalogs:
+            raise RuntimeError(f"Нет каталога сообщений локали по умолчанию: {directory}/{default}.json")
+        base = catalogs[default]
+        self.missing = {}
+        self._bundles = {}
+        for locale, catalog in catalogs.items():
+            texts = dict(base)
+            missing = 0
+            for key, template in base.items():
+                translated = catalog.get(key)
+                if translated is None:
+                    missing += 1
+                elif template_fields(translated) != template_fields(template):
+                    logger.warning(f"🌐 {locale}.json: поля шаблона {key} не совпадают с {default}.json, ключ пропущен")
+                    missing += 1
+                else:
+                    texts[key] = translated
+            if missing:
+                self.missing[locale] = missing
+            self._bundles[locale] = LocaleBundle(locale, texts, keyboards)
+        self._resolved = {}
+        self.renders = Counter()
+        logger.info(f"🌐 Загружены локали: {', '.join(sorted(self._bundles))}, ключей: {len(base)}")
+
+    @staticmethod
+    def load_catalogs(directory):
+        catalogs = {}
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.json'):
+                with open(os.path.join(directory, name), encoding='utf-8') as f:
+                    catalogs[name[:-len('.json')]] = json.load(f)
+        return catalogs
+
+    @property
+    def locales(self):
+        return list(self._bundles)
+
+    def bundles(self):
+        return self._bundles.values()
+
+    def locale(self, language_code):
+        """'en-GB' -> 'en'; неизвестные языки - локаль по умолчанию."""
+        locale = self._resolved.get(language_code)
+        if locale is None:
+            base = (language_code or '').split('-')[0].lower()
+            locale = base if base in self._bundles else self.default
+            self._resolved[language_code] = locale
+        return locale
+
+    def bundle(self, language_code=None):
+        locale = self.locale(language_code)
+        self.renders[locale] += 1
+        return self._bundles[locale]
+
+    def stats(self):
+        return {
+            'locales': self.locales,
+            'default': self.default,
+            'missing': self.missing,
+            'renders': dict(self.renders),
+        }
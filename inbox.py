@@ -0,0 +1,81 @@
+# inbox.py - Постраничный список открытых вопросов для владельцев
+import asyncio
+import logging
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+import db
+
+logger = logging.getLogger(__name__)
+
+INBOX_PAGE_SIZE = 5
+INBOX_PREVIEW_LENGTH = 150
+
+async def render_inbox(cursor=None, direction='older', primary=False):
+    """
+    Формирует страницу входящих: текст и клавиатуру с действиями и навигацией.
+    Навигация - keyset по курсору (db.row_cursor) первого/последнего вопроса на странице.
+    Читает с реплики, если она есть; primary=True - сразу после своего изменения.
+    """
+    (rows, has_newer, has_older), total = await asyncio.gather(
+        asyncio.to_thread(db.get_open_questions_page, INBOX_PAGE_SIZE, cursor, direction, primary),
+        asyncio.to_thread(db.get_open_questions_count, primary),
+    )
+    if not rows:
+        if cursor is not None:
+            # Страница опустела (вопросы закрыты) - показываем первую
+            return await render_inbox(primary=primary)
+        return "📭 Відкритих запитань немає.", None
+    anchor = db.row_cursor(rows[0])
+    lines = [f"📥 Відкриті запитання: {total}"]
+    keyboard = []
+    for row in rows:
+        text = row['message'] or ''
+        if len(text) > INBOX_PREVIEW_LENGTH:
+            text = text[:INBOX_PREVIEW_LENGTH] + "…"
+        assigned = f"👤 {row['assigned_to']}" if row['assigned_to'] else "👤 не призначено"
+        lines.append(
+            f"\n#{row['id']} · {row['created_at']:%d.%m %H:%M} · ID: {row['user_id']} · {assigned}\n{text}"
+        )
+        keyboard.append([
+            InlineKeyboardButton(f"✅ Закрити #{row['id']}", callback_data=f"inbox_close_{db.row_cursor(row)}_{anchor}"),
+            InlineKeyboardButton(f"🙋 Взяти #{row['id']}", callback_data=f"inbox_assign_{db.row_cursor(row)}_{anchor}"),
+        ])
+    navigation = []
+    if has_newer:
+        navigation.append(InlineKeyboardButton("⬅️ Новіші", callback_data=f"inbox_newer_{anchor}"))
+    if has_older:
+        navigation.append(InlineKeyboardButton("Старіші ➡️", callback_data=f"inbox_older_{db.row_cursor(rows[-1])}"))
+    if navigation:
+        keyboard.append(navigation)
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+async def handle_inbox_action(data, staff_id, support_relay):
+    """
+    Выполняет действие из callback_data вида inbox_<action>_<курсор>[_<anchor>].
+    Возвращает (текст уведомления, текст страницы, клавиатура).
+    """
+    parts = data.split('_')
+    action = parts[1]
+    if action in ('older', 'newer'):
+        text, reply_markup = await render_inbox(parts[2], action)
+        return None, text, reply_markup
+    cursor, anchor = parts[2], parts[3]
+    question_id = db.cursor_key(cursor)[0]
+    notice = None
+    if action == 'close':
+        result = await asyncio.to_thread(db.close_question, cursor)
+        if result:
+            user_id, remaining = result
+            if not remaining:
+                await support_relay.close(user_id)
+            notice = f"✅ Запитання #{question_id} закрито"
+        else:
+            notice = f"ℹ️ Запитання #{question_id} вже закрите"
+    elif action == 'assign':
+        user_id = await asyncio.to_thread(db.assign_question, cursor, staff_id)
+        if user_id:
+            support_relay.assign(user_id, staff_id)
+            notice = f"🙋 Запитання #{question_id} призначено вам"
+        else:
+            notice = f"ℹ️ Запитання #{question_id} вже закрите"
+    text, reply_markup = await render_inbox(anchor, 'from', primary=True)
+    return notice, text, reply_markup
@@ -0,0 +1,237 @@
+# intake.py - Приём заказов с сайта по HTTP вместо вставки /pay в чат
+#
+# POST /api/orders, тело - JSON:
+#   {"order_id": "W12345", "items": [{"sku": "s_netflix_pre_0", "quantity": 1}, {"sku": "d_psn_inr_2000"}]}
+# sku - ключ товара каталога (catalog_search.build_entries). Заголовки:
+#   X-Timestamp: unix-время отправки
+#   X-Signature: hex HMAC-SHA256(ORDER_INTAKE_SECRET, "<X-Timestamp>.<тело>")
+# Ответ 201: {"order_id", "token", "total_uah", "claim_url"} - клиент открывает claim_url в Telegram,
+# и заказ оформляется на него (/start claim_<token>).
+import os
+import hmac
+import json
+import time
+import queue
+import hashlib
+import logging
+import secrets
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+import db
+
+logger = logging.getLogger(__name__)
+
+INTAKE_PATH = "/api/orders"
+INTAKE_MAX_BODY = 64 * 1024
+INTAKE_QUEUE_SIZE = int(os.environ.get('INTAKE_QUEUE_SIZE', 1000))
+# Сколько заказов максимум сохраняется одной транзакцией
+INTAKE_BATCH_SIZE = int(os.environ.get('INTAKE_BATCH_SIZE', 200))
+# Сколько HTTP-поток ждёт коммита своей пачки, прежде чем ответить 503
+INTAKE_COMMIT_TIMEOUT = float(os.environ.get('INTAKE_COMMIT_TIMEOUT', 10))
+# Сколько живёт незабранный заказ
+INTAKE_CLAIM_TTL = int(os.environ.get('INTAKE_CLAIM_TTL', 24 * 60 * 60))
+# Допустимое расхождение X-Timestamp с часами сервера (защита от повтора запроса)
+INTAKE_MAX_SKEW = 300
+INTAKE_MAX_ITEMS = 20
+INTAKE_MAX_QUANTITY = 100
+INTAKE_PURGE_INTERVAL = 60 * 60
+CLAIM_PREFIX = 'claim_'
+
+ORDER_ID_CHARS = set('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_')
+
+class IntakeError(ValueError):
+    """Заказ не прошёл проверку; текст уходит сайту в ответе 422."""
+
+def sign(secret, timestamp, body):
+    message = str(timestamp).encode('ascii') + b'.' + body
+    return hmac.new(secret.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+def verify_signature(body, timestamp, signature, secret, now=None):
+    if not secret or not signature or not timestamp:
+        return False
+    try:
+        skew = abs((now or time.time()) - int(timestamp))
+    except ValueError:
+        return False
+    if skew > INTAKE_MAX_SKEW:
+        return False
+    return hmac.compare_digest(sign(secret, timestamp, body), signature.strip().lower())
+
+class OrderIntake:
+    """
+    HTTP-потоки проверяют подпись и состав заказа по каталогу и ставят заказ в очередь;
+    один поток-писатель сохраняет накопившиеся заказы одной транзакцией (db.insert_web_orders)
+    и только после коммита отвечает каждому запросу.
+    """
+
+    def __init__(self, catalog, secret, queue_size=INTAKE_QUEUE_SIZE, batch_size=INTAKE_BATCH_SIZE):
+        self.catalog = catalog
+        self.secret = secret
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = None
+        self._bot_username = None
+        self.accepted = 0
+        self.invalid = 0
+        self.rejected = 0
+        self.batches = 0
+        self.claimed = 0
+        self.timeouts = 0
+        self._committing = 0
+
+    def start(self, bot_username):
+        self._bot_username = bot_username
+        self._writer = threading.Thread(target=self._run_writer, name='order-intake', daemon=True)
+        self._writer.start()
+        logger.info(f"🌐 Приём заказов с сайта запущен: {INTAKE_PATH}")
+
+    @property
+    def running(self):
+        return self._writer is not None
+
+    def pending(self):
+        """Заказы в очереди и в сохраняемой пачке."""
+        return self._queue.qsize() + self._committing
+
+    def claim_url(self, token):
+        return f"https://t.me/{self._bot_username}?start={CLAIM_PREFIX}{token}"
+
+    def parse(self, payload):
+        """Проверяет заказ по каталогу. Цены берутся из каталога, а не из запроса."""
+        if not isinstance(payload, dict):
+            raise IntakeError("expected JSON object")
+        order_id = payload.get('order_id')
+        if not isinstance(order_id, str) or not 0 < len(order_id) <= 64 or not set(order_id) <= ORDER_ID_CHARS:
+            raise IntakeError("order_id must be 1-64 characters [A-Za-z0-9_-]")
+        items = payload.get('items')
+        if not isinstance(items, list) or not 0 < len(items) <= INTAKE_MAX_ITEMS:
+            raise IntakeError(f"items must be a list of 1-{INTAKE_MAX_ITEMS} items")
+        line_items = []
+        for item in items:
+            sku = item.get('sku') if isinstance(item, dict) else None
+            # Нестроковый sku (список, объект) не может быть ключом каталога
+            entry = self.catalog.get(sku) if isinstance(sku, str) else None
+            if entry is None:
+                raise IntakeError(f"unknown sku: {sku if isinstance(item, dict) else item}")
+            quantity = item.get('quantity', 1)
+            # bool - подкласс int: true не должно превращаться в количество 1
+            if type(quantity) is not int or not 0 < quantity <= INTAKE_MAX_QUANTITY:
+                raise IntakeError(f"quantity must be 1-{INTAKE_MAX_QUANTITY}: {entry.key}")
+            if 'price_uah' in item and item['price_uah'] != entry.price:
+                raise IntakeError(f"price mismatch for {entry.key}: catalog price is {entry.price}")
+            line_items.append({'sku': entry.key, 'name': entry.title, 'quantity': quantity, 'price_uah': entry.price})
+        total = sum(item['quantity'] * item['price_uah'] for item in line_items)
+        return order_id, line_items, total
+
+    def handle(self, body, headers):
+        """Обрабатывает POST из HTTP-потока. Возвращает (HTTP-код, JSON-ответ)."""
+        if not self.running:
+            return 503, {'error': 'unavailable'}
+        if not verify_signature(body, headers.get('X-Timestamp'), headers.get('X-Signature'), self.secret):
+            return 401, {'error': 'invalid signature'}
+        try:
+            order_id, line_items, total = self.parse(json.loads(body))
+        except (ValueError, UnicodeDecodeError) as e:
+            # IntakeError тоже ValueError; ошибки разбора JSON отвечаются так же
+            self.invalid += 1
+            return 422, {'error': str(e)}
+        future = Future()
+        try:
+            self._queue.put_nowait((secrets.token_urlsafe(16), order_id, line_items, total, future))
+        except queue.Full:
+            self.rejected += 1
+            return 503, {'error': 'busy'}
+        try:
+            # Для повтора уже сохранённого order_id - токен и сумма сохранённого заказа
+            token, total = future.result(timeout=INTAKE_COMMIT_TIMEOUT)
+        except FutureTimeout:
+            self.timeouts += 1
+            return 503, {'error': 'storage timeout'}
+        except Exception:
+            # Сайт повторит запрос: повтор того же order_id не создаст дубликат
+            return 503, {'error': 'storage unavailable'}
+        self.accepted += 1
+        return 201, {'order_id': order_id, 'token': token, 'total_uah': total, 'claim_url': self.claim_url(token)}
+
+    def _run_writer(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._committing = len(batch)
+            try:
+                self._commit_batch(batch)
+            finally:
+                self._committing = 0
+
+    def _commit_batch(self, batch):
+        # Любая ошибка пачки завершает все её future: поток-писатель продолжает работу,
+        # а HTTP-потоки отвечают 503 вместо вечного ожидания
+        try:
+            # Один order_id дважды в пачке (повтор запроса) - сохраняется первый
+            unique = {}
+            for token, order_id, line_items, total, _ in batch:
+                unique.setdefault(order_id, (token, order_id, json.dumps(line_items, ensure_ascii=False), total))
+            stored = db.insert_web_orders(list(unique.values()))
+            self.batches += 1
+            for _, order_id, _, _, future in batch:
+                order = stored.get(order_id)
+                if order is None:
+                    future.set_exception(RuntimeError(f"заказ {order_id} не сохранён"))
+                else:
+                    future.set_result(order)
+        except Exception as e:
+            logger.error(f"❌ Не удалось сохранить заказы с сайта ({len(batch)}): {e}")
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def purge(self):
+        """Удаляет забранные и просроченные заказы; запускается планировщиком раз в INTAKE_PURGE_INTERVAL."""
+        try:
+            removed = db.purge_web_orders(INTAKE_CLAIM_TTL)
+            if removed:
+                logger.info(f"🧹 Удалено заказов с сайта (забранных и просроченных): {removed}")
+        except Exception as e:
+            logger.warning(f"Не удалось удалить просроченные заказы с сайта: {e}")
+
+    def claim(self, payload, user_id):
+        """
+        Блокирующий вызов (из asyncio.to_thread): забирает заказ по параметру /start claim_<token>.
+        Возвращает (token, order_id, [(название, количество, цена)], total_uah) или None.
+        После оформления заказа вызывающий отмечает его через placed(token).
+        """
+        if not self.running or not payload or not payload.startswith(CLAIM_PREFIX):
+            return None
+        token = payload[len(CLAIM_PREFIX):]
+        order = db.claim_web_order(token, user_id, INTAKE_CLAIM_TTL)
+        if order is None:
+            return None
+        self.claimed += 1
+        line_items = [(item['name'], item['quantity'], item['price_uah']) for item in order['items']]
+        return order['token'], order['order_id'], line_items, order['total_uah']
+
+    def placed(self, token):
+        """
+        Блокирующий вызов: отмечает забранный заказ оформленным, после чего purge() его удаляет.
+        Забранный, но не отмеченный заказ не удаляется - клиент может открыть ссылку повторно.
+        """
+        try:
+            db.mark_web_order_placed(token)
+        except Exception as e:
+            logger.warning(f"Не удалось отметить заказ с сайта оформленным ({token}): {e}")
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'queued': self._queue.qsize(),
+            'accepted': self.accepted,
+            'invalid': self.invalid,
+            'rejected': self.rejected,
+            'batches': self.batches,
+            'claimed': self.claimed,
+            'timeouts': self.timeouts,
+        }
@@ -0,0 +1,271 @@
+# ipn.py - Приём IPN-уведомлений NOWPayments о статусе платежей
+import os
+import math
+import hmac
+import hashlib
+import json
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+IPN_PATH = "/ipn"
+IPN_MAX_BODY = 64 * 1024
+# Уведомлений, одновременно обрабатываемых HTTP-потоками; сверх этого провайдер получает 503
+IPN_QUEUE_SIZE = int(os.environ.get('IPN_QUEUE_SIZE', 1000))
+# Воркеры, отправляющие клиентам и персоналу сообщения об оплате
+IPN_WORKERS = int(os.environ.get('IPN_WORKERS', 4))
+IPN_DEDUP_SIZE = 10000
+# Уведомление относится к заказу не старше этого (и поиск затрагивает только свежие секции orders)
+IPN_ORDER_MAX_AGE_DAYS = int(os.environ.get('IPN_ORDER_MAX_AGE_DAYS', 30))
+# Валюта цены счёта: price_amount сверяется с orders.total_uah
+IPN_PRICE_CURRENCY = 'uah'
+
+# Порядок статусов NOWPayments: переход разрешён только "вперёд",
+# поэтому повторные и запоздавшие уведомления ничего не меняют.
+STATUS_RANK = {
+    'created': 0,
+    'waiting': 1,
+    'confirming': 2,
+    'confirmed': 3,
+    'sending': 4,
+    'partially_paid': 4,
+    'finished': 5,
+    'failed': 5,
+    'expired': 5,
+    'refunded': 6,
+}
+
+def verify_signature(body, signature, secret):
+    """
+    Проверяет подпись x-nowpayments-sig (HMAC-SHA512 от JSON с отсортированными ключами).
+    Возвращает разобранный payload или None, если подпись неверна.
+    """
+    if not secret or not signature:
+        return None
+    try:
+        payload = json.loads(body)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(payload, dict):
+        return None
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    expected = hmac.new(secret.encode('utf-8'), canonical.encode('utf-8'), hashlib.sha512).hexdigest()
+    if not hmac.compare_digest(expected, signature.strip().lower()):
+        return None
+    return payload
+
+def allowed_previous_statuses(status):
+    """Возвращает статусы, из которых разрешён переход в status."""
+    rank = STATUS_RANK.get(status)
+    if rank is None:
+        return []
+    return [s for s, r in STATUS_RANK.items() if r < rank]
+
+def parse_amount(value):
+    """Сумма из уведомления (число или строка) -> float; None, если её нет или она не число."""
+    if isinstance(value, bool):
+        return None
+    try:
+        amount = float(value)
+    except (TypeError, ValueError):
+        return None
+    return amount if math.isfinite(amount) else None
+
+class IPNProcessor:
+    """
+    Переход статуса выполняется в HTTP-потоке, и 200 отвечается только после записи в БД:
+    при ошибке провайдер получает 5xx и повторяет уведомление. Число одновременно обрабатываемых
+    уведомлений ограничено queue_size (лишние - 503). Уведомления клиенту и персоналу отправляют
+    воркеры в event loop бота, уже после ответа провайдеру.
+    update_order_status - метод хранилища (storage.py), чтобы платежи работали с любым бэкендом;
+    customer_texts(user_id) - тексты на языке клиента, staff_texts - уведомлений сотрудникам.
+    """
+
+    def __init__(self, update_order_status, customer_texts, staff_texts,
+                 queue_size=IPN_QUEUE_SIZE, workers=IPN_WORKERS):
+        self.update_order_status = update_order_status
+        self.customer_texts = customer_texts
+        self.staff_texts = staff_texts
+        self.queue_size = queue_size
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._seen = OrderedDict()
+        self._seen_lock = threading.Lock()
+        self._loop = None
+        self._queue = None
+        self._tasks = []
+        self._bot = None
+        self._staff_ids = []
+        self.accepted = 0
+        self.invalid = 0
+        self.rejected = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.unmatched = 0
+        self.processed = 0
+        self._active = 0
+
+    def start(self, bot, staff_ids):
+        """Запускает воркеры уведомлений. Вызывается внутри работающего event loop (post_init)."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._bot = bot
+        self._staff_ids = list(dict.fromkeys(i for i in staff_ids if i))
+        for _ in range(self.workers):
+            self._tasks.append(self._loop.create_task(self._worker()))
+        logger.info(f"💸 IPN обработчик запущен: {self.workers} воркеров, не больше {self.queue_size} уведомлений одновременно")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def running(self):
+        return self._loop is not None and bool(self._tasks)
+
+    def pending(self):
+        """Уведомления в обработке и сообщения клиентам/персоналу в очереди."""
+        return (self._queue.qsize() if self._queue else 0) + self._active
+
+    def _is_seen(self, key):
+        with self._seen_lock:
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                return True
+            return False
+
+    def _mark_seen(self, key):
+        """Запоминает обработанное (payment_id, status), чтобы повторы не шли в БД."""
+        with self._seen_lock:
+            self._seen[key] = True
+            if len(self._seen) > IPN_DEDUP_SIZE:
+                self._seen.popitem(last=False)
+
+    def handle(self, payload):
+        """Обрабатывает уведомление с проверенной подписью из HTTP-потока. Возвращает (HTTP-код, JSON-ответ)."""
+        if not self.running:
+            return 503, {'error': 'unavailable'}
+        payment_id = payload.get('payment_id')
+        order_id = payload.get('order_id')
+        status = payload.get('payment_status')
+        if payment_id is None or payment_id == '' or not order_id:
+            self.invalid += 1
+            return 400, {'error': 'payment_id and order_id are required'}
+        if status not in STATUS_RANK:
+            logger.warning(f"⚠️ IPN {payment_id} с неизвестным статусом: {status}")
+            return 200, {'status': 'ignored'}
+        key = (str(payment_id), status)
+        if self._is_seen(key):
+            self.duplicates += 1
+            return 200, {'status': 'duplicate'}
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            return 503, {'error': 'busy'}
+        self._active += 1
+        try:
+            match, order = self._apply(payload, str(payment_id), str(order_id), status)
+        except Exception as e:
+            # Провайдер повторит уведомление; в _seen оно не попало
+            self.failed += 1
+            logger.error(f"❌ Ошибка обработки IPN {payment_id} (заказ {order_id}): {e}")
+            return 500, {'error': 'storage unavailable'}
+        finally:
+            self._active -= 1
+            self._slots.release()
+        self.accepted += 1
+        self._mark_seen(key)
+        if match != 'matched':
+            self.unmatched += 1
+            logger.warning(f"⚠️ IPN {payment_id}: заказ {order_id} не сопоставлен ({match}), статус {status}")
+            if status == 'finished':
+                self._enqueue(self._notify_unmatched, payload, match)
+        elif order:
+            logger.info(f"💸 Заказ {order_id}: статус -> {order['status']} (платёж {payment_id})")
+            if order['status'] == 'finished':
+                self._enqueue(self._notify_finished, order, payload)
+            elif status == 'finished':
+                self._enqueue(self._notify_unmatched, payload, 'underpaid')
+        else:
+            logger.info(f"IPN {payment_id}: статус {status} заказа {order_id} уже применён")
+        return 200, {'status': 'processed'}
+
+    def _apply(self, payload, payment_id, order_id, status):
+        """
+        Блокирующий вызов: сумма заказа сверяется с price_amount (в UAH), а 'finished' без полной
+        оплаты (actually_paid < pay_amount) записывается как 'partially_paid'.
+        Возвращает (результат сопоставления, заказ с новым статусом или None).
+        """
+        price = parse_amount(payload.get('price_amount'))
+        if str(payload.get('price_currency', '')).lower() != IPN_PRICE_CURRENCY or price is None or price != int(price):
+            return 'amount_mismatch', None
+        if status == 'finished':
+            paid = parse_amount(payload.get('actually_paid'))
+            expected = parse_amount(payload.get('pay_amount'))
+            if paid is None or expected is None or paid < expected:
+                status = 'partially_paid'
+        return self.update_order_status(
+            payment_id, order_id, int(price), status, allowed_previous_statuses(status), IPN_ORDER_MAX_AGE_DAYS
+        )
+
+    def _enqueue(self, func, *args):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (func, args))
+
+    async def _worker(self):
+        while True:
+            func, args = await self._queue.get()
+            self._active += 1
+            try:
+                await func(*args)
+            except Exception as e:
+                logger.error(f"❌ Ошибка отправки уведомления об оплате: {e}")
+            finally:
+                self._active -= 1
+                self.processed += 1
+
+    async def _notify_staff(self, text):
+        for staff_id in self._staff_ids:
+            try:
+                await self._bot.send_message(chat_id=staff_id, text=text)
+            except Exception as e:
+                logger.error(f"❌ Не удалось уведомить {staff_id} об оплате: {e}")
+
+    async def _notify_finished(self, order, payload):
+        try:
+            await self._bot.send_message(
+                chat_id=order['user_id'],
+                text=self.customer_texts(order['user_id']).text('payment.received', order_id=order['order_id'])
+            )
+        except Exception as e:
+            logger.error(f"❌ Не удалось уведомить клиента {order['user_id']} об оплате: {e}")
+        await self._notify_staff(self.staff_texts.text(
+            'staff.order_paid', order_id=order['order_id'], user_id=order['user_id'], total_uah=order['total_uah'],
+            paid=payload.get('actually_paid') or payload.get('pay_amount'), pay_currency=payload.get('pay_currency', ''),
+            payment_id=payload.get('payment_id'),
+        ))
+
+    async def _notify_unmatched(self, payload, reason):
+        """Оплата, которую не удалось автоматически отнести к заказу, - на ручную проверку."""
+        await self._notify_staff(self.staff_texts.text(
+            'staff.payment_unmatched', order_id=payload.get('order_id'), payment_id=payload.get('payment_id'),
+            reason=self.staff_texts.text(f'staff.payment_reason.{reason}'),
+            price=payload.get('price_amount'), price_currency=payload.get('price_currency', ''),
+            paid=payload.get('actually_paid'), pay_amount=payload.get('pay_amount'),
+            pay_currency=payload.get('pay_currency', ''),
+        ))
+
+    def stats(self):
+        return {
+            'pending': self.pending(),
+            'accepted': self.accepted,
+            'invalid': self.invalid,
+            'rejected': self.rejected,
+            'duplicates': self.duplicates,
+            'failed': self.failed,
+            'unmatched': self.unmatched,
+            'processed': self.processed,
+        }
@@ -0,0 +1,196 @@
+# jobs.py - Фоновые отчёты и экспорты для владельцев: очередь, прогресс, отмена
+import os
+import time
+import asyncio
+import logging
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+# Один процесс по умолчанию: отчёты не должны отнимать CPU у обработки апдейтов
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', 1))
+REPORT_CONCURRENCY = int(os.environ.get('REPORT_CONCURRENCY', 1))
+# Сколько задач может быть в работе и в очереди одновременно
+REPORT_QUEUE_SIZE = int(os.environ.get('REPORT_QUEUE_SIZE', 4))
+PROGRESS_EDIT_INTERVAL = 3
+
+def _lower_priority():
+    try:
+        os.nice(10)
+    except OSError:
+        pass
+
+class JobContext:
+    """Передаётся задаче: вынос работы в процесс/поток и сообщения о прогрессе."""
+
+    def __init__(self, manager, job):
+        self._manager = manager
+        self._job = job
+
+    async def run_cpu(self, func, *args):
+        """
+        Выполняет CPU-тяжёлую функцию в пуле процессов (func - уровня импортируемого модуля, например
+        reports). Если воркер упал, пул пересоздаётся и функция выполняется ещё раз.
+        """
+        loop = asyncio.get_running_loop()
+        pool = self._manager.process_pool()
+        try:
+            return await loop.run_in_executor(pool, func, *args)
+        except BrokenProcessPool:
+            self._manager.discard_pool(pool)
+            return await loop.run_in_executor(self._manager.process_pool(), func, *args)
+
+    async def run_io(self, func, *args):
+        """Выполняет блокирующий ввод-вывод (БД, файлы) в потоке."""
+        return await asyncio.to_thread(func, *args)
+
+    async def progress(self, done, total=None):
+        await self._manager.report_progress(self._job, done, total)
+
+class Job:
+    __slots__ = ('id', 'title', 'chat_id', 'message', 'task', 'status', 'last_edit')
+
+    def __init__(self, job_id, title, chat_id):
+        self.id = job_id
+        self.title = title
+        self.chat_id = chat_id
+        self.message = None
+        self.task = None
+        self.status = 'queued'
+        self.last_edit = 0.0
+
+class JobManager:
+    """
+    Ограниченная очередь задач отчётов. Задача - async-функция job(ctx), возвращающая
+    (bytes или путь к временному файлу, имя файла, подпись) или None. Результат отправляется
+    документом в чат владельца (временный файл затем удаляется); прогресс и кнопка
+    отмены - в отдельном сообщении.
+    """
+
+    def __init__(self, workers=REPORT_WORKERS, concurrency=REPORT_CONCURRENCY, queue_size=REPORT_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._pool = None
+        self._bot = None
+        self._jobs = {}
+        self.pool_restarts = 0
+        self._ids = itertools.count(1)
+
+    def start(self, bot):
+        self._bot = bot
+
+    def process_pool(self):
+        # Пул создаётся при первом отчёте; spawn - чтобы не форкать процесс с потоками и event loop
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_lower_priority,
+            )
+        return self._pool
+
+    def discard_pool(self, pool):
+        """Убирает сломанный пул (воркер упал): следующий process_pool() создаст новый."""
+        if self._pool is pool:
+            logger.warning("⚠️ Пул процессов отчётов сломан (воркер завершился), создаётся новый")
+            self._pool = None
+            self.pool_restarts += 1
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def shutdown(self):
+        """Отменяет отчёты при остановке бота и дожидается их завершения."""
+        tasks = [job.task for job in self._jobs.values() if job.task]
+        for task in tasks:
+            task.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            'running': sum(1 for job in self._jobs.values() if job.status == 'running'),
+            'queued': sum(1 for job in self._jobs.values() if job.status == 'queued'),
+            'pool_restarts': self.pool_restarts,
+        }
+
+    @staticmethod
+    def cancel_markup(job):
+        return InlineKeyboardMarkup([[InlineKeyboardButton("❌ Скасувати", callback_data=f"job_cancel_{job.id}")]])
+
+    async def submit(self, chat_id, title, job_func):
+        """Ставит задачу в очередь. Возвращает Job или None, если очередь заполнена."""
+        if len(self._jobs) >= self.queue_size:
+            return None
+        job = Job(next(self._ids), title, chat_id)
+        self._jobs[job.id] = job
+        try:
+            job.message = await self._bot.send_message(
+                chat_id, f"⏳ {title}: в черзі (#{job.id})", reply_markup=self.cancel_markup(job)
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось отправить статус задачи #{job.id}: {e}")
+        job.task = asyncio.get_running_loop().create_task(self._run(job, job_func))
+        return job
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        job.task.cancel()
+        return True
+
+    async def _set_status(self, job, text, keep_button=False):
+        if job.message is None:
+            return
+        try:
+            await job.message.edit_text(text, reply_markup=self.cancel_markup(job) if keep_button else None)
+        except Exception as e:
+            logger.debug(f"Не удалось обновить статус задачи #{job.id}: {e}")
+
+    async def report_progress(self, job, done, total=None):
+        now = time.monotonic()
+        if now - job.last_edit < PROGRESS_EDIT_INTERVAL:
+            return
+        job.last_edit = now
+        if total:
+            text = f"⏳ {job.title}: {done}/{total} ({done * 100 // total}%)"
+        else:
+            text = f"⏳ {job.title}: {done}"
+        await self._set_status(job, text, keep_button=True)
+
+    async def _run(self, job, job_func):
+        started = None
+        try:
+            async with self._semaphore:
+                job.status = 'running'
+                started = time.monotonic()
+                logger.info(f"📊 Задача #{job.id} ({job.title}) запущена")
+                await self._set_status(job, f"⏳ {job.title}: виконується...", keep_button=True)
+                result = await job_func(JobContext(self, job))
+            if result is None:
+                await self._set_status(job, f"ℹ️ {job.title}: немає даних")
+                return
+            document, filename, caption = result
+            await self._set_status(job, f"✅ {job.title}: готово за {time.monotonic() - started:.1f}с")
+            if isinstance(document, (bytes, bytearray)):
+                await self._bot.send_document(job.chat_id, document=bytes(document), filename=filename, caption=caption)
+            else:
+                try:
+                    with open(document, 'rb') as file:
+                        await self._bot.send_document(job.chat_id, document=file, filename=filename, caption=caption)
+                finally:
+                    os.remove(document)
+        except asyncio.CancelledError:
+            logger.info(f"📊 Задача #{job.id} ({job.title}) отменена")
+            await self._set_status(job, f"🚫 {job.title}: скасовано")
+        except Exception as e:
+            logger.error(f"❌ Задача #{job.id} ({job.title}) завершилась ошибкой: {e}")
+            await self._set_status(job, f"❌ {job.title}: помилка")
+        finally:
+            self._jobs.pop(job.id, None)
@@ -0,0 +1,120 @@
+# lifecycle.py - Готовность к трафику и плавная остановка бота
+#
+# Состояния: starting -> ready -> draining -> stopped. /health отвечает 200 только в ready,
+# поэтому при деплое платформа переключает трафик на новый инстанс, когда тот готов, а старый
+# перестаёт получать его с началом остановки.
+#
+# По SIGTERM/SIGINT: прекращается получение апдейтов (непрочитанные достанутся новому инстансу),
+# затем до SHUTDOWN_GRACE секунд ждём, пока завершатся апдейты в работе и опустеют очереди
+# (IPN, заказы с сайта), после чего выполняются шаги остановки в порядке регистрации:
+# отложенные записи и журнал, закрытие соединений с БД и HTTP-клиентов.
+import os
+import time
+import signal
+import asyncio
+import inspect
+import logging
+
+logger = logging.getLogger(__name__)
+
+SHUTDOWN_GRACE = float(os.environ.get('SHUTDOWN_GRACE', 20))
+DRAIN_POLL_INTERVAL = 0.1
+
+class Lifecycle:
+    def __init__(self, grace=SHUTDOWN_GRACE):
+        self.grace = grace
+        self.state = 'starting'
+        self._pending = {}
+        self._stop_steps = []
+        self._drain_task = None
+        self.drain_seconds = None
+        self.leftover = {}
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    @property
+    def draining(self):
+        return self.state in ('draining', 'stopped')
+
+    def mark_ready(self):
+        if self.state == 'starting':
+            self.state = 'ready'
+            logger.info("✅ Бот готов принимать трафик")
+
+    def track(self, name, pending):
+        """Регистрирует источник незавершённой работы: pending() - число ожидающих элементов."""
+        self._pending[name] = pending
+
+    def on_stop(self, name, step):
+        """
+        Регистрирует шаг остановки без аргументов. Корутинные функции ожидаются в event loop,
+        обычные (блокирующие) выполняются в потоке.
+        """
+        self._stop_steps.append((name, step))
+
+    def pending(self):
+        return {name: pending() for name, pending in self._pending.items()}
+
+    def install_signal_handlers(self, application, signals=(signal.SIGTERM, signal.SIGINT)):
+        """Вызывается в post_init; run_polling при этом запускается с stop_signals=None."""
+        loop = asyncio.get_running_loop()
+        try:
+            for sig in signals:
+                loop.add_signal_handler(sig, self.request_stop, application)
+        except NotImplementedError:
+            # Windows: остаётся KeyboardInterrupt, на котором PTB остановится без ожидания очередей
+            logger.warning("🛑 Обработчики сигналов не поддерживаются, плавная остановка недоступна")
+
+    def request_stop(self, application):
+        if self._drain_task is None:
+            self._drain_task = asyncio.get_running_loop().create_task(self._drain(application))
+            return
+        # Повторный сигнал - выходим, не дожидаясь очередей (журнал записей остаётся на диске)
+        logger.warning("🛑 Повторный сигнал завершения, немедленный выход")
+        os._exit(1)
+
+    async def _drain(self, application):
+        self.state = 'draining'
+        started = time.monotonic()
+        logger.info(f"🛑 Принят сигнал завершения: остановка приёма апдейтов, ожидание до {self.grace:g}с")
+        if application.updater and application.updater.running:
+            try:
+                await application.updater.stop()
+            except Exception as e:
+                logger.error(f"Ошибка остановки получения апдейтов: {e}")
+        deadline = started + self.grace
+        pending = self.pending()
+        while any(pending.values()) and time.monotonic() < deadline:
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+            pending = self.pending()
+        self.leftover = {name: count for name, count in pending.items() if count}
+        self.drain_seconds = round(time.monotonic() - started, 2)
+        if self.leftover:
+            logger.warning(f"🛑 Не дождались за {self.grace:g}с: {self.leftover}")
+        else:
+            logger.info(f"🛑 Работа в процессе завершена за {self.drain_seconds}с")
+        application.stop_running()
+
+    async def run_stop_steps(self):
+        """Выполняет шаги остановки; ошибка одного шага не отменяет остальные."""
+        for name, step in self._stop_steps:
+            try:
+                if inspect.iscoroutinefunction(step):
+                    await step()
+                else:
+                    await asyncio.to_thread(step)
+            except Exception as e:
+                logger.error(f"Ошибка шага остановки {name}: {e}")
+        self.state = 'stopped'
+        logger.info("⏹️ Бот остановлен")
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'ready': self.ready,
+            'pending': self.pending(),
+            'drain_seconds': self.drain_seconds,
+            'leftover': self.leftover,
+        }
@@ -0,0 +1,166 @@
+# logs.py - Логирование без записи в stderr из event loop
+#
+# Корневой логгер пишет в очередь (QueueHandler), а форматирование и вывод выполняет отдельный
+# поток QueueListener. Переполненная очередь не блокирует вызывающий код: запись отбрасывается
+# и учитывается в stats(). Записи ниже WARNING можно сэмплировать и ограничивать по частоте
+# для отдельных логгеров (например, 'updates' - по строке на каждый апдейт); WARNING и выше
+# проходят всегда.
+#
+# LOG_FORMAT=json - одна JSON-строка на запись (для сборщиков логов).
+# LOG_SAMPLING="updates=0.1" - доля сохраняемых записей логгера (и его потомков).
+# LOG_RATE_LIMITS="updates=50" - не больше N записей в секунду на логгер.
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_SAMPLING = os.environ.get('LOG_SAMPLING', '')
+LOG_RATE_LIMITS = os.environ.get('LOG_RATE_LIMITS', 'updates=50')
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+def parse_logger_values(spec, cast=float):
+    """'updates=0.1,db=0.5' -> {'updates': 0.1, 'db': 0.5}"""
+    values = {}
+    for part in spec.split(','):
+        name, sep, value = part.partition('=')
+        if sep and name.strip():
+            values[name.strip()] = cast(value)
+    return values
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает WARNING и выше всегда, остальные записи - с долей sampling[логгер]
+    и не чаще rate_limits[логгер] в секунду. Настройка логгера действует и на его потомков.
+    """
+
+    def __init__(self, sampling=None, rate_limits=None):
+        super().__init__()
+        self.sampling = sampling or {}
+        self.rate_limits = rate_limits or {}
+        self._rules = {}
+        self._windows = {}
+        self._lock = threading.Lock()
+        self.sampled_out = Counter()
+        self.rate_limited = Counter()
+
+    def _rule(self, name):
+        rule = self._rules.get(name)
+        if rule is None:
+            rate, limit = 1.0, None
+            parts = name.split('.')
+            # Самая точная настройка: 'main.updates' важнее 'main'
+            for i in range(len(parts), 0, -1):
+                prefix = '.'.join(parts[:i])
+                if prefix in self.sampling or prefix in self.rate_limits:
+                    rate = self.sampling.get(prefix, 1.0)
+                    limit = self.rate_limits.get(prefix)
+                    break
+            rule = self._rules[name] = (rate, limit)
+        return rule
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate, limit = self._rule(record.name)
+        if rate < 1.0 and random.random() >= rate:
+            self.sampled_out[record.name] += 1
+            return False
+        if limit is not None:
+            second = int(time.monotonic())
+            with self._lock:
+                window = self._windows.get(record.name)
+                if window is None or window[0] != second:
+                    window = self._windows[record.name] = [second, 0]
+                window[1] += 1
+                if window[1] > limit:
+                    self.rate_limited[record.name] += 1
+                    return False
+        return True
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler, отбрасывающий записи при переполненной очереди вместо ожидания."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Аргументы подставляются сразу (объекты могут измениться), а время, уровень, JSON
+        # и трассировка исключения форматируются в потоке вывода
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class LogPipeline:
+    def __init__(self, handler, listener, sampling_filter):
+        self.handler = handler
+        self.listener = listener
+        self.filter = sampling_filter
+        self._running = True
+
+    def stop(self):
+        """Дописывает очередь и останавливает поток вывода."""
+        if self._running:
+            self._running = False
+            self.listener.stop()
+
+    def stats(self):
+        return {
+            'queued': self.handler.queue.qsize(),
+            'dropped': self.handler.dropped,
+            'sampled_out': dict(self.filter.sampled_out),
+            'rate_limited': dict(self.filter.rate_limited),
+        }
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, queue_size=LOG_QUEUE_SIZE,
+                  sampling=LOG_SAMPLING, rate_limits=LOG_RATE_LIMITS, stream=None):
+    """Заменяет обработчики корневого логгера очередью; вывод - в потоке QueueListener."""
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+    log_queue = queue.Queue(maxsize=queue_size)
+    handler = NonBlockingQueueHandler(log_queue)
+    sampling_filter = SamplingFilter(parse_logger_values(sampling), parse_logger_values(rate_limits, int))
+    handler.addFilter(sampling_filter)
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    pipeline = LogPipeline(handler, listener, sampling_filter)
+    # Записи, оставшиеся в очереди при выходе, дописываются
+    atexit.register(pipeline.stop)
+    return pipeline
@@ -0,0 +1,266 @@
+# partitions.py - Помесячное секционирование messages/orders/active_questions и архивирование
+#
+# При первом запуске рядом с существующей таблицей строится секционированная <table>_new с
+# помесячными секциями <table>_pYYYYMM (от месяца самой старой строки), и строки копируются в неё
+# пачками по короткой транзакции, пока таблица работает. Изменения, сделанные за время копирования,
+# триггер записывает в <table>_changes; под ACCESS EXCLUSIVE остаётся только догнать их и
+# поменять таблицы местами. История сразу отсекается по месяцам и архивируется по одному месяцу.
+# Дальше секции создаются заранее, а секции старше ARCHIVE_RETENTION_MONTHS выгружаются в
+# ARCHIVE_DIR/<секция>.csv.gz и удаляются.
+import os
+import re
+import gzip
+import logging
+from datetime import date
+import psycopg
+from config import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', 3))
+ARCHIVE_RETENTION_MONTHS = int(os.environ.get('ARCHIVE_RETENTION_MONTHS', 12))
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+# Строк в одной транзакции копирования при миграции
+PARTITION_MIGRATION_BATCH = int(os.environ.get('PARTITION_MIGRATION_BATCH', 10000))
+# Сколько ждать ACCESS EXCLUSIVE для замены таблицы и сколько раз пробовать снова
+PARTITION_SWAP_LOCK_TIMEOUT = os.environ.get('PARTITION_SWAP_LOCK_TIMEOUT', '5s')
+PARTITION_SWAP_ATTEMPTS = int(os.environ.get('PARTITION_SWAP_ATTEMPTS', 10))
+# Время ежедневного обслуживания секций (ЧЧ:ММ, время сервера)
+PARTITION_MAINTENANCE_AT = os.environ.get('PARTITION_MAINTENANCE_AT', '04:30')
+
+# Индексы (имя, определение) создаются на родительской таблице и наследуются всеми секциями.
+# Поиск по id обслуживает первичный ключ (id, created_at). Имена совпадают с индексами из
+# db.init_db, чтобы при следующем старте там не создавались дубликаты.
+PARTITIONED_TABLES = {
+    'messages': [
+        ('idx_messages_user_created', "(user_id, created_at DESC, id DESC)"),
+    ],
+    'orders': [
+        ('idx_orders_part_1', "(order_id, created_at DESC)"),
+        ('idx_orders_part_2', "(user_id, created_at DESC)"),
+        ('idx_orders_payment', "(payment_id, created_at DESC) WHERE payment_id IS NOT NULL"),
+    ],
+    'active_questions': [
+        ('idx_active_questions_open', "(created_at DESC, id DESC) WHERE status = 'open'"),
+        ('idx_active_questions_part_2', "(user_id) WHERE status = 'open'"),
+    ],
+}
+
+UPPER_BOUND_RE = re.compile(r"TO \('([^']+)'\)")
+
+def month_start(day, shift=0):
+    month = day.year * 12 + day.month - 1 + shift
+    return date(month // 12, month % 12 + 1, 1)
+
+def is_partitioned(cur, table):
+    cur.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", (table,))
+    return cur.fetchone() is not None
+
+def list_partitions(cur, table):
+    """Возвращает [(имя секции, верхняя граница date или None для DEFAULT)] по возрастанию границы."""
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+    """, (table,))
+    partitions = []
+    for name, bound in cur.fetchall():
+        match = UPPER_BOUND_RE.search(bound or '')
+        partitions.append((name, date.fromisoformat(match.group(1)[:10]) if match else None))
+    return sorted(partitions, key=lambda p: (p[1] is None, p[1] or date.min))
+
+def create_month_partitions(cur, table, start, until, parent=None):
+    """Создаёт секции <table>_pYYYYMM для месяцев [start, until) в parent (по умолчанию - в table)."""
+    parent = parent or table
+    created = []
+    while start < until:
+        end = month_start(start, 1)
+        name = f"{table}_p{start:%Y%m}"
+        # В DDL нельзя передавать параметры - границы (date) подставляются литералами
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {parent} FOR VALUES FROM ('{start}') TO ('{end}')")
+        created.append(name)
+        start = end
+    return created
+
+MIGRATION_TRIGGER_FUNCTION = """
+    CREATE OR REPLACE FUNCTION partition_migration_log() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            EXECUTE format('INSERT INTO %I (id) VALUES ($1)', TG_ARGV[0]) USING OLD.id;
+        ELSE
+            EXECUTE format('INSERT INTO %I (id) VALUES ($1)', TG_ARGV[0]) USING NEW.id;
+        END IF;
+        RETURN NULL;
+    END
+    $$
+"""
+
+def migrate_table(conn, table, indexes, today):
+    """
+    Превращает обычную таблицу в секционированную: копия строится рядом пачками, а под
+    ACCESS EXCLUSIVE только догоняются изменения из <table>_changes и меняются имена.
+    """
+    new, changes = f"{table}_new", f"{table}_changes"
+    logger.info(f"🗂️ Перевод {table} на помесячное секционирование")
+    with conn.cursor() as cur:
+        # Остатки прерванной миграции
+        cur.execute(f"DROP TRIGGER IF EXISTS {table}_partition_migration ON {table}")
+        cur.execute(f"DROP TABLE IF EXISTS {new}, {changes}")
+        cur.execute(f"CREATE TABLE {new} (LIKE {table} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)")
+        # Уникальность на секционированной таблице возможна только вместе с ключом секционирования
+        cur.execute(f"ALTER TABLE {new} ADD PRIMARY KEY (id, created_at)")
+        cur.execute(f"ALTER TABLE {new} ADD FOREIGN KEY (user_id) REFERENCES users(id)")
+        cur.execute(f"SELECT MIN(created_at) FROM {table}")
+        oldest = cur.fetchone()[0]
+        create_month_partitions(cur, table, month_start(oldest or today), month_start(today, 1), parent=new)
+        cur.execute(f"CREATE TABLE {table}_default PARTITION OF {new} DEFAULT")
+        # С этого момента каждая изменённая строка будет скопирована заново при замене
+        cur.execute(f"CREATE TABLE {changes} (id BIGINT NOT NULL)")
+        cur.execute(MIGRATION_TRIGGER_FUNCTION)
+        cur.execute(f"""
+            CREATE TRIGGER {table}_partition_migration AFTER INSERT OR UPDATE OR DELETE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION partition_migration_log('{changes}')
+        """)
+        cur.execute("SELECT attname FROM pg_attribute WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped ORDER BY attnum", (table,))
+        columns = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    # Строки без created_at попадают в текущий месяц
+    select_list = ", ".join("COALESCE(created_at, NOW())" if c == 'created_at' else c for c in columns)
+    column_list = ", ".join(columns)
+    last_id, copied = 0, 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                WITH moved AS (
+                    INSERT INTO {new} ({column_list})
+                    SELECT {select_list} FROM {table} WHERE id > %s ORDER BY id LIMIT %s
+                    RETURNING id
+                )
+                SELECT COUNT(*), MAX(id) FROM moved
+            """, (last_id, PARTITION_MIGRATION_BATCH))
+            count, max_id = cur.fetchone()
+        conn.commit()
+        if not count:
+            break
+        last_id, copied = max_id, copied + count
+    logger.info(f"🗂️ {table}: скопировано строк: {copied}")
+    # Индексы - после загрузки: построить их один раз быстрее, чем обновлять на каждой строке.
+    # Старые индексы с теми же именами ещё существуют, поэтому до замены имена временные.
+    with conn.cursor() as cur:
+        for name, definition in indexes:
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {name}_new ON {new} {definition}")
+    conn.commit()
+    swap_tables(conn, table, indexes, columns, select_list, last_id)
+
+def swap_tables(conn, table, indexes, columns, select_list, last_id):
+    """Под коротким ACCESS EXCLUSIVE догоняет изменения из <table>_changes и подменяет таблицу."""
+    new, changes = f"{table}_new", f"{table}_changes"
+    column_list = ", ".join(columns)
+    for attempt in range(1, PARTITION_SWAP_ATTEMPTS + 1):
+        try:
+            with conn.cursor() as cur:
+                # Очередь за блокировкой остановила бы и все запросы к таблице - ждём недолго
+                cur.execute(f"SET LOCAL lock_timeout = '{PARTITION_SWAP_LOCK_TIMEOUT}'")
+                cur.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+                cur.execute(f"DELETE FROM {new} WHERE id IN (SELECT id FROM {changes})")
+                cur.execute(f"""
+                    INSERT INTO {new} ({column_list})
+                    SELECT {select_list} FROM {table}
+                    WHERE id > %s OR id IN (SELECT id FROM {changes})
+                """, (last_id,))
+                logger.info(f"🗂️ {table}: догнано изменённых строк: {cur.rowcount}")
+                # Последовательность id должна принадлежать новой таблице, иначе удалится вместе со старой
+                cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (table,))
+                sequence = cur.fetchone()[0]
+                if sequence:
+                    cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY {new}.id")
+                cur.execute(f"DROP TABLE {table}, {changes}")
+                cur.execute(f"ALTER TABLE {new} RENAME TO {table}")
+                cur.execute(f"ALTER TABLE {table} RENAME CONSTRAINT {new}_pkey TO {table}_pkey")
+                cur.execute(f"ALTER TABLE {table} RENAME CONSTRAINT {new}_user_id_fkey TO {table}_user_id_fkey")
+                for name, _ in indexes:
+                    cur.execute(f"ALTER INDEX {name}_new RENAME TO {name}")
+            conn.commit()
+            return
+        except psycopg.errors.LockNotAvailable:
+            conn.rollback()
+            logger.warning(f"⚠️ {table}: таблица занята, замена отложена (попытка {attempt}/{PARTITION_SWAP_ATTEMPTS})")
+    raise RuntimeError(f"не удалось заблокировать {table} для замены на секционированную")
+
+def ensure_partitions(cur, table, today, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Создаёт помесячные секции от последней существующей границы до months_ahead вперёд."""
+    bounds = [upper for _, upper in list_partitions(cur, table) if upper]
+    start = max(bounds) if bounds else month_start(today)
+    return create_month_partitions(cur, table, start, month_start(today, months_ahead + 1))
+
+def setup(today=None):
+    """Вызывается при старте после init_db: миграция (однократно) и секции на будущее."""
+    today = today or date.today()
+    with psycopg.connect(DATABASE_URL) as conn:
+        with conn.cursor() as cur:
+            # Позиции заказов не могут ссылаться на orders(id): уникален только (id, created_at)
+            cur.execute("ALTER TABLE IF EXISTS order_items DROP CONSTRAINT IF EXISTS order_items_order_ref_fkey")
+        conn.commit()
+        for table, indexes in PARTITIONED_TABLES.items():
+            with conn.cursor() as cur:
+                migrate = not is_partitioned(cur, table)
+            conn.commit()
+            if migrate:
+                migrate_table(conn, table, indexes, today)
+            with conn.cursor() as cur:
+                created = ensure_partitions(cur, table, today)
+            conn.commit()
+            if created:
+                logger.info(f"🗂️ {table}: созданы секции {', '.join(created)}")
+
+def _copy_to_file(cur, query, path):
+    """COPY TO STDOUT в gzip-файл; файл появляется под итоговым именем только после fsync."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as target:
+            with cur.copy(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)") as copy:
+                for chunk in copy:
+                    target.write(chunk)
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, path)
+    return cur.rowcount
+
+def archive_old_partitions(today=None, retention_months=ARCHIVE_RETENTION_MONTHS, archive_dir=ARCHIVE_DIR):
+    """
+    Выгружает в archive_dir и удаляет секции, целиком лежащие раньше окна хранения.
+    Секции active_questions с открытыми вопросами не трогаются. Возвращает имена архивированных секций.
+    """
+    cutoff = month_start(today or date.today(), -retention_months)
+    os.makedirs(archive_dir, exist_ok=True)
+    archived = []
+    with psycopg.connect(DATABASE_URL) as conn:
+        with conn.cursor() as cur:
+            for table in PARTITIONED_TABLES:
+                for name, upper in list_partitions(cur, table):
+                    if upper is None or upper > cutoff:
+                        continue
+                    if table == 'active_questions':
+                        cur.execute(f"SELECT 1 FROM {name} WHERE status = 'open' LIMIT 1")
+                        if cur.fetchone():
+                            logger.warning(f"🗄️ {name}: есть открытые вопросы, архивирование отложено")
+                            continue
+                    rows = _copy_to_file(cur, f"SELECT * FROM {name}", os.path.join(archive_dir, f"{name}.csv.gz"))
+                    if table == 'orders':
+                        _copy_to_file(
+                            cur,
+                            f"SELECT i.* FROM order_items i JOIN {name} o ON o.id = i.order_ref",
+                            os.path.join(archive_dir, f"{name}_items.csv.gz"),
+                        )
+                        cur.execute(f"DELETE FROM order_items WHERE order_ref IN (SELECT id FROM {name})")
+                    cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+                    cur.execute(f"DROP TABLE {name}")
+                    conn.commit()
+                    archived.append(name)
+                    logger.info(f"🗄️ Секция {name} ({rows} строк) выгружена в архив и удалена")
+    return archived
+
+def maintain():
+    """Создаёт будущие секции и архивирует старые; планировщик запускает ежедневно в PARTITION_MAINTENANCE_AT."""
+    setup()
+    return archive_old_partitions()
@@ -0,0 +1,141 @@
+# persistence.py - Хранение context.user_data в Postgres (JSONB на пользователя)
+import os
+import json
+import asyncio
+import logging
+from telegram.ext import BasePersistence, PersistenceInput
+import db
+
+logger = logging.getLogger(__name__)
+
+PERSISTENCE_FLUSH_INTERVAL = float(os.environ.get('PERSISTENCE_FLUSH_INTERVAL', 5))
+
+def serialize_state(data):
+    return json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+
+class PostgresPersistence(BasePersistence):
+    """
+    Персистентность только для user_data.
+    - Данные пользователя загружаются лениво при его первом апдейте (refresh_user_data),
+      поэтому время старта не зависит от числа пользователей.
+    - Записываются только пользователи, чьи данные реально изменились
+      (сравнение с последним сохранённым снимком).
+    - Изменения копятся и сбрасываются в БД одной пачкой раз в flush_interval.
+    - Ключи expiring_keys из состояния, не менявшегося дольше state_ttl,
+      отбрасываются при загрузке (незавершённый диалог не переживает перезапуск).
+    """
+
+    def __init__(self, flush_interval=PERSISTENCE_FLUSH_INTERVAL, expiring_keys=(), state_ttl=None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=flush_interval,
+        )
+        self.flush_interval = flush_interval
+        self.expiring_keys = tuple(expiring_keys)
+        self.state_ttl = state_ttl
+        self._snapshots = {}
+        self._pending = {}
+        self._deleted = set()
+        self._flush_lock = asyncio.Lock()
+        self.writes = 0
+        self.skipped = 0
+
+    def forget(self, user_id):
+        """Забывает снимок пользователя: при следующем апдейте данные загрузятся из БД заново."""
+        self._snapshots.pop(user_id, None)
+
+    def stats(self):
+        return {
+            'loaded': len(self._snapshots),
+            'pending': len(self._pending),
+            'writes': self.writes,
+            'skipped': self.skipped,
+        }
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._snapshots:
+            return
+        if user_id in self._deleted:
+            # Удаление ещё не сброшено в БД - не поднимаем старое состояние
+            self._snapshots[user_id] = serialize_state({})
+            return
+        try:
+            data, age = await asyncio.to_thread(db.load_user_state, user_id)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки состояния пользователя {user_id}: {e}")
+            return
+        # Снимок - то, что лежит в БД; если ключи истекли, апдейт перезапишет состояние
+        self._snapshots[user_id] = serialize_state(data or {})
+        if data and self.state_ttl is not None and age > self.state_ttl:
+            data = {key: value for key, value in data.items() if key not in self.expiring_keys}
+        if data and not user_data:
+            user_data.update(data)
+
+    async def update_user_data(self, user_id, data):
+        serialized = serialize_state(data)
+        if self._snapshots.get(user_id) == serialized and user_id not in self._pending:
+            self.skipped += 1
+            return
+        self._pending[user_id] = serialized
+        self._deleted.discard(user_id)
+
+    async def drop_user_data(self, user_id):
+        stored = self._snapshots.pop(user_id, None)
+        if self._pending.pop(user_id, None) is None and stored == serialize_state({}):
+            # В БД нечего удалять
+            return
+        self._deleted.add(user_id)
+
+    async def flush(self):
+        async with self._flush_lock:
+            pending, self._pending = self._pending, {}
+            deleted, self._deleted = self._deleted, set()
+            try:
+                if pending:
+                    await asyncio.to_thread(db.save_user_states, list(pending.items()))
+                if deleted:
+                    await asyncio.to_thread(db.delete_user_states, deleted)
+            except Exception:
+                # Вернём несохранённое в очередь, не затирая более свежие изменения
+                for user_id, serialized in pending.items():
+                    self._pending.setdefault(user_id, serialized)
+                self._deleted |= deleted - set(self._pending)
+                raise
+            self._snapshots.update(pending)
+            self.writes += len(pending)
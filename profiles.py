@@ -0,0 +1,124 @@
+# profiles.py - Ограниченный кэш профилей пользователей (LRU + TTL)
+import os
+import sys
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', 10000))
+PROFILE_CACHE_TTL = int(os.environ.get('PROFILE_CACHE_TTL', 3600))
+DEFAULT_LANGUAGE = 'uk'
+
+class UserProfile:
+    __slots__ = ('username', 'first_name', 'last_name', 'language_code', 'is_owner', 'expires_at')
+
+    def __init__(self, user, is_owner, expires_at):
+        self.username = user.username
+        self.first_name = user.first_name
+        self.last_name = user.last_name
+        self.language_code = user.language_code
+        self.is_owner = is_owner
+        self.expires_at = expires_at
+
+    def memory_bytes(self):
+        total = sys.getsizeof(self)
+        for field in ('username', 'first_name', 'last_name', 'language_code'):
+            value = getattr(self, field)
+            if value is not None:
+                total += sys.getsizeof(value)
+        return total
+
+    def matches(self, user):
+        return (
+            self.username == user.username
+            and self.first_name == user.first_name
+            and self.last_name == user.last_name
+            and self.language_code == user.language_code
+        )
+
+class ProfileCache:
+    """
+    Профили недавно активных пользователей. Пока профиль в кэше и не изменился,
+    повторный upsert в users не нужен. Размер ограничен max_size (LRU),
+    записи старше ttl считаются неизвестными и обновляются в БД.
+    """
+
+    def __init__(self, owner_ids=(), max_size=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL):
+        self.owner_ids = set(owner_ids)
+        self.max_size = max_size
+        self.ttl = ttl
+        self._profiles = OrderedDict()
+        # Объём записей считается при изменениях: stats() вызывается из потока /health,
+        # и обход OrderedDict там гонялся бы с event loop
+        self._entries_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def get(self, user_id):
+        profile = self._profiles.get(user_id)
+        if profile is None:
+            return None
+        if profile.expires_at < time.monotonic():
+            self._remove(user_id)
+            return None
+        self._profiles.move_to_end(user_id)
+        return profile
+
+    def is_known(self, user):
+        """True, если пользователь в кэше и его данные не изменились (upsert не нужен)."""
+        profile = self.get(user.id)
+        if profile is not None and profile.matches(user):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def is_owner(self, user_id):
+        profile = self.get(user_id)
+        return profile.is_owner if profile else user_id in self.owner_ids
+
+    def language(self, user_id, default=DEFAULT_LANGUAGE):
+        profile = self.get(user_id)
+        return (profile.language_code if profile else None) or default
+
+    @staticmethod
+    def _entry_bytes(user_id, profile):
+        return sys.getsizeof(user_id) + profile.memory_bytes()
+
+    def _remove(self, user_id):
+        profile = self._profiles.pop(user_id, None)
+        if profile is not None:
+            self._entries_bytes -= self._entry_bytes(user_id, profile)
+
+    def put(self, user):
+        self._remove(user.id)
+        profile = UserProfile(user, user.id in self.owner_ids, time.monotonic() + self.ttl)
+        self._profiles[user.id] = profile
+        self._entries_bytes += self._entry_bytes(user.id, profile)
+        while len(self._profiles) > self.max_size:
+            user_id, evicted = self._profiles.popitem(last=False)
+            self._entries_bytes -= self._entry_bytes(user_id, evicted)
+            self.evictions += 1
+
+    def discard(self, user_id):
+        self._remove(user_id)
+
+    def memory_bytes(self):
+        """Приблизительный объём памяти кэша: словарь + записи + строки."""
+        return sys.getsizeof(self._profiles) + self._entries_bytes
+
+    def stats(self):
+        return {
+            'size': len(self._profiles),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'memory_bytes': self.memory_bytes(),
+        }
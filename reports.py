@@ -0,0 +1,22 @@
+# reports.py - CPU-тяжёлая часть отчётов; выполняется в пуле процессов (jobs.JobManager)
+#
+# Здесь только чистые функции уровня модуля без зависимостей от бота и БД:
+# они сериализуются в дочерний процесс и обратно, а каждый воркер импортирует этот модуль,
+# поэтому импорт не должен иметь побочных эффектов.
+import json
+
+USER_EXPORT_FIELDS = ('id', 'username', 'first_name', 'last_name', 'language_code', 'is_bot', 'created_at', 'updated_at')
+
+def serialize_users_page(rows):
+    """
+    Превращает страницу пользователей [(id, username, ..., created_at, updated_at), ...]
+    в фрагмент JSON-массива с отступом 2 - в том же виде, что json.dumps(users, indent=2).
+    """
+    parts = []
+    for row in rows:
+        user = dict(zip(USER_EXPORT_FIELDS, row))
+        for field in ('created_at', 'updated_at'):
+            user[field] = user[field].isoformat() if user[field] else None
+        item = json.dumps(user, ensure_ascii=False, indent=2)
+        parts.append("  " + item.replace("\n", "\n  "))
+    return ",\n".join(parts)
@@ -0,0 +1,75 @@
+# routing.py - Распределение вопросов клиентов между сотрудниками
+import logging
+from datetime import datetime, time as dtime
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+def parse_working_hours(spec):
+    """
+    Разбирает строку вида "111=09:00-18:00,222=18:00-02:00" в {staff_id: (start, end)}.
+    Смена может переходить через полночь.
+    """
+    hours = {}
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            staff_id, period = item.split('=')
+            start, end = period.split('-')
+            hours[int(staff_id)] = (dtime.fromisoformat(start.strip()), dtime.fromisoformat(end.strip()))
+        except ValueError:
+            logger.warning(f"⚠️ Неверный формат рабочих часов: {item}")
+    return hours
+
+class StaffRouter:
+    """
+    Выбирает сотрудника с наименьшим числом открытых диалогов.
+    Нагрузка считается в памяти; при равенстве выбирается тот,
+    кому вопрос назначался давнее всего.
+    """
+
+    def __init__(self, staff_ids, working_hours=None, timezone='Europe/Kyiv'):
+        self.staff_ids = [id for id in dict.fromkeys(staff_ids) if id]
+        self.working_hours = working_hours or {}
+        self.timezone = ZoneInfo(timezone)
+        self._load = {staff_id: 0 for staff_id in self.staff_ids}
+        self._last_assigned = {staff_id: 0 for staff_id in self.staff_ids}
+        self._assignments = 0
+
+    def load(self):
+        return dict(self._load)
+
+    def set_initial_load(self, owners):
+        """Восстанавливает нагрузку по владельцам уже открытых диалогов."""
+        for owner in owners:
+            if owner in self._load:
+                self._load[owner] += 1
+
+    def on_shift(self, staff_id, now=None):
+        hours = self.working_hours.get(staff_id)
+        if not hours:
+            return True
+        current = (now or datetime.now(self.timezone)).time()
+        start, end = hours
+        if start <= end:
+            return start <= current < end
+        return current >= start or current < end
+
+    def pick(self, now=None):
+        """Возвращает ID сотрудника для нового диалога (или None, если персонала нет)."""
+        if not self.staff_ids:
+            return None
+        candidates = [id for id in self.staff_ids if self.on_shift(id, now)] or self.staff_ids
+        return min(candidates, key=lambda id: (self._load[id], self._last_assigned[id]))
+
+    def assign(self, staff_id):
+        if staff_id in self._load:
+            self._assignments += 1
+            self._load[staff_id] += 1
+            self._last_assigned[staff_id] = self._assignments
+
+    def release(self, staff_id):
+        if staff_id in self._load and self._load[staff_id] > 0:
+            self._load[staff_id] -= 1
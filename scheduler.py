@@ -0,0 +1,167 @@
+# scheduler.py - Периодические задачи в event loop бота
+#
+# Каждая задача - отдельный asyncio.Task со своим расписанием: "каждые N секунд" или
+# "ежедневно в ЧЧ:ММ". Задача не запускается повторно, пока не закончился предыдущий запуск:
+# пропущенные из-за долгого выполнения срабатывания не догоняются, а считаются в skipped.
+# Синхронные (блокирующие) функции выполняются в потоке через asyncio.to_thread.
+import time
+import random
+import asyncio
+import inspect
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+class ScheduledJob:
+    __slots__ = (
+        'name', 'func', 'interval', 'at', 'tz', 'jitter', 'first', 'task', 'running',
+        'runs', 'failures', 'skipped', 'last_duration', 'max_duration', 'total_duration',
+        'last_error', 'next_run',
+    )
+
+    def __init__(self, name, func, interval=None, at=None, tz=None, jitter=0.0, first=None):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.at = at
+        self.tz = tz
+        self.jitter = jitter
+        self.first = first
+        self.task = None
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_duration = None
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_error = None
+        self.next_run = None
+
+    def delay_until_next(self, now):
+        """Секунды до следующего срабатывания (без учёта jitter)."""
+        if self.at is None:
+            return self.interval
+        hour, minute = self.at
+        current = datetime.now(self.tz)
+        target = current.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if target <= current:
+            target += timedelta(days=1)
+        return (target - current).total_seconds()
+
+    def stats(self):
+        return {
+            'schedule': f"daily {self.at[0]:02d}:{self.at[1]:02d}" if self.at else f"every {self.interval}s",
+            'running': self.running,
+            'runs': self.runs,
+            'failures': self.failures,
+            'skipped': self.skipped,
+            'last_ms': round(self.last_duration * 1000, 1) if self.last_duration is not None else None,
+            'avg_ms': round(self.total_duration / self.runs * 1000, 1) if self.runs else None,
+            'max_ms': round(self.max_duration * 1000, 1),
+            'next_in': round(self.next_run - time.monotonic(), 1) if self.next_run else None,
+            'last_error': self.last_error,
+        }
+
+class Scheduler:
+    """Расписание задач; запускается в post_init и останавливается в post_shutdown."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._started = False
+
+    def every(self, name, interval, func, jitter=0.0, first=None):
+        """
+        Выполнять func каждые interval секунд (плюс случайно до jitter секунд).
+        first - задержка первого запуска; по умолчанию через interval.
+        """
+        return self._add(ScheduledJob(name, func, interval=interval, jitter=jitter, first=first))
+
+    def daily(self, name, at, func, tz=None, jitter=0.0):
+        """Выполнять func ежедневно в at ('ЧЧ:ММ', время tz или локальное)."""
+        hour, minute = (int(part) for part in at.split(':'))
+        return self._add(ScheduledJob(name, func, at=(hour, minute), tz=tz, jitter=jitter))
+
+    def _add(self, job):
+        if job.name in self._jobs:
+            raise ValueError(f"Задача {job.name} уже запланирована")
+        self._jobs[job.name] = job
+        if self._started:
+            self._spawn(job)
+        return job
+
+    def start(self):
+        """Запускает все запланированные задачи. Вызывается внутри работающего event loop."""
+        self._started = True
+        for job in self._jobs.values():
+            self._spawn(job)
+        logger.info(f"⏰ Планировщик запущен: {', '.join(self._jobs)}")
+
+    def _spawn(self, job):
+        job.task = asyncio.get_running_loop().create_task(self._loop(job), name=f"job:{job.name}")
+
+    async def _loop(self, job):
+        now = time.monotonic()
+        job.next_run = now + (job.first if job.first is not None else job.delay_until_next(now))
+        while True:
+            delay = job.next_run - time.monotonic() + (random.uniform(0, job.jitter) if job.jitter else 0)
+            await asyncio.sleep(max(delay, 0))
+            await self._run(job)
+            now = time.monotonic()
+            if job.at is not None:
+                job.next_run = now + job.delay_until_next(now)
+                continue
+            job.next_run += job.interval
+            if job.next_run < now:
+                # Запуск длился дольше интервала: пропущенные срабатывания не выполняются
+                missed = int((now - job.next_run) // job.interval) + 1
+                job.skipped += missed
+                job.next_run += missed * job.interval
+
+    async def _run(self, job):
+        job.running = True
+        started = time.monotonic()
+        try:
+            if inspect.iscoroutinefunction(job.func):
+                await job.func()
+            else:
+                await asyncio.to_thread(job.func)
+            job.last_error = None
+        except asyncio.CancelledError:
+            # Прерванный остановкой запуск в статистику не попадает
+            job.running = False
+            raise
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)
+            logger.error(f"⏰ Ошибка задачи {job.name}: {e}")
+        duration = time.monotonic() - started
+        job.running = False
+        job.runs += 1
+        job.last_duration = duration
+        job.total_duration += duration
+        job.max_duration = max(job.max_duration, duration)
+
+    async def run_now(self, name):
+        """Выполняет задачу вне расписания; если она уже выполняется - пропускает. Возвращает True при запуске."""
+        job = self._jobs[name]
+        if job.running:
+            job.skipped += 1
+            return False
+        await self._run(job)
+        return True
+
+    async def shutdown(self):
+        """Отменяет все задачи и дожидается их завершения."""
+        tasks = [job.task for job in self._jobs.values() if job.task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for job in self._jobs.values():
+            job.task = None
+        self._started = False
+        logger.info("⏰ Планировщик остановлен")
+
+    def stats(self):
+        return {name: job.stats() for name, job in self._jobs.items()}
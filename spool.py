@@ -0,0 +1,209 @@
+# spool.py - Предохранитель для БД и локальный журнал записей на время её недоступности
+import os
+import json
+import time
+import uuid
+import zlib
+import struct
+import asyncio
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DB_BREAKER_FAILURES = int(os.environ.get('DB_BREAKER_FAILURES', 3))
+DB_BREAKER_RESET = float(os.environ.get('DB_BREAKER_RESET', 15))
+SPOOL_PATH = os.environ.get('SPOOL_PATH', os.path.join('spool', 'writes.log'))
+SPOOL_REPLAY_INTERVAL = 10
+
+# Заголовок записи журнала: длина тела и его CRC32 (big-endian)
+RECORD_HEADER = struct.Struct('>II')
+
+class CircuitBreaker:
+    """
+    После failure_threshold подряд неудачных подключений считает БД недоступной и
+    reset_timeout секунд отказывает сразу, не дожидаясь таймаута подключения.
+    Затем пропускает одну пробную попытку: успех закрывает предохранитель, неудача - снова открывает.
+    """
+
+    def __init__(self, failure_threshold=DB_BREAKER_FAILURES, reset_timeout=DB_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self.rejected = 0
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return 'open'
+        return 'half_open'
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("✅ База данных снова доступна, предохранитель закрыт")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._opened_at is not None:
+                # Пробная попытка не удалась - ждём следующий интервал
+                self._opened_at = time.monotonic()
+                self._probing = False
+            elif self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                logger.error(f"🔌 База данных недоступна ({self._failures} ошибок подряд), предохранитель открыт")
+
+    def stats(self):
+        return {'state': self.state, 'failures': self._failures, 'rejected': self.rejected}
+
+class WriteSpool:
+    """
+    Журнал записей, не попавших в БД: записи дописываются в конец файла
+    ([длина][crc32][JSON]) с fsync, поэтому переживают перезапуск процесса.
+    Каждая запись несёт уникальный key - повторное воспроизведение её не дублирует.
+    """
+
+    def __init__(self, path=SPOOL_PATH):
+        self.path = path
+        self.replay_path = path + '.replay'
+        # Записи, которые БД отвергает (ошибка не из-за недоступности): разбираются вручную
+        self.dead_letter_path = path + '.dead'
+        self._lock = threading.Lock()
+        self.appended = 0
+        self.replayed = 0
+        self.dead_lettered = 0
+
+    def append(self, kind, data):
+        record = {
+            'key': uuid.uuid4().hex,
+            'kind': kind,
+            'created_at': datetime.now().isoformat(),
+            'data': data,
+        }
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'ab') as f:
+                f.write(self._encode(record))
+                f.flush()
+                os.fsync(f.fileno())
+            self.appended += 1
+        logger.warning(f"💾 Запись '{kind}' сохранена в локальный журнал до восстановления БД")
+        return record['key']
+
+    def has_pending(self):
+        return os.path.exists(self.replay_path) or os.path.exists(self.path)
+
+    @staticmethod
+    def read_records(path):
+        """Читает записи по порядку; недописанный или повреждённый хвост пропускается."""
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if not header:
+                    return
+                if len(header) < RECORD_HEADER.size:
+                    logger.warning(f"💾 Недописанный заголовок в конце {path}, хвост пропущен")
+                    return
+                length, checksum = RECORD_HEADER.unpack(header)
+                body = f.read(length)
+                if len(body) < length or zlib.crc32(body) != checksum:
+                    logger.warning(f"💾 Повреждённая запись в {path}, хвост пропущен")
+                    return
+                yield json.loads(body)
+
+    def replay(self, apply, transient):
+        """
+        Воспроизводит журнал через apply(record). Новые записи во время воспроизведения
+        пишутся в свежий файл. Ошибка из transient (БД недоступна) останавливает воспроизведение:
+        в файле остаются только невоспроизведённые записи, продолжение - в следующий раз.
+        Любая другая ошибка постоянна: запись уходит в dead_letter_path, остальные воспроизводятся.
+        Возвращает число воспроизведённых записей.
+        """
+        if not os.path.exists(self.replay_path):
+            with self._lock:
+                if not os.path.exists(self.path):
+                    return 0
+                os.replace(self.path, self.replay_path)
+        count = 0
+        records = self.read_records(self.replay_path)
+        for record in records:
+            try:
+                apply(record)
+            except transient:
+                # Уже применённые записи убираются из файла: повтор начнётся с этой
+                remaining = [record, *records]
+                records.close()
+                self._rewrite(self.replay_path, remaining)
+                self.replayed += count
+                raise
+            except Exception as e:
+                self._dead_letter(record, e)
+                continue
+            count += 1
+        os.remove(self.replay_path)
+        self.replayed += count
+        logger.info(f"💾 Локальный журнал воспроизведён: {count} записей")
+        return count
+
+    @staticmethod
+    def _encode(record):
+        body = json.dumps(record, ensure_ascii=False, default=str).encode('utf-8')
+        return RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body
+
+    def _rewrite(self, path, records):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for record in records:
+                f.write(self._encode(record))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _dead_letter(self, record, error):
+        record = dict(record, error=f"{type(error).__name__}: {error}")
+        with open(self.dead_letter_path, 'ab') as f:
+            f.write(self._encode(record))
+            f.flush()
+            os.fsync(f.fileno())
+        self.dead_lettered += 1
+        logger.error(
+            f"💾 Запись журнала '{record.get('kind')}' ({record.get('key')}) не применяется: {error}. "
+            f"Перенесена в {self.dead_letter_path}"
+        )
+
+    def stats(self):
+        return {
+            'pending': self.has_pending(),
+            'appended': self.appended,
+            'replayed': self.replayed,
+            'dead_lettered': self.dead_lettered,
+        }
+
+    async def replay_pending(self, apply, breaker, transient):
+        """Задача планировщика (раз в SPOOL_REPLAY_INTERVAL): воспроизводит журнал, если предохранитель БД не открыт."""
+        if not self.has_pending() or breaker.state == 'open':
+            return
+        try:
+            await asyncio.to_thread(self.replay, apply, transient)
+        except Exception as e:
+            logger.warning(f"💾 Воспроизведение журнала отложено: {e}")
@@ -0,0 +1,348 @@
+# sqlite_store.py - Встроенное хранилище SQLite для установок на одном сервере
+#
+# Включается через DATABASE_URL=sqlite:///путь/к/bot.db (см. storage.py).
+# Файл работает в режиме WAL: читатели не ждут писателя. Все записи выполняет один
+# поток-писатель: записи, накопившиеся в очереди, пока шёл предыдущий коммит,
+# фиксируются одной транзакцией (group commit). Чтение - по соединению на поток.
+import os
+import queue
+import sqlite3
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Сколько записей из очереди максимум фиксируется одним коммитом
+SQLITE_BATCH_SIZE = int(os.environ.get('SQLITE_BATCH_SIZE', 64))
+SQLITE_BUSY_TIMEOUT = 5
+# synchronous=NORMAL в WAL не теряет целостность при сбое процесса;
+# при отключении питания могут пропасть последние коммиты
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        language_code TEXT,
+        is_bot INTEGER,
+        blocked_at TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS bot_stats (
+        id INTEGER PRIMARY KEY,
+        total_orders INTEGER DEFAULT 0,
+        total_questions INTEGER DEFAULT 0,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS active_questions (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id),
+        message TEXT,
+        status TEXT DEFAULT 'open',
+        assigned_to INTEGER,
+        closed_at TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_active_questions_open
+    ON active_questions (created_at DESC, id DESC)
+    WHERE status = 'open'
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id),
+        order_id TEXT,
+        items TEXT,
+        total_uah INTEGER,
+        status TEXT DEFAULT 'created',
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        payment_id TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_orders_order_id ON orders (order_id, created_at DESC)",
+    """
+    CREATE TABLE IF NOT EXISTS order_items (
+        id INTEGER PRIMARY KEY,
+        order_ref INTEGER NOT NULL REFERENCES orders(id),
+        position INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 1,
+        price_uah INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_ref)",
+)
+
+USER_UPSERT = """
+    INSERT INTO users (id, username, first_name, last_name, language_code, is_bot, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+    ON CONFLICT (id) DO UPDATE SET
+        username = excluded.username,
+        first_name = excluded.first_name,
+        last_name = excluded.last_name,
+        language_code = excluded.language_code,
+        blocked_at = NULL,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+# Признак остановки потока-писателя
+_STOP = object()
+
+# Колонки, добавленные после первой версии схемы (таблица, колонка, тип), и индексы по ним
+MIGRATIONS = (
+    ('orders', 'payment_id', 'TEXT'),
+)
+MIGRATION_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_orders_payment ON orders (payment_id, created_at DESC) WHERE payment_id IS NOT NULL",
+)
+
+def _init_schema(conn):
+    for statement in SCHEMA:
+        conn.execute(statement)
+    for table, column, column_type in MIGRATIONS:
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+    for statement in MIGRATION_INDEXES:
+        conn.execute(statement)
+    if conn.execute("SELECT COUNT(*) FROM bot_stats").fetchone()[0] == 0:
+        conn.execute("INSERT INTO bot_stats (total_orders, total_questions) VALUES (0, 0)")
+
+def _upsert_user(conn, user):
+    conn.execute(USER_UPSERT, (user.id, user.username, user.first_name, user.last_name, user.language_code, user.is_bot))
+
+def _insert_question(conn, user_id, message, assigned_to):
+    conn.execute(
+        "INSERT INTO active_questions (user_id, message, assigned_to) VALUES (?, ?, ?)",
+        (user_id, message, assigned_to),
+    )
+
+def _increment_questions(conn):
+    conn.execute("UPDATE bot_stats SET total_questions = total_questions + 1, updated_at = CURRENT_TIMESTAMP")
+
+def _insert_order(conn, user, order_id, items_text, total_uah, line_items):
+    _upsert_user(conn, user)
+    order_ref = conn.execute(
+        "INSERT INTO orders (user_id, order_id, items, total_uah) VALUES (?, ?, ?, ?)",
+        (user.id, order_id, items_text, total_uah),
+    ).lastrowid
+    conn.executemany(
+        "INSERT INTO order_items (order_ref, position, name, quantity, price_uah) VALUES (?, ?, ?, ?, ?)",
+        [(order_ref, position, name, quantity, price)
+         for position, (name, quantity, price) in enumerate(line_items, 1)],
+    )
+    conn.execute("UPDATE bot_stats SET total_orders = total_orders + 1, updated_at = CURRENT_TIMESTAMP")
+    return order_ref
+
+def _update_order_status(conn, payment_id, order_id, total_uah, status, allowed_from, max_age_days):
+    # Писатель один, поэтому выборка и обновление не разделяются другими записями (см. db.update_order_status)
+    since = f'-{int(max_age_days)} days'
+    rows = conn.execute("""
+        SELECT id, status FROM orders
+        WHERE payment_id = ? AND created_at > datetime('now', ?)
+    """, (payment_id, since)).fetchall()
+    if not rows:
+        rows = conn.execute("""
+            SELECT id, status FROM orders
+            WHERE order_id = ? AND total_uah = ? AND payment_id IS NULL AND created_at > datetime('now', ?)
+            LIMIT 2
+        """, (order_id, total_uah, since)).fetchall()
+    if len(rows) != 1:
+        return ('not_found' if not rows else 'ambiguous'), None
+    order_ref, current = rows[0]
+    changed = current in allowed_from
+    row = conn.execute("""
+        UPDATE orders SET payment_id = ?, status = CASE WHEN ? THEN ? ELSE status END
+        WHERE id = ?
+        RETURNING id, user_id, order_id, total_uah, status
+    """, (payment_id, changed, status, order_ref)).fetchone()
+    return 'matched', (dict(zip(('id', 'user_id', 'order_id', 'total_uah', 'status'), row)) if changed else None)
+
+class SQLiteStore:
+    """
+    То же, что storage.PostgresStore, поверх локального файла SQLite.
+    Методы записи блокируют вызывающий поток до коммита своей пачки,
+    поэтому вызываются из asyncio.to_thread, как и для Postgres.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path, batch_size=SQLITE_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self._writes = queue.SimpleQueue()
+        self._local = threading.local()
+        self.commits = 0
+        self.writes = 0
+        self.failed = 0
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def _run_writer(self):
+        conn = self._connect()
+        # Режим WAL хранится в самом файле БД - достаточно включить один раз
+        conn.execute("PRAGMA journal_mode=WAL")
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(item is _STOP for item in batch)
+            batch = [item for item in batch if item is not _STOP]
+            if batch:
+                self._commit_batch(conn, batch)
+            if stop:
+                conn.close()
+                return
+
+    def _commit_batch(self, conn, batch):
+        # Каждая запись - в своей точке сохранения: ошибка одной не откатывает остальные
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for func, args, future in batch:
+                conn.execute("SAVEPOINT write")
+                try:
+                    results.append((future, func(conn, *args), None))
+                    conn.execute("RELEASE write")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write")
+                    conn.execute("RELEASE write")
+                    results.append((future, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"Ошибка фиксации пачки записей SQLite ({len(batch)}): {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            results = [(future, None, e) for _, _, future in batch]
+        self.commits += 1
+        for future, result, error in results:
+            self.writes += 1
+            if error is None:
+                future.set_result(result)
+            else:
+                self.failed += 1
+                future.set_exception(error)
+
+    def _write(self, func, *args):
+        # Поток-писатель запускается при первой записи, а не при импорте модуля
+        if self._writer is None:
+            with self._writer_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._run_writer, name='sqlite-writer', daemon=True)
+                    self._writer.start()
+        future = Future()
+        self._writes.put((func, args, future))
+        return future.result()
+
+    def close(self):
+        if self._writer is not None:
+            self._writes.put(_STOP)
+            self._writer.join()
+            self._writer = None
+
+    def init_schema(self):
+        try:
+            self._write(_init_schema)
+        except Exception as e:
+            logger.error(f"Ошибка инициализации базы данных SQLite: {e}")
+
+    def save_user(self, user):
+        try:
+            self._write(_upsert_user, user)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения пользователя {user.id}: {e}")
+            return False
+
+    def save_question(self, user_id, message, assigned_to=None):
+        try:
+            self._write(_insert_question, user_id, message, assigned_to)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения вопроса от {user_id}: {e}")
+
+    def increment_questions(self):
+        try:
+            self._write(_increment_questions)
+        except Exception as e:
+            logger.error(f"Ошибка увеличения счетчика вопросов: {e}")
+
+    def place_order(self, user, order_id, items_text, total_uah, line_items):
+        """Upsert пользователя, заказ, позиции и счётчик - одной записью в пачке. Возвращает orders.id."""
+        try:
+            return self._write(_insert_order, user, order_id, items_text, total_uah, line_items)
+        except Exception as e:
+            logger.error(f"Ошибка оформления заказа {order_id}: {e}")
+            raise
+
+    def update_order_status(self, payment_id, order_id, total_uah, status, allowed_from, max_age_days):
+        """Привязывает платёж к заказу и меняет его статус (см. db.update_order_status)."""
+        try:
+            return self._write(_update_order_status, payment_id, order_id, total_uah, status,
+                               list(allowed_from), max_age_days)
+        except Exception as e:
+            logger.error(f"Ошибка обновления статуса заказа {order_id}: {e}")
+            raise
+
+    def get_stats(self):
+        try:
+            row = self._reader().execute(
+                "SELECT total_orders, total_questions FROM bot_stats ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+            return {'total_orders': row[0], 'total_questions': row[1]}
+        except Exception as e:
+            logger.error(f"Ошибка получения статистики: {e}")
+            return {'total_orders': 0, 'total_questions': 0}
+
+    def _count(self, query, what):
+        try:
+            return self._reader().execute(query).fetchone()[0]
+        except Exception as e:
+            logger.error(f"Ошибка получения количества {what}: {e}")
+            return 0
+
+    def count_users(self):
+        return self._count("SELECT COUNT(*) FROM users", "пользователей")
+
+    def count_open_questions(self):
+        return self._count("SELECT COUNT(*) FROM active_questions WHERE status = 'open'", "активных вопросов")
+
+    def count_orders(self):
+        return self._count("SELECT COUNT(*) FROM orders", "заказов")
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'queued': self._writes.qsize(),
+            'commits': self.commits,
+            'writes': self.writes,
+            'failed': self.failed,
+            'avg_batch': round(self.writes / self.commits, 2) if self.commits else 0,
+        }
@@ -0,0 +1,114 @@
+# state_sweeper.py - Истечение незавершённых диалогов и учёт памяти user_data/chat_data
+import os
+import time
+import logging
+from collections import Counter
+from telegram import Update
+from telegram.ext import ContextTypes
+from persistence import serialize_state
+
+logger = logging.getLogger(__name__)
+
+# Ключи user_data, описывающие незавершённый диалог. Если клиент ушёл,
+# не закончив его, следующее сообщение не должно трактоваться как ответ.
+CONVERSATION_KEYS = (
+    'awaiting_subscription_data',
+    'subscription_order_details',
+    'conversation_type',
+    'pending_order',
+    'pending_order_from_command',
+)
+STATE_IDLE_TTL = int(os.environ.get('STATE_IDLE_TTL', 1800))
+STATE_SWEEP_INTERVAL = int(os.environ.get('STATE_SWEEP_INTERVAL', 60))
+
+class StateSweeper:
+    """
+    Запоминает время последнего апдейта пользователя/чата и периодически:
+    - удаляет ключи диалога у пользователей, молчащих дольше idle_ttl;
+    - освобождает опустевшие записи user_data и chat_data.
+    """
+
+    def __init__(self, persistence, idle_ttl=STATE_IDLE_TTL, interval=STATE_SWEEP_INTERVAL):
+        self.persistence = persistence
+        self.idle_ttl = idle_ttl
+        self.interval = interval
+        self._last_seen = {}
+        self._application = None
+        self.expired = Counter()
+        self.reclaimed_users = 0
+        self.reclaimed_chats = 0
+
+    async def touch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        now = time.monotonic()
+        if update.effective_user:
+            self._last_seen[update.effective_user.id] = now
+        if update.effective_chat:
+            self._last_seen[update.effective_chat.id] = now
+
+    def bind(self, application):
+        """Привязывает к приложению; sweep затем запускается планировщиком раз в interval."""
+        self._application = application
+
+    def _idle(self, key, now):
+        last = self._last_seen.get(key)
+        return last is None or now - last > self.idle_ttl
+
+    async def sweep(self, now=None):
+        now = now if now is not None else time.monotonic()
+        application = self._application
+        expired = reclaimed_users = reclaimed_chats = 0
+        for user_id, data in list(application.user_data.items()):
+            if not self._idle(user_id, now):
+                continue
+            stale = [key for key in CONVERSATION_KEYS if key in data]
+            for key in stale:
+                del data[key]
+                self.expired[key] += 1
+            expired += len(stale)
+            if not data:
+                application.drop_user_data(user_id)
+                reclaimed_users += 1
+            elif stale and self.persistence is not None:
+                await self.persistence.update_user_data(user_id, data)
+        for chat_id, data in list(application.chat_data.items()):
+            if not data and self._idle(chat_id, now):
+                application.drop_chat_data(chat_id)
+                reclaimed_chats += 1
+        for key in [key for key, last in self._last_seen.items() if now - last > self.idle_ttl]:
+            del self._last_seen[key]
+        self.reclaimed_users += reclaimed_users
+        self.reclaimed_chats += reclaimed_chats
+        if expired or reclaimed_users or reclaimed_chats:
+            logger.info(
+                f"🧹 Очистка состояний: истекло ключей {expired}, "
+                f"освобождено user_data {reclaimed_users}, chat_data {reclaimed_chats}"
+            )
+
+    def usage(self):
+        """Возвращает {ключ: (число пользователей, приблизительный объём в байтах)} по user_data."""
+        usage = {}
+        for data in self._application.user_data.values():
+            for key, value in data.items():
+                count, size = usage.get(key, (0, 0))
+                usage[key] = (count + 1, size + len(serialize_state(value).encode('utf-8')))
+        return usage
+
+    def report(self):
+        application = self._application
+        lines = [
+            "🧠 Стан діалогів у пам'яті:",
+            f"👤 user_data: {len(application.user_data)}",
+            f"💬 chat_data: {len(application.chat_data)}",
+            f"⏱️ Активних за {self.idle_ttl // 60} хв: {len(self._last_seen)}",
+        ]
+        usage = self.usage()
+        if usage:
+            lines.append("")
+            for key, (count, size) in sorted(usage.items(), key=lambda item: -item[1][1]):
+                lines.append(f"▫️ {key}: {count} шт., ~{size} байт")
+        lines += [
+            "",
+            f"🧹 Прострочено ключів: {sum(self.expired.values())}",
+            f"♻️ Звільнено user_data: {self.reclaimed_users}, chat_data: {self.reclaimed_chats}",
+        ]
+        return "\n".join(lines)
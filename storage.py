@@ -0,0 +1,218 @@
+# storage.py - Хранилище пользователей, заказов, вопросов, счётчиков и статистики
+#
+# Реализация выбирается по DATABASE_URL:
+#   postgresql://...      - PostgresStore (db.py, предохранитель и локальный журнал записей)
+#   sqlite:///data/bot.db - SQLiteStore (sqlite_store.py) для однонодовых установок
+import logging
+import psycopg
+from psycopg.rows import dict_row
+import db
+
+logger = logging.getLogger(__name__)
+
+SQLITE_URL_PREFIX = 'sqlite:///'
+
+def is_sqlite_url(url):
+    return bool(url) and url.startswith(SQLITE_URL_PREFIX)
+
+def user_record(user):
+    return {
+        'id': user.id,
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'language_code': user.language_code,
+        'is_bot': user.is_bot,
+    }
+
+class PostgresStore:
+    """
+    Запись и чтение через основную БД (чтение статистики - через реплику, если настроена).
+    Пока БД недоступна, записи уходят в локальный журнал spool и воспроизводятся позже - только
+    если запрос заведомо не дошёл до БД (db.DatabaseUnavailable), заказ заведомо не записан
+    (БД отвергла транзакцию) или запись идемпотентна.
+    """
+
+    name = 'postgres'
+
+    def __init__(self, spool):
+        self.spool = spool
+
+    def init_schema(self):
+        try:
+            with db.connect() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS users (
+                            id BIGINT PRIMARY KEY,
+                            username VARCHAR(255),
+                            first_name VARCHAR(255),
+                            last_name VARCHAR(255),
+                            language_code VARCHAR(10),
+                            is_bot BOOLEAN,
+                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        );
+                    """)
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS bot_stats (
+                            id SERIAL PRIMARY KEY,
+                            total_orders INTEGER DEFAULT 0,
+                            total_questions INTEGER DEFAULT 0,
+                            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        );
+                    """)
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS active_questions (
+                            id SERIAL PRIMARY KEY,
+                            user_id BIGINT REFERENCES users(id),
+                            message TEXT,
+                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        );
+                    """)
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS orders (
+                            id SERIAL PRIMARY KEY,
+                            user_id BIGINT REFERENCES users(id),
+                            order_id VARCHAR(255),
+                            items TEXT,
+                            total_uah INTEGER,
+                            status VARCHAR(50) DEFAULT 'created',
+                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        );
+                    """)
+                    cur.execute("SELECT COUNT(*) FROM bot_stats")
+                    if cur.fetchone()[0] == 0:
+                        cur.execute("INSERT INTO bot_stats (total_orders, total_questions) VALUES (0, 0)")
+                    conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка инициализации базы данных: {e}")
+        # Остальные таблицы (диалоги, рассылки, позиции заказов, состояние) и их миграции
+        db.init_db()
+
+    def save_user(self, user):
+        try:
+            with db.connect() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO users (id, username, first_name, last_name, language_code, is_bot, created_at, updated_at)
+                        VALUES (%s, %s, %s, %s, %s, %s, NOW(), NOW())
+                        ON CONFLICT (id) DO UPDATE SET
+                            username = EXCLUDED.username,
+                            first_name = EXCLUDED.first_name,
+                            last_name = EXCLUDED.last_name,
+                            language_code = EXCLUDED.language_code,
+                            blocked_at = NULL,
+                            updated_at = NOW()
+                    """, (user.id, user.username, user.first_name, user.last_name, user.language_code, user.is_bot))
+                    conn.commit()
+            return True
+        except psycopg.OperationalError:
+            # Upsert идемпотентен, поэтому в журнал - при любой ошибке соединения,
+            # даже если запись могла успеть примениться
+            self.spool.append('user', {'user': user_record(user)})
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения пользователя {user.id}: {e}")
+            return False
+
+    def save_question(self, user_id, message, assigned_to=None):
+        try:
+            with db.connect() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO active_questions (user_id, message, assigned_to, created_at)
+                        VALUES (%s, %s, %s, NOW())
+                    """, (user_id, message, assigned_to))
+                    conn.commit()
+        except db.DatabaseUnavailable:
+            self.spool.append('question', {'user_id': user_id, 'message': message, 'assigned_to': assigned_to})
+        except Exception as e:
+            logger.error(f"Ошибка сохранения вопроса от {user_id}: {e}")
+
+    def increment_questions(self):
+        try:
+            with db.connect() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("UPDATE bot_stats SET total_questions = total_questions + 1, updated_at = NOW()")
+                    conn.commit()
+        except db.DatabaseUnavailable:
+            self.spool.append('counter', {'column': 'total_questions'})
+        except Exception as e:
+            logger.error(f"Ошибка увеличения счетчика вопросов: {e}")
+
+    def place_order(self, user, order_id, items_text, total_uah, line_items):
+        """
+        Возвращает orders.id или None, если заказ отложен в журнал. Исключение - только когда
+        исход неизвестен (обрыв соединения во время транзакции): вызывающий сообщает об ошибке.
+        """
+        try:
+            return db.place_order(user, order_id, items_text, total_uah, line_items)
+        except db.DatabaseUnavailable:
+            # Запрос заведомо не отправлялся - заказ попадёт в БД при воспроизведении журнала
+            pass
+        except psycopg.OperationalError:
+            # Обрыв во время транзакции (в том числе на commit) мог оставить заказ записанным,
+            # и повтор из журнала продублировал бы его
+            raise
+        except Exception:
+            # БД отвергла транзакцию (или ошибка до отправки) - она откатана целиком, заказ не записан.
+            # В журнале он не потеряется: повторится или, если ошибка постоянна, уйдёт в dead-letter
+            pass
+        self.spool.append('order', {
+            'user': user_record(user),
+            'order_id': order_id,
+            'items_text': items_text,
+            'total_uah': total_uah,
+            'line_items': line_items,
+        })
+        return None
+
+    def update_order_status(self, payment_id, order_id, total_uah, status, allowed_from, max_age_days):
+        return db.update_order_status(payment_id, order_id, total_uah, status, allowed_from, max_age_days)
+
+    def get_stats(self):
+        try:
+            with db.connect_read() as conn:
+                with conn.cursor(row_factory=dict_row) as cur:
+                    cur.execute("SELECT total_orders, total_questions FROM bot_stats ORDER BY id DESC LIMIT 1")
+                    return cur.fetchone()
+        except Exception as e:
+            logger.error(f"Ошибка получения статистики: {e}")
+            return {'total_orders': 0, 'total_questions': 0}
+
+    def _count(self, query, what):
+        try:
+            with db.connect_read() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(query)
+                    return cur.fetchone()[0]
+        except Exception as e:
+            logger.error(f"Ошибка получения количества {what}: {e}")
+            return 0
+
+    def count_users(self):
+        return self._count("SELECT COUNT(*) FROM users", "пользователей")
+
+    def count_open_questions(self):
+        return self._count("SELECT COUNT(*) FROM active_questions WHERE status = 'open'", "активных вопросов")
+
+    def count_orders(self):
+        return self._count("SELECT COUNT(*) FROM orders", "заказов")
+
+    def close(self):
+        db.close_connections()
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'breaker': db.breaker.stats(),
+            'pool': db.primary_pool.stats(),
+            'spool': self.spool.stats(),
+        }
+
+def create_store(url, spool):
+    if is_sqlite_url(url):
+        from sqlite_store import SQLiteStore
+        return SQLiteStore(url[len(SQLITE_URL_PREFIX):])
+    return PostgresStore(spool)
@@ -0,0 +1,179 @@
+# support.py - Двусторонняя переписка клиентов с персоналом через бота
+import re
+import asyncio
+import logging
+import itertools
+from string import Formatter
+from collections import OrderedDict
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+import db
+
+logger = logging.getLogger(__name__)
+
+HISTORY_PAGE_SIZE = 10
+HISTORY_PREVIEW_LENGTH = 200
+MESSAGE_MAP_SIZE = 5000
+# Шаблоны пересылки клиентских сообщений персоналу: по ним клиент определяется, если сообщение
+# уже вытеснено из кэша или бот перезапущен. Другие сообщения бота (заказы, оплаты) с "ID:" не подходят.
+RELAY_TEMPLATES = ('staff.question', 'staff.customer_message')
+
+def relay_pattern(template):
+    """Регулярное выражение для текста по шаблону; поле {user_id} - группа с ID клиента."""
+    parts = []
+    for literal, field, _, _ in Formatter().parse(template):
+        parts.append(re.escape(literal))
+        if field == 'user_id':
+            parts.append(r'(?P<user_id>\d+)')
+        elif field is not None:
+            parts.append('.*?')
+    return re.compile(''.join(parts), re.S)
+
+class SupportRelay:
+    """
+    Пересылает вопросы клиентов персоналу и ответы персонала клиентам.
+    Открытые диалоги (user_id -> диалог) и соответствие пересланных
+    сообщений клиентам держатся в памяти, чтобы ответ не ждал запросов к БД.
+    customer_texts(user_id) - тексты на языке клиента для ответов персонала.
+    persistent=False (хранилище SQLite, где нет таблиц переписки) - диалоги живут
+    только в памяти процесса, а сообщения не сохраняются.
+    """
+
+    def __init__(self, router, staff_texts, customer_texts, persistent=True):
+        self.router = router
+        self.customer_texts = customer_texts
+        self.persistent = persistent
+        self._local_ids = itertools.count(1)
+        self.staff_texts = staff_texts
+        self._relay_patterns = [relay_pattern(staff_texts.source(key)) for key in RELAY_TEMPLATES]
+        self._conversations = {}
+        self._message_map = OrderedDict()
+
+    async def load(self):
+        """Загружает открытые диалоги из БД при старте."""
+        for row in await asyncio.to_thread(db.get_open_conversations):
+            self._conversations[row['user_id']] = {'id': row['id'], 'owner': row['assigned_owner']}
+        self.router.set_initial_load(c['owner'] for c in self._conversations.values())
+        logger.info(f"💬 Загружено открытых диалогов: {len(self._conversations)}")
+
+    def has_open(self, user_id):
+        return user_id in self._conversations
+
+    def get_owner(self, user_id):
+        conversation = self._conversations.get(user_id)
+        if conversation and conversation['owner']:
+            return conversation['owner']
+        return self.router.pick()
+
+    def remember(self, message, user_id):
+        """Запоминает, какому клиенту соответствует сообщение в чате персонала."""
+        key = (message.chat_id, message.message_id)
+        self._message_map[key] = user_id
+        self._message_map.move_to_end(key)
+        if len(self._message_map) > MESSAGE_MAP_SIZE:
+            self._message_map.popitem(last=False)
+
+    def resolve_customer(self, message):
+        """Определяет клиента по сообщению, на которое ответил сотрудник."""
+        user_id = self._message_map.get((message.chat_id, message.message_id))
+        if user_id:
+            return user_id
+        if not (message.from_user and message.from_user.is_bot and message.text):
+            return None
+        for pattern in self._relay_patterns:
+            match = pattern.fullmatch(message.text)
+            if match:
+                return int(match.group('user_id'))
+        return None
+
+    async def open(self, user_id, conversation_type, message_text):
+        """
+        Открывает диалог (или продолжает уже открытый) и сохраняет сообщение клиента.
+        Новый диалог назначается наименее загруженному сотруднику.
+        """
+        conversation = self._conversations.get(user_id)
+        if conversation:
+            await self._save_message(user_id, message_text, True)
+            return conversation
+        owner = self.router.pick()
+        # Нагрузка учитывается до записи в БД, иначе параллельные вопросы увидят её
+        # одинаковой и все уйдут одному сотруднику
+        self.router.assign(owner)
+        try:
+            if self.persistent:
+                conversation_id = await asyncio.to_thread(
+                    db.open_conversation, user_id, conversation_type, owner, message_text
+                )
+            else:
+                conversation_id = next(self._local_ids)
+        except BaseException:
+            self.router.release(owner)
+            raise
+        conversation = {'id': conversation_id, 'owner': owner}
+        if conversation_id is None:
+            self.router.release(owner)
+        else:
+            self._conversations[user_id] = conversation
+        return conversation
+
+    def assign(self, user_id, staff_id):
+        """Меняет ответственного за открытый диалог (БД обновляется вызывающим)."""
+        conversation = self._conversations.get(user_id)
+        if conversation and conversation['owner'] != staff_id:
+            self.router.release(conversation['owner'])
+            self.router.assign(staff_id)
+            conversation['owner'] = staff_id
+
+    async def close(self, user_id):
+        conversation = self._conversations.pop(user_id, None)
+        if conversation:
+            self.router.release(conversation['owner'])
+        if not self.persistent:
+            return int(conversation is not None)
+        return await asyncio.to_thread(db.close_conversation, user_id)
+
+    async def _save_message(self, user_id, message_text, is_from_user):
+        if self.persistent:
+            await asyncio.to_thread(db.save_message, user_id, message_text, is_from_user)
+
+    async def forward_from_customer(self, bot, user, message_text):
+        """Пересылает сообщение клиента из открытого диалога ответственному сотруднику."""
+        staff_id = self.get_owner(user.id)
+        sent = await bot.send_message(
+            chat_id=staff_id,
+            text=self.staff_texts.text(
+                'staff.customer_message', first_name=user.first_name,
+                username=user.username or self.staff_texts.text('staff.username_missing'),
+                user_id=user.id, text=message_text
+            )
+        )
+        self.remember(sent, user.id)
+        await self._save_message(user.id, message_text, True)
+
+    async def reply_to_customer(self, bot, user_id, message_text):
+        """Доставляет ответ сотрудника клиенту; запись в БД - уже после отправки."""
+        text = self.customer_texts(user_id).text('support.reply', text=message_text)
+        await bot.send_message(chat_id=user_id, text=text)
+        await self._save_message(user_id, message_text, False)
+
+    async def history_page(self, user_id, before=None):
+        """Возвращает текст и клавиатуру страницы истории переписки."""
+        rows = await asyncio.to_thread(
+            db.get_conversation_history, user_id, HISTORY_PAGE_SIZE + 1, before
+        )
+        has_more = len(rows) > HISTORY_PAGE_SIZE
+        rows = rows[:HISTORY_PAGE_SIZE]
+        if not rows:
+            return f"ℹ️ Історія переписки з {user_id} порожня.", None
+        lines = [f"📜 Історія переписки з {user_id}:"]
+        for row in reversed(rows):
+            author = "👤" if row['is_from_user'] else "🛡️"
+            text = row['message'] or ''
+            if len(text) > HISTORY_PREVIEW_LENGTH:
+                text = text[:HISTORY_PREVIEW_LENGTH] + "…"
+            lines.append(f"{author} {row['created_at']:%d.%m %H:%M}: {text}")
+        reply_markup = None
+        if has_more:
+            reply_markup = InlineKeyboardMarkup([[
+                InlineKeyboardButton("⬅️ Старіші", callback_data=f"hist_{user_id}_{db.row_cursor(rows[-1])}")
+            ]])
+        return "\n".join(lines), reply_markup
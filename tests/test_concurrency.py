@@ -0,0 +1,76 @@
+# tests/test_concurrency.py - Очередь апдейтов пользователя и слоты семафора (concurrency.py)
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import concurrency
+from admission import AdmissionController
+from concurrency import PerUserUpdateProcessor
+
+def make_update(user_id):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+
+async def handler(log, name, release=None):
+    if release is not None:
+        await release.wait()
+    log.append(name)
+
+def test_busy_user_does_not_block_others():
+    async def scenario():
+        processor = PerUserUpdateProcessor(AdmissionController(), max_concurrent_updates=2)
+        release = asyncio.Event()
+        log = []
+        busy = [
+            asyncio.create_task(processor.process_update(make_update(1), handler(log, f"1-{i}", release)))
+            for i in range(5)
+        ]
+        await asyncio.sleep(0)
+        # Пять апдейтов пользователя 1 ждут, но держат один слот из двух
+        await asyncio.wait_for(processor.process_update(make_update(2), handler(log, "2-0")), timeout=1)
+        assert log == ["2-0"]
+        release.set()
+        await asyncio.gather(*busy)
+        return log
+    log = asyncio.run(scenario())
+    assert log == ["2-0", "1-0", "1-1", "1-2", "1-3", "1-4"]
+
+def test_user_updates_run_in_order_one_at_a_time():
+    async def scenario():
+        processor = PerUserUpdateProcessor(AdmissionController(), max_concurrent_updates=8)
+        running = []
+        log = []
+
+        async def step(i):
+            running.append(i)
+            assert len(running) == 1
+            await asyncio.sleep(0.001)
+            running.remove(i)
+            log.append(i)
+
+        await asyncio.gather(*(processor.process_update(make_update(1), step(i)) for i in range(6)))
+        assert processor.active_keys() == 0
+        return log
+    assert asyncio.run(scenario()) == list(range(6))
+
+def test_excess_updates_of_one_user_are_dropped(monkeypatch):
+    monkeypatch.setattr(concurrency, 'MAX_PENDING_PER_USER', 3)
+
+    async def scenario():
+        controller = AdmissionController()
+        processor = PerUserUpdateProcessor(controller, max_concurrent_updates=4)
+        release = asyncio.Event()
+        log = []
+        tasks = [
+            asyncio.create_task(processor.process_update(make_update(1), handler(log, i, release)))
+            for i in range(5)
+        ]
+        await asyncio.sleep(0)
+        assert processor.dropped == 2
+        assert controller.pending == 3
+        release.set()
+        await asyncio.gather(*tasks)
+        assert controller.pending == 0
+        return log
+    assert asyncio.run(scenario()) == [0, 1, 2]
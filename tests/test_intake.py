@@ -0,0 +1,71 @@
+# tests/test_intake.py - Проверка заказов с сайта (intake.OrderIntake) без HTTP и без БД
+#
+#   python -m pytest -q tests
+import os
+import sys
+import json
+import time
+from concurrent.futures import Future
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import db
+import intake
+from catalog_search import CatalogEntry
+from intake import IntakeError, OrderIntake
+
+SECRET = 'test-secret'
+
+def make_intake():
+    entry = CatalogEntry('d_nitro', 'Discord Nitro', '', 150, 'digital_nitro', 'Discord Nitro - 150 UAH', 'nitro')
+    return OrderIntake({entry.key: entry}, SECRET)
+
+@pytest.mark.parametrize('item', [
+    {'sku': ['d_nitro']},
+    {'sku': {'key': 'd_nitro'}},
+    {'sku': 'missing'},
+    'd_nitro',
+])
+def test_unknown_sku_is_rejected(item):
+    with pytest.raises(IntakeError, match='unknown sku'):
+        make_intake().parse({'order_id': 'W1', 'items': [item]})
+
+@pytest.mark.parametrize('quantity', [True, False, 0, 101, 1.0, '1'])
+def test_invalid_quantity_is_rejected(quantity):
+    with pytest.raises(IntakeError, match='quantity'):
+        make_intake().parse({'order_id': 'W1', 'items': [{'sku': 'd_nitro', 'quantity': quantity}]})
+
+def test_parse_uses_catalog_price():
+    order_id, line_items, total = make_intake().parse({'order_id': 'W1', 'items': [{'sku': 'd_nitro', 'quantity': 2}]})
+    assert order_id == 'W1'
+    assert line_items == [{'sku': 'd_nitro', 'name': 'Discord Nitro', 'quantity': 2, 'price_uah': 150}]
+    assert total == 300
+
+def test_replay_returns_stored_order(monkeypatch):
+    # В БД уже есть W1 на 150 UAH: повтор с другим составом получает сохранённые токен и сумму
+    monkeypatch.setattr(db, 'insert_web_orders', lambda orders: {'W1': ('stored-token', 150)})
+    order_intake = make_intake()
+    order_intake.start('test_bot')
+    body = json.dumps({'order_id': 'W1', 'items': [{'sku': 'd_nitro', 'quantity': 3}]}).encode('utf-8')
+    timestamp = str(int(time.time()))
+    headers = {'X-Timestamp': timestamp, 'X-Signature': intake.sign(SECRET, timestamp, body)}
+    code, response = order_intake.handle(body, headers)
+    assert code == 201
+    assert response['token'] == 'stored-token'
+    assert response['total_uah'] == 150
+
+def test_duplicate_in_batch_gets_first_order(monkeypatch):
+    saved = []
+
+    def insert_web_orders(orders):
+        saved.extend(orders)
+        return {order_id: (token, total) for token, order_id, _, total in orders}
+
+    monkeypatch.setattr(db, 'insert_web_orders', insert_web_orders)
+    first, second = Future(), Future()
+    make_intake()._commit_batch([
+        ('t1', 'W1', [], 150, first),
+        ('t2', 'W1', [], 450, second),
+    ])
+    assert len(saved) == 1
+    assert first.result() == second.result() == ('t1', 150)
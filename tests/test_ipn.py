@@ -0,0 +1,93 @@
+# tests/test_ipn.py - Обработка IPN-уведомлений (ipn.IPNProcessor) без HTTP и без БД
+#
+#   python -m pytest -q tests
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ipn import IPNProcessor
+
+class Texts:
+    def text(self, key, **kwargs):
+        return key
+
+class Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+def make_payload(**fields):
+    payload = {
+        'payment_id': 5000000001,
+        'payment_status': 'finished',
+        'order_id': 'T-1',
+        'price_amount': 150,
+        'price_currency': 'uah',
+        'pay_amount': 3.5,
+        'actually_paid': 3.5,
+        'pay_currency': 'usdttrc20',
+    }
+    payload.update(fields)
+    return payload
+
+def run(update_order_status, *payloads):
+    """Запускает обработчик, прогоняет payloads из HTTP-потока и возвращает (ответы, отправленные сообщения)."""
+    async def main():
+        bot = Bot()
+        processor = IPNProcessor(update_order_status, lambda user_id: Texts(), Texts(), workers=1)
+        processor.start(bot, [1])
+        responses = []
+        for payload in payloads:
+            responses.append(await asyncio.to_thread(processor.handle, payload))
+        while processor.pending():
+            await asyncio.sleep(0.01)
+        await processor.stop()
+        return responses, bot.sent, processor.stats()
+    return asyncio.run(main())
+
+def test_payment_id_required():
+    calls = []
+    responses, _, stats = run(lambda *args: calls.append(args), make_payload(payment_id=None))
+    assert responses == [(400, {'error': 'payment_id and order_id are required'})]
+    assert calls == []
+    assert stats['invalid'] == 1
+
+def test_storage_error_is_retried():
+    attempts = []
+
+    def update_order_status(*args):
+        attempts.append(args)
+        if len(attempts) == 1:
+            raise ConnectionError("БД недоступна")
+        return 'matched', {'user_id': 42, 'order_id': 'T-1', 'total_uah': 150, 'status': 'finished'}
+
+    responses, sent, _ = run(update_order_status, make_payload(), make_payload(), make_payload())
+    # Ошибка записи - 5xx и без отметки о дубликате; повтор провайдера проходит, следующий - дубликат
+    assert [code for code, _ in responses] == [500, 200, 200]
+    assert responses[2][1] == {'status': 'duplicate'}
+    assert len(attempts) == 2
+    assert sent == [(42, 'payment.received'), (1, 'staff.order_paid')]
+
+def test_underpaid_is_not_finished():
+    statuses = []
+
+    def update_order_status(payment_id, order_id, total_uah, status, allowed_from, max_age_days):
+        statuses.append((order_id, total_uah, status))
+        return 'matched', {'user_id': 42, 'order_id': order_id, 'total_uah': total_uah, 'status': status}
+
+    responses, sent, _ = run(update_order_status, make_payload(actually_paid=1.0))
+    assert responses == [(200, {'status': 'processed'})]
+    assert statuses == [('T-1', 150, 'partially_paid')]
+    assert sent == [(1, 'staff.payment_unmatched')]
+
+def test_amount_mismatch_is_not_applied():
+    calls = []
+    responses, sent, stats = run(lambda *args: calls.append(args),
+                                 make_payload(price_amount=10, price_currency='usd'))
+    assert responses == [(200, {'status': 'processed'})]
+    assert calls == []
+    assert stats['unmatched'] == 1
+    assert sent == [(1, 'staff.payment_unmatched')]
@@ -0,0 +1,30 @@
+# tests/test_jobs.py - Пул процессов отчётов (jobs.JobManager) переживает падение воркера
+#
+#   python -m pytest -q tests
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from jobs import JobContext, JobManager
+
+def crash_once(marker):
+    # Уровень модуля: функция передаётся в воркер по имени
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return os.getpid()
+
+def test_pool_recreated_after_worker_crash(tmp_path):
+    async def main():
+        manager = JobManager(workers=1)
+        ctx = JobContext(manager, None)
+        try:
+            first_pool = manager.process_pool()
+            pid = await ctx.run_cpu(crash_once, str(tmp_path / 'crashed'))
+            assert manager.process_pool() is not first_pool
+            assert pid != os.getpid()
+            assert manager.stats()['pool_restarts'] == 1
+        finally:
+            await manager.shutdown()
+    asyncio.run(main())
@@ -0,0 +1,61 @@
+# tests/test_spool.py - Воспроизведение локального журнала записей (spool.py)
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from spool import WriteSpool
+
+class Unavailable(Exception):
+    """Временная ошибка: БД недоступна."""
+
+class FakeDatabase:
+    def __init__(self, fail=None):
+        self.applied = []
+        # message -> исключение, которое бросает apply для записи с этим текстом
+        self.fail = fail or {}
+
+    def apply(self, record):
+        error = self.fail.get(record['data']['message'])
+        if error is not None:
+            raise error
+        self.applied.append(record['data']['message'])
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = WriteSpool(str(tmp_path / 'writes.log'))
+    for message in ('a', 'b', 'c'):
+        spool.append('question', {'message': message})
+    return spool
+
+def test_replay_applies_all_and_removes_file(spool):
+    db = FakeDatabase()
+    assert spool.replay(db.apply, Unavailable) == 3
+    assert db.applied == ['a', 'b', 'c']
+    assert not spool.has_pending()
+    assert spool.stats()['replayed'] == 3
+
+def test_transient_error_keeps_only_unapplied_records(spool):
+    db = FakeDatabase({'b': Unavailable("нет соединения")})
+    with pytest.raises(Unavailable):
+        spool.replay(db.apply, Unavailable)
+    assert db.applied == ['a']
+    assert [r['data']['message'] for r in WriteSpool.read_records(spool.replay_path)] == ['b', 'c']
+    # Новые записи не смешиваются с воспроизводимым файлом
+    spool.append('question', {'message': 'd'})
+    db.fail.clear()
+    assert spool.replay(db.apply, Unavailable) == 2
+    assert db.applied == ['a', 'b', 'c']
+    assert spool.replay(db.apply, Unavailable) == 1
+    assert db.applied == ['a', 'b', 'c', 'd']
+    assert not spool.has_pending()
+
+def test_permanent_error_moves_record_to_dead_letter(spool):
+    db = FakeDatabase({'a': ValueError("Неизвестный тип записи журнала")})
+    assert spool.replay(db.apply, Unavailable) == 2
+    assert db.applied == ['b', 'c']
+    assert not spool.has_pending()
+    assert spool.stats()['dead_lettered'] == 1
+    dead = list(WriteSpool.read_records(spool.dead_letter_path))
+    assert [r['data']['message'] for r in dead] == ['a']
+    assert dead[0]['error'].startswith('ValueError')
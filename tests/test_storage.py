@@ -0,0 +1,147 @@
+# tests/test_storage.py - Одинаковое поведение хранилищ SQLite и Postgres (storage.py)
+#
+#   python -m pytest -q tests
+# Вариант postgres запускается, только если DATABASE_URL указывает на PostgreSQL
+# (таблицы создаются через init_schema, проверяются приращения, а не абсолютные значения).
+import os
+import sys
+import uuid
+from types import SimpleNamespace
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import spool
+import storage
+from config import DATABASE_URL
+from ipn import allowed_previous_statuses
+
+POSTGRES_URL = DATABASE_URL if DATABASE_URL and DATABASE_URL.startswith(('postgres://', 'postgresql://')) else None
+
+# Одно хранилище на модуль: PostgresStore.close() закрывает общие пулы db.py
+@pytest.fixture(scope='module', params=['sqlite', 'postgres'])
+def store(request, tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp(request.param)
+    if request.param == 'sqlite':
+        url = f"sqlite:///{tmp_path / 'bot.db'}"
+    elif POSTGRES_URL:
+        url = POSTGRES_URL
+    else:
+        pytest.skip("DATABASE_URL не указывает на PostgreSQL")
+    store = storage.create_store(url, spool.WriteSpool(str(tmp_path / 'spool.log')))
+    assert store.name == request.param
+    store.init_schema()
+    yield store
+    store.close()
+
+def make_user(**fields):
+    # Уникальный id: в общей БД Postgres тесты не пересекаются с уже записанными данными
+    user = {
+        'id': uuid.uuid4().int % 10**12,
+        'username': 'tester',
+        'first_name': 'Test',
+        'last_name': None,
+        'language_code': 'uk',
+        'is_bot': False,
+    }
+    user.update(fields)
+    return SimpleNamespace(**user)
+
+def test_save_user(store):
+    users = store.count_users()
+    user = make_user()
+    assert store.save_user(user) is True
+    # Повторное сохранение - upsert, а не новая строка
+    assert store.save_user(make_user(id=user.id, username='renamed')) is True
+    assert store.count_users() == users + 1
+
+def test_place_order_updates_stats(store):
+    before = store.get_stats()
+    orders = store.count_orders()
+    order_ref = store.place_order(make_user(), f"T-{uuid.uuid4().hex[:8]}", "Netflix Premium 1 міс.", 450,
+                                  [("Netflix Premium 1 міс.", 1, 300), ("Discord Nitro", 1, 150)])
+    assert order_ref
+    assert store.count_orders() == orders + 1
+    after = store.get_stats()
+    assert after['total_orders'] == before['total_orders'] + 1
+    assert after['total_questions'] == before['total_questions']
+
+def test_get_stats_counts_questions(store):
+    before = store.get_stats()
+    user = make_user()
+    store.save_user(user)
+    store.save_question(user.id, "Коли буде поповнення?")
+    store.increment_questions()
+    after = store.get_stats()
+    assert after['total_questions'] == before['total_questions'] + 1
+    assert after['total_orders'] == before['total_orders']
+
+def test_update_order_status(store):
+    user = make_user()
+    order_id = f"T-{uuid.uuid4().hex[:8]}"
+    payment_id = uuid.uuid4().hex[:12]
+    finished = allowed_previous_statuses('finished')
+    store.place_order(user, order_id, "Discord Nitro", 150, [("Discord Nitro", 1, 150)])
+    # Сумма не совпадает - платёж не привязывается
+    assert store.update_order_status(payment_id, order_id, 999, 'finished', finished, 30) == ('not_found', None)
+    match, order = store.update_order_status(payment_id, order_id, 150, 'finished', finished, 30)
+    assert match == 'matched'
+    assert order['user_id'] == user.id
+    assert order['order_id'] == order_id
+    assert order['total_uah'] == 150
+    assert order['status'] == 'finished'
+    # Повторное уведомление о том же статусе ничего не меняет
+    assert store.update_order_status(payment_id, order_id, 150, 'finished', finished, 30) == ('matched', None)
+    assert store.update_order_status(uuid.uuid4().hex[:12], 'missing', 150, 'finished', finished, 30) == ('not_found', None)
+
+def test_update_order_status_ambiguous(store):
+    # order_id бота не уникален: два одинаковых непривязанных заказа не угадываются
+    order_id = f"T-{uuid.uuid4().hex[:8]}"
+    for _ in range(2):
+        store.place_order(make_user(), order_id, "Discord Nitro", 150, [("Discord Nitro", 1, 150)])
+    result = store.update_order_status(uuid.uuid4().hex[:12], order_id, 150, 'finished',
+                                       allowed_previous_statuses('finished'), 30)
+    assert result == ('ambiguous', None)
+
+def test_postgres_order_spooled_only_when_not_written(tmp_path, monkeypatch):
+    import db
+    import psycopg
+    write_spool = spool.WriteSpool(str(tmp_path / 'spool.log'))
+    store = storage.PostgresStore(write_spool)
+    line_items = [("Discord Nitro", 1, 150)]
+
+    def fail_with(error):
+        def place_order(*args):
+            raise error
+        monkeypatch.setattr(db, 'place_order', place_order)
+
+    # Запрос не отправлялся или БД отвергла транзакцию - заказ в журнале
+    for error in (db.DatabaseUnavailable("нет соединения"), psycopg.errors.DataError("bad value")):
+        fail_with(error)
+        assert store.place_order(make_user(), "T-1", "Discord Nitro", 150, line_items) is None
+    assert write_spool.stats()['appended'] == 2
+    # Обрыв во время транзакции: заказ мог записаться - повтор из журнала задублировал бы его
+    fail_with(psycopg.OperationalError("server closed the connection unexpectedly"))
+    with pytest.raises(psycopg.OperationalError):
+        store.place_order(make_user(), "T-1", "Discord Nitro", 150, line_items)
+    assert write_spool.stats()['appended'] == 2
+
+def test_sqlite_schema_migrates_existing_file(tmp_path):
+    import sqlite3
+    path = tmp_path / 'old.db'
+    # Файл, созданный до появления orders.payment_id
+    with sqlite3.connect(path) as conn:
+        conn.execute("""
+            CREATE TABLE orders (
+                id INTEGER PRIMARY KEY, user_id INTEGER, order_id TEXT, items TEXT,
+                total_uah INTEGER, status TEXT DEFAULT 'created', created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.execute("INSERT INTO orders (user_id, order_id, items, total_uah) VALUES (1, 'OLD-1', 'Discord Nitro', 150)")
+    store = storage.create_store(f"sqlite:///{path}", spool.WriteSpool(str(tmp_path / 'spool.log')))
+    try:
+        store.init_schema()
+        match, order = store.update_order_status('P-1', 'OLD-1', 150, 'finished', allowed_previous_statuses('finished'), 30)
+        assert match == 'matched'
+        assert order['status'] == 'finished'
+    finally:
+        store.close()
@@ -0,0 +1,109 @@
+# throttle.py - Защита от флуда: token bucket на пользователя
+import os
+import time
+import logging
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# (скорость в токенах/с, ёмкость) для каждого типа апдейтов
+FLOOD_BUDGETS = {
+    'message': (float(os.environ.get('FLOOD_MESSAGE_RATE', 1)), int(os.environ.get('FLOOD_MESSAGE_BURST', 5))),
+    'callback': (float(os.environ.get('FLOOD_CALLBACK_RATE', 3)), int(os.environ.get('FLOOD_CALLBACK_BURST', 10))),
+    'pay': (float(os.environ.get('FLOOD_PAY_RATE', 0.1)), int(os.environ.get('FLOOD_PAY_BURST', 3))),
+}
+FLOOD_IDLE_TTL = 600
+FLOOD_SWEEP_INTERVAL = 60
+
+class UserRateLimiter:
+    """
+    Token bucket на пользователя. Хранит только [токены, время, предупреждён]
+    на user_id и удаляет записи, простаивающие дольше idle_ttl.
+    """
+
+    def __init__(self, rate, burst, idle_ttl=FLOOD_IDLE_TTL):
+        self.rate = rate
+        self.burst = burst
+        self.idle_ttl = idle_ttl
+        self._buckets = {}
+        self._last_sweep = time.monotonic()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, user_id, now=None):
+        """
+        Возвращает (разрешено, нужно_предупредить). Предупреждение выдаётся
+        один раз, пока пользователь не перестанет превышать лимит.
+        """
+        now = now if now is not None else time.monotonic()
+        if now - self._last_sweep > FLOOD_SWEEP_INTERVAL:
+            self.evict_idle(now)
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            self._buckets[user_id] = [self.burst - 1.0, now, False]
+            return True, False
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return True, False
+        self.dropped += 1
+        warn = not bucket[2]
+        bucket[2] = True
+        return False, warn
+
+    def evict_idle(self, now=None):
+        now = now if now is not None else time.monotonic()
+        cutoff = now - self.idle_ttl
+        stale = [user_id for user_id, bucket in self._buckets.items() if bucket[1] < cutoff]
+        for user_id in stale:
+            del self._buckets[user_id]
+        self._last_sweep = now
+        return len(stale)
+
+class FloodGuard:
+    """
+    Проверяет лимиты до любых обращений к БД и Bot API (группа обработчиков -1).
+    texts(user) - тексты на языке пользователя (i18n.LocaleBundle) для предупреждений.
+    """
+
+    def __init__(self, texts, exempt_ids=(), budgets=FLOOD_BUDGETS):
+        self.texts = texts
+        self.exempt_ids = set(exempt_ids)
+        self.limiters = {kind: UserRateLimiter(rate, burst) for kind, (rate, burst) in budgets.items()}
+
+    def stats(self):
+        return {kind: {'tracked': len(l), 'dropped': l.dropped} for kind, l in self.limiters.items()}
+
+    @staticmethod
+    def classify(update):
+        if update.callback_query:
+            return 'callback'
+        message = update.message
+        if message and message.text:
+            return 'pay' if message.text.startswith('/pay') else 'message'
+        return None
+
+    async def __call__(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        user = update.effective_user
+        kind = self.classify(update)
+        if not user or not kind or user.id in self.exempt_ids:
+            return
+        allowed, warn = self.limiters[kind].allow(user.id)
+        if allowed:
+            return
+        if warn:
+            logger.warning(f"🚦 Флуд от пользователя {user.id} ({kind}), апдейты отбрасываются")
+        try:
+            if kind == 'callback':
+                # На каждый отброшенный callback нужен ответ, иначе клиент крутит индикатор до таймаута
+                await update.callback_query.answer(self.texts(user).text('flood.callback') if warn else None)
+            elif warn:
+                await update.message.reply_text(self.texts(user).text('flood.message'))
+        except Exception as e:
+            logger.debug(f"Не удалось ответить на отброшенный апдейт {user.id}: {e}")
+        raise ApplicationHandlerStop